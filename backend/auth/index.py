@@ -2,186 +2,128 @@
 API для авторизации пользователей: регистрация по телефону, вход, управление сессиями
 """
 import json
-import os
-import psycopg2
 from datetime import datetime
+from db_pool import get_pool
+from user_cache import user_cache
+import runtime
+import tracing
 
 def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+    """Соединение из пула процесса"""
+    return get_pool().getconn()
+
+def release_db_connection(conn):
+    """Возврат соединения в пул, незавершённая транзакция откатывается"""
+    get_pool().putconn(conn)
 
 def get_schema():
     """Получение имени схемы"""
-    return os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return runtime.get_schema()
 
-def handler(event: dict, context) -> dict:
-    """Обработчик запросов авторизации"""
-    method = event.get('httpMethod', 'GET')
+router = runtime.Router()
+
+@router.route('GET')
+def get_user(event: dict, conn, cur) -> dict:
+    """Получение данных пользователя"""
+    user_id = event.get('queryStringParameters', {}).get('user_id')
     
-    # CORS preflight
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not user_id:
+        return runtime.error(400, 'user_id обязателен')
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    schema = get_schema()
+    with tracing.span('user'):
+        user = user_cache.get_by_id(cur, schema, user_id)
     
-    try:
-        if method == 'POST':
-            # Регистрация или вход по телефону
-            body = json.loads(event.get('body', '{}'))
-            phone = body.get('phone', '').strip()
-            first_name = body.get('first_name', '').strip()
-            last_name = body.get('last_name', '').strip()
-            
-            if not phone:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Телефон обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            # Проверяем существует ли пользователь
-            schema = get_schema()
-            cur.execute(f"SELECT id, phone, first_name, last_name, yandex_id, ai_responses_enabled FROM {schema}.users WHERE phone = %s", (phone,))
-            user = cur.fetchone()
-            
-            if user:
-                # Пользователь существует - вход
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user_id': user[0],
-                        'phone': user[1],
-                        'first_name': user[2],
-                        'last_name': user[3],
-                        'yandex_connected': user[4] is not None,
-                        'ai_responses_enabled': user[5],
-                        'message': 'Вход выполнен'
-                    }),
-                    'isBase64Encoded': False
-                }
-            else:
-                # Новый пользователь - регистрация
-                cur.execute(
-                    f"INSERT INTO {schema}.users (phone, first_name, last_name) VALUES (%s, %s, %s) RETURNING id",
-                    (phone, first_name, last_name)
-                )
-                user_id = cur.fetchone()[0]
-                conn.commit()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user_id': user_id,
-                        'phone': phone,
-                        'first_name': first_name,
-                        'last_name': last_name,
-                        'yandex_connected': False,
-                        'ai_responses_enabled': False,
-                        'message': 'Регистрация успешна'
-                    }),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET':
-            # Получение данных пользователя
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            schema = get_schema()
+    if not user:
+        return runtime.error(404, 'Пользователь не найден')
+    
+    return runtime.json_response(200, {
+        'user_id': user['id'],
+        'phone': user['phone'],
+        'first_name': user['first_name'],
+        'last_name': user['last_name'],
+        'yandex_connected': user['yandex_id'] is not None,
+        'yandex_email': user['yandex_email'],
+        'ai_responses_enabled': user['ai_responses_enabled']
+    })
+
+@router.route('POST')
+def sign_in(event: dict, conn, cur) -> dict:
+    """Регистрация или вход по телефону"""
+    body = json.loads(event.get('body', '{}'))
+    phone = body.get('phone', '').strip()
+    first_name = body.get('first_name', '').strip()
+    last_name = body.get('last_name', '').strip()
+    
+    if not phone:
+        return runtime.error(400, 'Телефон обязателен')
+    
+    # Повторный вход из кэша — без обращения к базе
+    user = user_cache.cached_by_phone(phone)
+    created = False
+    
+    if user is None:
+        # Вход или регистрация одним INSERT ... ON CONFLICT
+        schema = get_schema()
+        with tracing.span('upsert'):
+            user, created = user_cache.upsert(cur, schema, 'phone', {
+                'phone': phone,
+                'first_name': first_name,
+                'last_name': last_name
+            })
+        with tracing.span('commit'):
+            conn.commit()
+        user_cache.put(user)
+    
+    return runtime.json_response(201 if created else 200, {
+        'user_id': user['id'],
+        'phone': user['phone'],
+        'first_name': user['first_name'],
+        'last_name': user['last_name'],
+        'yandex_connected': user['yandex_id'] is not None,
+        'ai_responses_enabled': user['ai_responses_enabled'],
+        'message': 'Регистрация успешна' if created else 'Вход выполнен'
+    })
+
+@router.route('PUT')
+def update_settings(event: dict, conn, cur) -> dict:
+    """Обновление настроек пользователя"""
+    body = json.loads(event.get('body', '{}'))
+    user_id = body.get('user_id')
+    ai_responses_enabled = body.get('ai_responses_enabled')
+    
+    if not user_id:
+        return runtime.error(400, 'user_id обязателен')
+    
+    if ai_responses_enabled is not None:
+        schema = get_schema()
+        with tracing.span('update'):
             cur.execute(
-                f"SELECT id, phone, first_name, last_name, yandex_id, yandex_email, ai_responses_enabled FROM {schema}.users WHERE id = %s",
-                (user_id,)
+                f"UPDATE {schema}.users SET ai_responses_enabled = %s, updated_at = %s WHERE id = %s",
+                (ai_responses_enabled, datetime.now(), user_id)
             )
-            user = cur.fetchone()
-            
-            if not user:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь не найден'}),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'user_id': user[0],
-                    'phone': user[1],
-                    'first_name': user[2],
-                    'last_name': user[3],
-                    'yandex_connected': user[4] is not None,
-                    'yandex_email': user[5],
-                    'ai_responses_enabled': user[6]
-                }),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT':
-            # Обновление настроек пользователя
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('user_id')
-            ai_responses_enabled = body.get('ai_responses_enabled')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            if ai_responses_enabled is not None:
-                schema = get_schema()
-                cur.execute(
-                    f"UPDATE {schema}.users SET ai_responses_enabled = %s, updated_at = %s WHERE id = %s",
-                    (ai_responses_enabled, datetime.now(), user_id)
-                )
-                conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Настройки обновлены'}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+            user_cache.invalidate(cur, user_id)
+        with tracing.span('commit'):
+            conn.commit()
     
+    return runtime.json_response(200, {'message': 'Настройки обновлены'})
+
+@tracing.traced('auth')
+def handler(event: dict, context) -> dict:
+    """Обработчик запросов авторизации"""
+    route = router.get(event)
+    if route is None:
+        return router.reject(event)
+    
+    with tracing.span('db_checkout'):
+        conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        return route(event, conn, cur)
     except Exception as e:
         conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return runtime.error(500, str(e))
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
@@ -0,0 +1,173 @@
+"""
+Трассировка запросов: этапы по монотонным таймерам, request id, JSON-логи и заголовок Server-Timing
+"""
+import contextvars
+import functools
+import json
+import os
+import random
+import time
+
+import runtime
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class _NullSpan:
+    """Этап в невыбранном запросе: ничего не замеряет"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, trace, name: str):
+        self.trace = trace
+        self.name = name
+        self.started = 0.0
+        self.attrs = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.record(self.name, self.started, time.monotonic(), error=exc_type is not None, attrs=self.attrs)
+        return False
+
+    def set(self, **attrs) -> None:
+        """Поля этапа в JSON-логе трассировки: with span('normalize') as s: s.set(width=...)"""
+        self.attrs = dict(self.attrs or {}, **attrs)
+
+
+class Trace:
+    """Этапы одного вызова функции"""
+
+    def __init__(self, function: str, request_id: str, sampled: bool):
+        self.function = function
+        self.request_id = request_id
+        self.sampled = sampled
+        self.started = time.monotonic()
+        self.spans = []
+
+    def span(self, name: str):
+        return Span(self, name) if self.sampled else _NULL_SPAN
+
+    def record(self, name: str, started: float, ended: float, error: bool = False, attrs: dict = None) -> None:
+        entry = {
+            'name': name,
+            'start_ms': round((started - self.started) * 1000, 2),
+            'duration_ms': round((ended - started) * 1000, 2),
+            'error': error
+        }
+        if attrs:
+            entry['attrs'] = attrs
+        # append атомарен: этапы из потоков пакетной обработки пишутся без блокировки
+        self.spans.append(entry)
+
+    def timings(self) -> dict:
+        """Суммарная длительность по именам этапов"""
+        totals = {}
+        for span in self.spans:
+            totals[span['name']] = round(totals.get(span['name'], 0.0) + span['duration_ms'], 2)
+        return totals
+
+    def server_timing(self, total_ms: float) -> str:
+        parts = [f'{name};dur={duration}' for name, duration in self.timings().items()]
+        parts.append(f'total;dur={total_ms}')
+        return ', '.join(parts)
+
+    def log(self, status: int, total_ms: float, error: str = None) -> None:
+        entry = {
+            'request_id': self.request_id,
+            'function': self.function,
+            'status': status,
+            'total_ms': total_ms,
+            'spans': self.spans
+        }
+        if error:
+            entry['error'] = error
+        print(json.dumps({'trace': entry}, ensure_ascii=False))
+
+
+def span(name: str):
+    """Этап текущего запроса: with span('vision'): ..."""
+    trace = _current.get()
+    return trace.span(name) if trace is not None else _NULL_SPAN
+
+
+def bind(fn):
+    """Функция для пула потоков, пишущая этапы в трассировку вызывающего запроса"""
+    trace = _current.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def get_request_id(event: dict, context) -> str:
+    """X-Request-Id клиента, id вызова из контекста платформы или новый"""
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'x-request-id' and value:
+            return str(value)[:128]
+    # 128 случайных бит в hex, как uuid4().hex, без импорта uuid
+    return str(getattr(context, 'request_id', '') or os.urandom(16).hex())
+
+
+def is_sampled(event: dict) -> bool:
+    """TRACE_SAMPLE_RATE — доля трассируемых запросов; заголовок X-Trace: 1 включает трассировку для запроса"""
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'x-trace' and value == '1':
+            return True
+    rate = float(runtime.setting('TRACE_SAMPLE_RATE', 0.1))
+    return rate >= 1 or random.random() < rate
+
+
+def traced(function: str):
+    """Обёртка обработчика: трассировка, X-Request-Id в ответе, Server-Timing при TRACE_SERVER_TIMING=1.
+    Ошибки 5xx попадают в лог и без выборки, первый вызов процесса — отдельной записью cold_start"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event: dict, context) -> dict:
+            init_ms = runtime.take_cold_start()
+            trace = Trace(function, get_request_id(event, context), is_sampled(event))
+            token = _current.set(trace)
+            try:
+                response = handler(event, context)
+            except Exception as e:
+                trace.log(500, round((time.monotonic() - trace.started) * 1000, 2), error=str(e))
+                raise
+            finally:
+                _current.reset(token)
+
+            total_ms = round((time.monotonic() - trace.started) * 1000, 2)
+            status = response.get('statusCode', 200)
+            headers = dict(response.get('headers') or {})
+            headers['X-Request-Id'] = trace.request_id
+            if trace.sampled and runtime.setting('TRACE_SERVER_TIMING') == '1':
+                headers['Server-Timing'] = trace.server_timing(total_ms)
+                headers['Timing-Allow-Origin'] = '*'
+            response['headers'] = headers
+            if trace.sampled or status >= 500:
+                trace.log(status, total_ms)
+            if init_ms is not None:
+                print(json.dumps({'cold_start': {
+                    'function': function, 'request_id': trace.request_id, 'init_ms': init_ms, 'first_request_ms': total_ms
+                }}))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,174 @@
+"""
+Read-through кэш записей users по id, телефону и yandex_id.
+Записи живут USER_CACHE_TTL; изменение всегда уходит NOTIFY, и читающие кэш функции
+(auth, scan, yandex-oauth развёрнуты отдельно) вытесняют запись через LISTEN на одном соединении на процесс.
+С USER_CACHE_LISTEN=0 чужие изменения не видны, поэтому кэш выключен, если USER_CACHE_TTL не задан явно
+"""
+import threading
+import time
+from typing import Optional
+
+import runtime
+
+psycopg2 = runtime.lazy_import('psycopg2')
+
+CHANNEL = 'user_cache'
+USER_COLUMNS = ('id', 'phone', 'first_name', 'last_name', 'yandex_id', 'yandex_email', 'ai_responses_enabled')
+
+
+class UserCache:
+    """Записи пользователей с временем жизни и вторичными ключами phone/yandex_id"""
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 10000, listen: bool = True):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.listen = listen
+        self._records = {}
+        self._by_phone = {}
+        self._by_yandex_id = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _sync(self) -> None:
+        """Применение уведомлений об изменениях от других экземпляров; без обращения к серверу.
+        Слушатель один на процесс: поток, не успевший взять блокировку, обходится без синхронизации"""
+        if not self.listen or not self._listener_lock.acquire(blocking=False):
+            return
+        try:
+            self._sync_locked()
+        finally:
+            self._listener_lock.release()
+
+    def _sync_locked(self) -> None:
+        try:
+            if self._listener is None or self._listener.closed:
+                self._listener = psycopg2.connect(runtime.setting('DATABASE_URL'))
+                self._listener.autocommit = True
+                with self._listener.cursor() as cur:
+                    cur.execute(f'LISTEN {CHANNEL}')
+                # Пока слушателя не было, изменения могли пройти мимо
+                self.clear()
+                return
+            self._listener.poll()
+            while self._listener.notifies:
+                notify = self._listener.notifies.pop(0)
+                if notify.payload.isdigit():
+                    self.evict(int(notify.payload))
+                else:
+                    self.clear()
+        except psycopg2.Error:
+            if self._listener is not None:
+                self._listener.close()
+            self._listener = None
+            self.clear()
+
+    def _get(self, index: Optional[dict], key) -> Optional[dict]:
+        self._sync()
+        with self._lock:
+            user_id = key if index is None else index.get(key)
+            record = self._records.get(user_id) if user_id is not None else None
+            if record is None or record[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return record[1]
+
+    def put(self, user: dict) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if len(self._records) >= self.max_size:
+                self._clear_locked()
+            self._drop_locked(user['id'])
+            self._records[user['id']] = (time.monotonic() + self.ttl, user)
+            self._by_phone[user['phone']] = user['id']
+            if user['yandex_id']:
+                self._by_yandex_id[user['yandex_id']] = user['id']
+
+    def _drop_locked(self, user_id: int) -> None:
+        record = self._records.pop(user_id, None)
+        if record is not None:
+            self._by_phone.pop(record[1]['phone'], None)
+            self._by_yandex_id.pop(record[1]['yandex_id'], None)
+
+    def _clear_locked(self) -> None:
+        self._records.clear()
+        self._by_phone.clear()
+        self._by_yandex_id.clear()
+
+    def evict(self, user_id: int) -> None:
+        with self._lock:
+            self._drop_locked(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+
+    def _load(self, cur, schema: str, column: str, value) -> Optional[dict]:
+        cur.execute(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM {schema}.users WHERE {column} = %s",
+            (value,)
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        user = dict(zip(USER_COLUMNS, row))
+        self.put(user)
+        return user
+
+    def get_by_id(self, cur, schema: str, user_id) -> Optional[dict]:
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        return self._get(None, user_id) or self._load(cur, schema, 'id', user_id)
+
+    def get_by_phone(self, cur, schema: str, phone: str) -> Optional[dict]:
+        return self._get(self._by_phone, phone) or self._load(cur, schema, 'phone', phone)
+
+    def get_by_yandex_id(self, cur, schema: str, yandex_id: str) -> Optional[dict]:
+        return self._get(self._by_yandex_id, yandex_id) or self._load(cur, schema, 'yandex_id', yandex_id)
+
+    def cached_by_phone(self, phone: str) -> Optional[dict]:
+        """Только кэш, без запроса к базе"""
+        return self._get(self._by_phone, phone)
+
+    def cached_by_yandex_id(self, yandex_id: str) -> Optional[dict]:
+        return self._get(self._by_yandex_id, yandex_id)
+
+    def upsert(self, cur, schema: str, key: str, values: dict) -> tuple:
+        """
+        Вход или регистрация одним оператором: (запись, создана ли).
+        При конфликте по key холостой UPDATE блокирует и возвращает существующую строку,
+        поэтому одновременные первые входы не падают на уникальном индексе; xmax = 0
+        только у строки, вставленной этим оператором. В кэш запись кладёт вызывающий после коммита
+        """
+        columns = ', '.join(values)
+        placeholders = ', '.join(['%s'] * len(values))
+        cur.execute(
+            f"""
+            INSERT INTO {schema}.users ({columns}) VALUES ({placeholders})
+            ON CONFLICT ({key}) DO UPDATE SET {key} = EXCLUDED.{key}
+            RETURNING {', '.join(USER_COLUMNS)}, (xmax = 0) AS inserted
+            """,
+            tuple(values.values())
+        )
+        row = cur.fetchone()
+        return dict(zip(USER_COLUMNS, row[:-1])), row[-1]
+
+    def invalidate(self, cur, user_id: int) -> None:
+        """Вытеснение записи здесь и после коммита транзакции cur во всех слушающих экземплярах"""
+        self.evict(int(user_id))
+        cur.execute('SELECT pg_notify(%s, %s)', (CHANNEL, str(user_id)))
+
+
+# Живёт между тёплыми вызовами функции
+_listen = runtime.setting('USER_CACHE_LISTEN', '1') == '1'
+user_cache = UserCache(
+    ttl=float(runtime.setting('USER_CACHE_TTL', 60 if _listen else 0)),
+    max_size=int(runtime.setting('USER_CACHE_MAX_SIZE', 10000)),
+    listen=_listen
+)
@@ -0,0 +1,146 @@
+"""
+Выгрузка истории сканирований в CSV или NDJSON: строки читаются серверным курсором
+порциями и сразу пишутся в gzip-файл на диске, в памяти — только текущая порция.
+Готовый файл уходит в хранилище кадров (ответ — редирект на него), без хранилища — в тело ответа.
+Число строк ограничено EXPORT_MAX_ROWS
+"""
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+import runtime
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+COLUMNS = ('id', 'created_at', 'title', 'category', 'confidence', 'description', 'recognizer', 'image_url')
+_SELECT = 'id, created_at, title, category, confidence, ai_response, recognizer, image_url'
+
+
+class InvalidExportRequest(Exception):
+    """Неизвестный формат или некорректный фильтр"""
+
+
+class ExportTooLarge(Exception):
+    """Под фильтры попадает больше EXPORT_MAX_ROWS строк"""
+
+
+def get_export_limits() -> tuple:
+    """Потолок строк одной выгрузки и размер порции серверного курсора"""
+    return int(runtime.setting('EXPORT_MAX_ROWS', 100000)), int(runtime.setting('EXPORT_ITERSIZE', 1000))
+
+
+def _parse_date(value: Optional[str], end: bool) -> Optional[datetime]:
+    """ISO-дата или дата-время; граница 'to' без времени включает весь день"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError as e:
+        raise InvalidExportRequest(f'Некорректная дата: {value}') from e
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def parse_export_params(params: dict) -> dict:
+    fmt = params.get('export')
+    if fmt not in FORMATS:
+        raise InvalidExportRequest(f"Формат выгрузки: {', '.join(FORMATS)}")
+    return {
+        'format': fmt,
+        'from': _parse_date(params.get('from'), end=False),
+        'to': _parse_date(params.get('to'), end=True),
+        'category': params.get('category') or None
+    }
+
+
+def write_export(conn, schema: str, user_id, options: dict, path: str) -> int:
+    """Выгрузка в gzip-файл path; число строк. Курсор с именем живёт на сервере, itersize — размер порции"""
+    max_rows, itersize = get_export_limits()
+    conditions = ['user_id = %s']
+    values = [user_id]
+    if options['from']:
+        conditions.append('created_at >= %s')
+        values.append(options['from'])
+    if options['to']:
+        conditions.append('created_at < %s')
+        values.append(options['to'])
+    if options['category']:
+        conditions.append('category = %s')
+        values.append(options['category'])
+
+    rows = 0
+    cur = conn.cursor(name='scan_history_export')
+    cur.itersize = itersize
+    try:
+        with gzip.open(path, 'wb', compresslevel=6) as stream, io.TextIOWrapper(stream, encoding='utf-8', newline='') as text:
+            writer = None
+            if options['format'] == 'csv':
+                # BOM, чтобы Excel открыл кириллицу без мастера импорта
+                text.write('\ufeff')
+                writer = csv.writer(text)
+                writer.writerow(COLUMNS)
+
+            # Строка сверх потолка означает, что выгрузка не поместится
+            cur.execute(
+                f"""
+                SELECT {_SELECT} 
+                FROM {schema}.scan_history 
+                WHERE {' AND '.join(conditions)} 
+                ORDER BY created_at, id 
+                LIMIT %s
+                """,
+                values + [max_rows + 1]
+            )
+            for row in cur:
+                rows += 1
+                if rows > max_rows:
+                    raise ExportTooLarge(f'В выгрузке больше {max_rows} строк, сузьте период from и to')
+                record = list(row)
+                record[1] = record[1].isoformat()
+                if writer is not None:
+                    writer.writerow(record)
+                else:
+                    text.write(json.dumps(dict(zip(COLUMNS, record)), ensure_ascii=False))
+                    text.write('\n')
+    finally:
+        cur.close()
+    return rows
+
+
+def export_response(conn, schema: str, user_id, options: dict, accept_encoding: str, store=None) -> dict:
+    """Ответ функции с выгрузкой, всегда сжатой gzip. С хранилищем — редирект 302 на загруженный файл
+    (чистка префикса exports/ — правилом жизненного цикла бакета); без него — тело ответа с
+    Content-Encoding: gzip или, если клиент gzip не принимает, файл .gz"""
+    content_type, extension = FORMATS[options['format']]
+    filename = f'scans-{user_id}.{extension}'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f'{filename}.gz')
+        rows = write_export(conn, schema, user_id, options, path)
+        headers = {'Access-Control-Allow-Origin': '*', 'X-Export-Rows': str(rows)}
+        if store is not None:
+            key = f'exports/{user_id}/{uuid.uuid4().hex}/{filename}.gz'
+            store.put_file(key, path, 'application/gzip')
+            headers['Location'] = store.url(key)
+            return {'statusCode': 302, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+        with open(path, 'rb') as f:
+            body = base64.b64encode(f.read()).decode()
+
+    if 'gzip' in (accept_encoding or '').lower():
+        headers.update({
+            'Content-Type': content_type,
+            'Content-Encoding': 'gzip',
+            'Content-Disposition': f'attachment; filename="{filename}"'
+        })
+    else:
+        headers.update({'Content-Type': 'application/gzip', 'Content-Disposition': f'attachment; filename="{filename}.gz"'})
+    return {'statusCode': 200, 'headers': headers, 'body': body, 'isBase64Encoded': True}
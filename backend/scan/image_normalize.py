@@ -0,0 +1,82 @@
+"""
+Нормализация кадра перед отправкой в Vision: уменьшение, удаление EXIF, пережатие в JPEG
+"""
+import io
+import time
+from typing import Optional
+
+import runtime
+
+Image = runtime.lazy_import('PIL.Image')
+ImageOps = runtime.lazy_import('PIL.ImageOps')
+
+
+class ImageTooLarge(Exception):
+    """Размер изображения превышает допустимый"""
+
+
+class InvalidImage(Exception):
+    """Изображение не удалось декодировать"""
+
+
+def get_max_bytes() -> int:
+    """Максимальный размер исходного изображения в байтах"""
+    return int(runtime.setting('IMAGE_MAX_BYTES', 8 * 1024 * 1024))
+
+
+def check_base64_size(image_base64: str, max_bytes: Optional[int] = None) -> None:
+    """Ранний отказ по длине base64-строки, до декодирования"""
+    if len(image_base64) * 3 // 4 > (max_bytes or get_max_bytes()):
+        raise ImageTooLarge('Изображение слишком большое')
+
+
+def normalize_image(image_bytes: bytes) -> tuple:
+    """Возвращает (байты JPEG, статистика); исходник отдаётся, если пережатие не помогло"""
+    started = time.monotonic()
+    max_side = int(runtime.setting('IMAGE_MAX_SIDE', 1024))
+    quality = int(runtime.setting('IMAGE_JPEG_QUALITY', 80))
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            has_exif = bool(image.info.get('exif'))
+            original_size = image.size
+            # JPEG можно декодировать сразу в уменьшенном масштабе
+            image.draft('RGB', (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            resized = image.size != original_size
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage('Некорректное изображение') from e
+
+    normalized = buffer.getvalue()
+    if len(normalized) >= len(image_bytes) and not resized and not has_exif:
+        normalized = image_bytes
+
+    stats = {
+        'original_bytes': len(image_bytes),
+        'normalized_bytes': len(normalized),
+        'bytes_saved': len(image_bytes) - len(normalized),
+        'width': image.size[0],
+        'height': image.size[1],
+        'normalize_ms': round((time.monotonic() - started) * 1000, 2)
+    }
+    return normalized, stats
+
+
+def make_thumbnail(image_bytes: bytes) -> bytes:
+    """Квадратное превью для списка истории: THUMBNAIL_SIZE пикселей по стороне, JPEG"""
+    size = int(runtime.setting('THUMBNAIL_SIZE', 256))
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft('RGB', (size * 2, size * 2))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, format='JPEG', quality=int(runtime.setting('THUMBNAIL_JPEG_QUALITY', 70)), optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImage('Некорректное изображение') from e
+    return buffer.getvalue()
@@ -0,0 +1,180 @@
+"""
+Хранилище кадров: локальная файловая система или S3-совместимое объектное хранилище.
+Ключи — SHA-256 исходных байтов, повторная загрузка того же кадра ничего не пишет.
+Загрузка идёт в фоне параллельно с распознаванием: нормализованные байты берутся из recognize_image,
+а при ошибке распознавания загрузка отменяется (discard_upload)
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+import runtime
+import tracing
+from image_normalize import make_thumbnail, normalize_image
+
+executors = runtime.lazy_import('concurrent.futures')
+
+CONTENT_TYPE = 'image/jpeg'
+
+
+class LocalImageStore:
+    """Файлы в IMAGE_STORE_PATH; URL — IMAGE_STORE_PUBLIC_URL плюс ключ или file://"""
+
+    def __init__(self, root: str, public_url: Optional[str] = None):
+        self.root = root
+        self.public_url = public_url
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def _write(self, key: str, write) -> None:
+        """Запись во временный файл и переименование: читатель не увидит недописанный кадр,
+        а при ошибке записи временный файл удаляется"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, key: str, data: bytes, content_type: str = CONTENT_TYPE) -> None:
+        self._write(key, lambda f: f.write(data))
+
+    def put_file(self, key: str, source_path: str, content_type: str) -> None:
+        """Загрузка файла без чтения целиком в память"""
+        def copy(target):
+            with open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, target)
+        self._write(key, copy)
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{key}"
+        return f'file://{self._path(key)}'
+
+
+class S3ImageStore:
+    """S3-совместимое хранилище (Yandex Object Storage, MinIO и т.п.) через boto3"""
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, public_url: Optional[str] = None):
+        import boto3
+        from botocore.config import Config
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_url = public_url
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            config=Config(connect_timeout=3, read_timeout=10, retries={'max_attempts': 2})
+        )
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put(self, key: str, data: bytes, content_type: str = CONTENT_TYPE) -> None:
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+            # Содержимое по ключу не меняется никогда
+            CacheControl='public, max-age=31536000, immutable'
+        )
+
+    def put_file(self, key: str, source_path: str, content_type: str) -> None:
+        """Загрузка файла частями (multipart для больших архивов)"""
+        self.client.upload_file(source_path, self.bucket, key, ExtraArgs={'ContentType': content_type})
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{key}"
+        return f"{(self.endpoint_url or 'https://s3.amazonaws.com').rstrip('/')}/{self.bucket}/{key}"
+
+
+_store = None
+_store_lock = threading.Lock()
+_executor = None
+
+
+def get_image_store():
+    """Хранилище процесса по IMAGE_STORE_BACKEND (local или s3); None, если не настроено"""
+    global _store
+    backend = runtime.setting('IMAGE_STORE_BACKEND', '')
+    if not backend:
+        return None
+    with _store_lock:
+        if _store is None:
+            if backend == 's3':
+                _store = S3ImageStore(
+                    runtime.setting('S3_BUCKET'),
+                    endpoint_url=runtime.setting('S3_ENDPOINT_URL'),
+                    public_url=runtime.setting('S3_PUBLIC_URL')
+                )
+            else:
+                _store = LocalImageStore(
+                    runtime.setting('IMAGE_STORE_PATH', os.path.join(tempfile.gettempdir(), 'scan-images')),
+                    public_url=runtime.setting('IMAGE_STORE_PUBLIC_URL')
+                )
+    return _store
+
+
+def image_keys(digest: str) -> tuple:
+    """Ключи кадра и превью по SHA-256 исходных байтов (image_digest)"""
+    return f'scans/{digest[:2]}/{digest}.jpg', f'thumbs/{digest[:2]}/{digest}.jpg'
+
+
+def store_image(store, digest: str, image_bytes: bytes, normalized_bytes: Optional[bytes] = None) -> tuple:
+    """Нормализованный кадр и превью в хранилище; (image_url, thumbnail_url).
+    Без normalized_bytes (результат взят из кэша) кадр нормализуется здесь"""
+    image_key, thumbnail_key = image_keys(digest)
+    with tracing.span('image_upload'):
+        # Превью пишется последним: если оно есть, кадр уже загружен
+        if not store.exists(thumbnail_key):
+            if normalized_bytes is None:
+                normalized_bytes, _ = normalize_image(image_bytes)
+            store.put(image_key, normalized_bytes)
+            store.put(thumbnail_key, make_thumbnail(normalized_bytes))
+    return store.url(image_key), store.url(thumbnail_key)
+
+
+def submit_upload(digest: str, image_bytes: bytes, normalized_bytes: Optional[bytes] = None):
+    """Фоновая загрузка кадра; future или None без хранилища"""
+    global _executor
+    store = get_image_store()
+    if store is None:
+        return None
+    with _store_lock:
+        if _executor is None:
+            _executor = executors.ThreadPoolExecutor(max_workers=int(runtime.setting('IMAGE_STORE_CONCURRENCY', 4)))
+    return _executor.submit(tracing.bind(store_image), store, digest, image_bytes, normalized_bytes)
+
+
+def discard_upload(future) -> None:
+    """Отмена загрузки кадра без результата; уже начатая доводится до конца — ключ по SHA-256, лишний объект безвреден"""
+    if future is not None:
+        future.cancel()
+
+
+def upload_result(future) -> tuple:
+    """(image_url, thumbnail_url) загрузки; ошибка хранилища не ломает сканирование"""
+    if future is None:
+        return None, None
+    try:
+        return future.result()
+    except Exception as e:
+        print(json.dumps({'image_store_error': str(e)}, ensure_ascii=False))
+        return None, None
@@ -2,24 +2,50 @@
 API для сканирования объектов через камеру с AI-распознаванием (OpenAI Vision)
 """
 import json
-import os
-import psycopg2
 import base64
+import binascii
+import hmac
+import time
 from datetime import datetime
-import urllib.request
+from db_pool import get_pool
+from user_cache import user_cache
+from recognition_cache import image_digest, make_cache_key, get_recognition_cache
+from phash import dhash, to_db, find_recent_duplicate
+from stream_parser import StreamingFieldParser
+from recognizers import RemoteRecognizer, get_local_recognizer, route_recognition
+from pagination import InvalidCursor, decode_cursor, encode_cursor, parse_limit
+from image_normalize import ImageTooLarge, InvalidImage, check_base64_size, get_max_bytes, normalize_image
+from response_parser import ParseError, parse_analysis
+from upload import InvalidUpload, get_header, read_upload
+from export import ExportTooLarge, InvalidExportRequest, export_response, parse_export_params
+from search import InvalidSearchRequest, is_search, parse_search_params, search_history
+from image_store import discard_upload, get_image_store, submit_upload, upload_result
+from partitions import ensure_partitions_periodically, get_retention_settings, run_retention
+from single_flight import claim_scan, find_previous, get_idempotency_key, remember_scan
+import rate_limit
+import runtime
+import tracing
+
+# Нужны только на путях распознавания и пакетов: история и OPTIONS их не загружают
+executors = runtime.lazy_import('concurrent.futures')
+extras = runtime.lazy_import('psycopg2.extras')
+http_client = runtime.lazy_import('http_client')
 
 def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+    """Соединение из пула процесса"""
+    return get_pool().getconn()
+
+def release_db_connection(conn):
+    """Возврат соединения в пул, незавершённая транзакция откатывается"""
+    get_pool().putconn(conn)
 
 def get_schema():
     """Получение имени схемы"""
-    return os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return runtime.get_schema()
 
-def analyze_image(image_base64: str, ai_responses_enabled: bool) -> dict:
-    """Анализ изображения через OpenAI Vision API"""
-    api_key = os.environ.get('OPENAI_API_KEY')
+def build_vision_request(image_base64: str, ai_responses_enabled: bool) -> tuple:
+    """URL, тело и заголовки запроса к OpenAI Vision"""
+    api_key = runtime.setting('OPENAI_API_KEY')
     
     if not api_key:
         raise Exception('OpenAI API ключ не настроен')
@@ -50,189 +76,918 @@ def analyze_image(image_base64: str, ai_responses_enabled: bool) -> dict:
             "content": "Также добавь поле 'description' с подробным описанием объекта (2-3 предложения)."
         })
     
-    request_data = json.dumps({
+    api_base = runtime.setting('OPENAI_API_BASE', 'https://api.openai.com/v1')
+    payload = {
         "model": "gpt-4o-mini",
         "messages": messages,
-        "max_tokens": 300
-    }).encode()
-    
-    req = urllib.request.Request(
-        'https://api.openai.com/v1/chat/completions',
-        data=request_data,
-        headers={
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-    )
-    
-    with urllib.request.urlopen(req) as response:
-        result = json.loads(response.read().decode())
+        "max_tokens": 300,
+        # JSON mode: модель отвечает одним объектом без обёртки и пояснений
+        "response_format": {"type": "json_object"}
+    }
+    return f'{api_base}/chat/completions', payload, {'Authorization': f'Bearer {api_key}'}
+
+def repair_model_output(content: str) -> str:
+    """Починка неразобранного ответа текстовым запросом без изображения: в разы дешевле повторного распознавания"""
+    url, payload, headers = build_vision_request('', False)
+    payload['messages'] = [{
+        "role": "user",
+        "content": "Преобразуй ответ ниже в один JSON-объект с полями title, category, confidence и, если есть, description. Верни только JSON.\n\n" + content[:2000]
+    }]
+    payload['max_tokens'] = 200
+    with tracing.span('vision_repair'):
+        result = http_client.post_json(url, payload, headers=headers).json()
+    return result['choices'][0]['message'].get('content') or ''
+
+def analyze_image(image_base64: str, ai_responses_enabled: bool) -> dict:
+    """Анализ изображения через OpenAI Vision API"""
+    url, payload, headers = build_vision_request(image_base64, ai_responses_enabled)
+    with tracing.span('vision'):
+        result = http_client.post_json(url, payload, headers=headers).json()
     
-    content = result['choices'][0]['message']['content']
+    content = result['choices'][0]['message'].get('content')
+    with tracing.span('parse'):
+        return parse_analysis(content, repair=repair_model_output)
+
+def analyze_image_stream(image_base64: str, ai_responses_enabled: bool):
+    """Потоковый анализ: ('fields', dict) как только известны title/category/confidence,
+    затем ('description', кусок текста), в конце ('done', полный результат)"""
+    url, payload, headers = build_vision_request(image_base64, ai_responses_enabled)
+    payload['stream'] = True
+    headers['Content-Type'] = 'application/json'
     
-    # Извлекаем JSON из ответа
-    if '```json' in content:
-        content = content.split('```json')[1].split('```')[0].strip()
-    elif '```' in content:
-        content = content.split('```')[1].split('```')[0].strip()
+    parser = StreamingFieldParser()
+    content = []
+    # Время потока включает обработку промежуточных событий вызывающим кодом
+    with tracing.span('vision_stream'):
+        for line in http_client.stream_lines('POST', url, body=json.dumps(payload).encode(), headers=headers):
+            line = line.strip()
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                # Дочитываем поток до конца, чтобы соединение вернулось в пул
+                continue
+            choices = json.loads(data).get('choices') or [{}]
+            delta = (choices[0].get('delta') or {}).get('content')
+            if not delta:
+                continue
+            content.append(delta)
+            for event in parser.feed(delta):
+                yield event
     
-    return json.loads(content)
+    with tracing.span('parse'):
+        analysis = parse_analysis(''.join(content), repair=repair_model_output)
+    yield 'done', analysis
 
-def handler(event: dict, context) -> dict:
-    """Обработчик сканирования объектов"""
-    method = event.get('httpMethod', 'GET')
+def decode_image(image_base64) -> bytes:
+    """Проверка размера и декодирование base64; ImageTooLarge или InvalidImage при ошибке.
+    Байты из бинарной загрузки проверяются по размеру и возвращаются без копирования"""
+    if isinstance(image_base64, bytes) and image_base64:
+        if len(image_base64) > get_max_bytes():
+            raise ImageTooLarge('Изображение слишком большое')
+        return image_base64
+    if not isinstance(image_base64, str) or not image_base64:
+        raise InvalidImage('Некорректное изображение')
+    check_base64_size(image_base64)
+    try:
+        return base64.b64decode(image_base64, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidImage('Некорректное изображение') from e
+
+def find_known_result(cur, schema: str, cache, cache_key: str, user_id, image_phash, ai_responses_enabled: bool) -> tuple:
+    """Результат из кэша или недавнего похожего кадра: (результат или None, hit/near_hit/miss)"""
+    analysis = cache.get(cache_key)
+    if analysis is not None:
+        return analysis, 'hit'
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    # Тот же объект с небольшим сдвигом кадра — берём недавний результат
+    if image_phash is not None:
+        analysis = find_recent_duplicate(cur, schema, user_id, image_phash, ai_responses_enabled)
+        if analysis is not None:
+            cache.set(cache_key, analysis)
+            return analysis, 'near_hit'
+    return None, 'miss'
+
+def recognize_image(image_bytes: bytes, ai_responses_enabled: bool, on_event=None, digest: str = None) -> tuple:
+    """Нормализация кадра, локальная модель и при необходимости Vision; возвращает (результат, статистика кадра, загрузка).
+    С digest нормализованный кадр уходит в хранилище сразу, параллельно с распознаванием: загрузка — future для
+    upload_result (None без digest или хранилища), при ошибке распознавания она отменяется.
+    С on_event ответ Vision читается потоком, и промежуточные события передаются в колбэк"""
+    # Уменьшенный кадр без EXIF дешевле по трафику и токенам
+    with tracing.span('normalize') as span:
+        normalized_bytes, image_stats = normalize_image(image_bytes)
+        span.set(**image_stats)
+    upload = submit_upload(digest, image_bytes, normalized_bytes) if digest else None
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    def analyze_remote(data: bytes, ai_enabled: bool) -> dict:
+        image_base64 = base64.b64encode(data).decode()
+        if on_event is None:
+            return analyze_image(image_base64, ai_enabled)
+        started = time.monotonic()
+        for kind, value in analyze_image_stream(image_base64, ai_enabled):
+            if kind == 'done':
+                return value
+            if kind == 'fields':
+                image_stats['first_fields_ms'] = round((time.monotonic() - started) * 1000, 2)
+            on_event(kind, value)
     
     try:
-        if method == 'POST':
-            # Сканирование нового изображения
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('user_id')
-            image_base64 = body.get('image')
-            
-            if not user_id or not image_base64:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id и image обязательны'}),
-                    'isBase64Encoded': False
-                }
-            
-            # Получаем настройки пользователя
-            schema = get_schema()
-            cur.execute(f"SELECT ai_responses_enabled FROM {schema}.users WHERE id = %s", (user_id,))
-            user = cur.fetchone()
-            
-            if not user:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь не найден'}),
-                    'isBase64Encoded': False
-                }
-            
-            ai_responses_enabled = user[0]
-            
-            # Анализ изображения через OpenAI Vision
-            analysis = analyze_image(image_base64, ai_responses_enabled)
-            
-            # Сохранение в историю
-            cur.execute(
+        analysis, routing = route_recognition(
+            normalized_bytes, ai_responses_enabled, get_local_recognizer(), RemoteRecognizer(analyze_remote)
+        )
+    except BaseException:
+        discard_upload(upload)
+        raise
+    image_stats.update(routing)
+    return analysis, image_stats, upload
+
+def recognition_meta(cache_status: str, image_stats) -> tuple:
+    """Кто дал результат (кэш, локальная модель, Vision) и задержки по бэкендам для scan_history"""
+    if not image_stats:
+        return cache_status, None
+    timings = {key: value for key, value in image_stats.items() if key.endswith('_ms')}
+    return image_stats.get('route'), json.dumps(timings)
+
+def scan_history_values(user_id, analysis: dict, image_phash, cache_status: str, image_stats, image_urls=(None, None)) -> tuple:
+    """Значения строки scan_history для результата распознавания; image_urls — (кадр, превью) из хранилища"""
+    recognizer, recognition_ms = recognition_meta(cache_status, image_stats)
+    return (
+        user_id,
+        analysis.get('title', 'Неизвестный объект'),
+        analysis.get('category', 'Другое'),
+        analysis.get('confidence', 50),
+        analysis.get('description'),
+        to_db(image_phash) if image_phash is not None else None,
+        recognizer,
+        recognition_ms,
+        image_urls[0],
+        image_urls[1],
+        datetime.now()
+    )
+
+def get_batch_limits() -> tuple:
+    """Максимум кадров в пакете и число одновременных запросов в Vision.
+    Пакет дороже ёмкости вёдер допуска не прошёл бы никогда, поэтому потолок — меньшее из
+    SCAN_BATCH_MAX_ITEMS и rate_limit.max_cost: клиент видит один предел"""
+    return (
+        int(min(int(runtime.setting('SCAN_BATCH_MAX_ITEMS', 20)), rate_limit.max_cost(rate_limit.BATCH))),
+        int(runtime.setting('SCAN_BATCH_CONCURRENCY', 4))
+    )
+
+def get_max_body_bytes() -> int:
+    """Потолок тела POST до разбора JSON; кадры внутри проверяются отдельно по IMAGE_MAX_BYTES"""
+    return int(runtime.setting('SCAN_MAX_BODY_BYTES', 32 * 1024 * 1024))
+
+def decode_batch(images: list) -> list:
+    """Декодирование кадров пакета: для каждого байты или текст ошибки"""
+    decoded = []
+    with tracing.span('decode'):
+        for image_base64 in images:
+            try:
+                decoded.append(decode_image(image_base64))
+            except (ImageTooLarge, InvalidImage) as e:
+                decoded.append(str(e))
+    return decoded
+
+def scan_batch(cur, schema: str, user_id, decoded: list, ai_responses_enabled: bool) -> list:
+    """Пакетное распознавание декодированных кадров (decode_batch): кэш и поиск дублей по очереди,
+    Vision параллельно, одна вставка в историю"""
+    _, concurrency = get_batch_limits()
+    cache = get_recognition_cache(cur, schema)
+    results = [{'index': index} for index in range(len(decoded))]
+    items = {}
+    pending = {}
+    uploads = {}
+    
+    for index, image_bytes in enumerate(decoded):
+        if isinstance(image_bytes, str):
+            results[index]['error'] = image_bytes
+            continue
+        
+        with tracing.span('phash'):
+            digest = image_digest(image_bytes)
+            cache_key = make_cache_key(digest, ai_responses_enabled)
+            image_phash = dhash(image_bytes)
+        items[index] = {'cache_key': cache_key, 'phash': image_phash}
+        
+        # Одинаковые кадры внутри пакета распознаём один раз
+        if cache_key in pending:
+            pending[cache_key]['indexes'].append(index)
+            items[index]['cache'] = 'batch_hit'
+            continue
+        
+        with tracing.span('cache'):
+            analysis, items[index]['cache'] = find_known_result(
+                cur, schema, cache, cache_key, user_id, image_phash, ai_responses_enabled
+            )
+        if analysis is None:
+            pending[cache_key] = {'image_bytes': image_bytes, 'digest': digest, 'indexes': [index]}
+        else:
+            items[index]['analysis'] = analysis
+            # Результат уже есть: кадр нормализуется на потоке загрузки, пока идёт распознавание остальных
+            if cache_key not in uploads:
+                uploads[cache_key] = submit_upload(digest, image_bytes)
+    
+    if pending:
+        with executors.ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(pending)))) as executor:
+            futures = {
+                cache_key: executor.submit(
+                    tracing.bind(recognize_image), job['image_bytes'], ai_responses_enabled, digest=job['digest']
+                )
+                for cache_key, job in pending.items()
+            }
+        for cache_key, future in futures.items():
+            try:
+                analysis, image_stats, uploads[cache_key] = future.result()
+            except Exception as e:
+                for index in pending[cache_key]['indexes']:
+                    results[index]['error'] = str(e)
+                    items.pop(index, None)
+                continue
+            cache.set(cache_key, analysis)
+            for index in pending[cache_key]['indexes']:
+                items[index]['analysis'] = analysis
+                items[index]['image'] = image_stats
+    
+    ready = sorted(items)
+    image_urls = {cache_key: upload_result(future) for cache_key, future in uploads.items()}
+    if ready:
+        # Все строки истории одной вставкой
+        with tracing.span('insert'):
+            rows = extras.execute_values(
+                cur,
                 f"""
                 INSERT INTO {schema}.scan_history 
-                (user_id, title, category, confidence, ai_response, created_at) 
-                VALUES (%s, %s, %s, %s, %s, %s) 
+                (user_id, title, category, confidence, ai_response, phash, recognizer, recognition_ms, image_url, thumbnail_url, created_at) 
+                VALUES %s 
                 RETURNING id, created_at
                 """,
+                [
+                    scan_history_values(
+                        user_id, items[index]['analysis'], items[index]['phash'], items[index]['cache'], items[index].get('image'),
+                        image_urls[items[index]['cache_key']]
+                    )
+                    for index in ready
+                ],
+                page_size=len(ready),
+                fetch=True
+            )
+        for index, (scan_id, created_at) in zip(ready, rows):
+            analysis = items[index]['analysis']
+            image_url, thumbnail_url = image_urls[items[index]['cache_key']]
+            results[index].update({
+                'scan_id': scan_id,
+                'title': analysis.get('title'),
+                'category': analysis.get('category'),
+                'confidence': analysis.get('confidence'),
+                'description': analysis.get('description') if ai_responses_enabled else None,
+                'created_at': created_at.isoformat(),
+                'cache': items[index]['cache'],
+                'image': items[index].get('image'),
+                'image_url': image_url,
+                'thumbnail_url': thumbnail_url
+            })
+    return results
+
+def get_worker_settings() -> dict:
+    """Настройки обработчика очереди асинхронных сканирований"""
+    return {
+        'batch_size': int(runtime.setting('SCAN_WORKER_BATCH_SIZE', 10)),
+        'concurrency': int(runtime.setting('SCAN_WORKER_CONCURRENCY', 4)),
+        'lock_timeout': int(runtime.setting('SCAN_JOB_LOCK_TIMEOUT', 300)),
+        'max_attempts': int(runtime.setting('SCAN_JOB_MAX_ATTEMPTS', 3)),
+        'max_seconds': float(runtime.setting('SCAN_WORKER_MAX_SECONDS', 50))
+    }
+
+def claim_scan_jobs(cur, schema: str, settings: dict, job_id=None) -> list:
+    """Захват пачки задач (или одной job_id); зависшие в processing дольше lock_timeout забираются повторно"""
+    # Последняя попытка оборвалась посреди обработки: без этого задача осталась бы processing с кадром навсегда
+    cur.execute(
+        f"""
+        UPDATE {schema}.scan_jobs 
+        SET status = 'failed', image = NULL, error = 'Обработка прервана, попытки исчерпаны', updated_at = NOW() 
+        WHERE status = 'processing' 
+          AND locked_at < NOW() - make_interval(secs => %s) 
+          AND attempts >= %s 
+          AND (%s::int IS NULL OR id = %s::int)
+        """,
+        (settings['lock_timeout'], settings['max_attempts'], job_id, job_id)
+    )
+    cur.execute(
+        f"""
+        UPDATE {schema}.scan_jobs 
+        SET status = 'processing', locked_at = NOW(), attempts = attempts + 1, updated_at = NOW() 
+        WHERE id IN (
+            SELECT id FROM {schema}.scan_jobs 
+            WHERE (status = 'pending' 
+                   OR (status = 'processing' AND locked_at < NOW() - make_interval(secs => %s))) 
+              AND attempts < %s 
+              AND (%s::int IS NULL OR id = %s::int) 
+            ORDER BY id 
+            LIMIT %s 
+            FOR UPDATE SKIP LOCKED
+        ) 
+        RETURNING id, user_id, image, ai_responses_enabled, attempts
+        """,
+        (settings['lock_timeout'], settings['max_attempts'], job_id, job_id, settings['batch_size'])
+    )
+    return cur.fetchall()
+
+def process_scan_jobs(conn, cur, schema: str, settings: dict, job_id=None) -> dict:
+    """Одна итерация обработчика очереди: захват, распознавание, запись результатов"""
+    jobs = claim_scan_jobs(cur, schema, settings, job_id)
+    conn.commit()
+    if not jobs:
+        return {'claimed': 0, 'done': 0, 'failed': 0}
+    
+    cache = get_recognition_cache(cur, schema)
+    results = {}
+    errors = {}
+    # Кадр, который не декодируется, не исправится повтором
+    permanent = set()
+    pending = {}
+    uploads = {}
+    
+    for job_id, user_id, image_base64, ai_responses_enabled, _ in jobs:
+        try:
+            image_bytes = decode_image(image_base64)
+        except (ImageTooLarge, InvalidImage) as e:
+            errors[job_id] = str(e)
+            permanent.add(job_id)
+            continue
+        digest = image_digest(image_bytes)
+        cache_key = make_cache_key(digest, ai_responses_enabled)
+        image_phash = dhash(image_bytes)
+        results[job_id] = {'user_id': user_id, 'phash': image_phash, 'cache': 'batch_hit', 'cache_key': cache_key}
+        
+        if cache_key in pending:
+            pending[cache_key]['job_ids'].append(job_id)
+            continue
+        analysis, results[job_id]['cache'] = find_known_result(
+            cur, schema, cache, cache_key, user_id, image_phash, ai_responses_enabled
+        )
+        if analysis is None:
+            pending[cache_key] = {'image_bytes': image_bytes, 'digest': digest, 'ai': ai_responses_enabled, 'job_ids': [job_id]}
+        else:
+            results[job_id]['analysis'] = analysis
+            if cache_key not in uploads:
+                uploads[cache_key] = submit_upload(digest, image_bytes)
+    
+    if pending:
+        with executors.ThreadPoolExecutor(max_workers=max(1, min(settings['concurrency'], len(pending)))) as executor:
+            futures = {}
+            for cache_key, job in pending.items():
+                # Описание генерируется долго: название и категорию публикуем сразу
+                on_event = job_fields_publisher(schema, job['job_ids']) if job['ai'] else None
+                futures[cache_key] = executor.submit(
+                    tracing.bind(recognize_image), job['image_bytes'], job['ai'], on_event, digest=job['digest']
+                )
+        for cache_key, future in futures.items():
+            try:
+                analysis, image_stats, uploads[cache_key] = future.result()
+            except Exception as e:
+                for job_id in pending[cache_key]['job_ids']:
+                    errors[job_id] = str(e)
+                    results.pop(job_id, None)
+                    if isinstance(e, InvalidImage):
+                        permanent.add(job_id)
+                continue
+            cache.set(cache_key, analysis)
+            for job_id in pending[cache_key]['job_ids']:
+                results[job_id]['analysis'] = analysis
+                results[job_id]['image'] = image_stats
+    
+    ready = sorted(results)
+    if ready:
+        rows = extras.execute_values(
+            cur,
+            f"""
+            INSERT INTO {schema}.scan_history 
+            (user_id, title, category, confidence, ai_response, phash, recognizer, recognition_ms, image_url, thumbnail_url, created_at) 
+            VALUES %s 
+            RETURNING id
+            """,
+            [
+                scan_history_values(
+                    results[job_id]['user_id'], results[job_id]['analysis'], results[job_id]['phash'],
+                    results[job_id]['cache'], results[job_id].get('image'), upload_result(uploads[results[job_id]['cache_key']])
+                )
+                for job_id in ready
+            ],
+            page_size=len(ready),
+            fetch=True
+        )
+        for job_id, (scan_id,) in zip(ready, rows):
+            analysis = results[job_id]['analysis']
+            cur.execute(
+                f"""
+                UPDATE {schema}.scan_jobs 
+                SET status = 'done', title = %s, category = %s, confidence = %s, ai_response = %s, 
+                    scan_id = %s, image = NULL, error = NULL, updated_at = NOW() 
+                WHERE id = %s
+                """,
                 (
-                    user_id,
                     analysis.get('title', 'Неизвестный объект'),
                     analysis.get('category', 'Другое'),
                     analysis.get('confidence', 50),
                     analysis.get('description'),
-                    datetime.now()
+                    scan_id,
+                    job_id
                 )
             )
-            scan_id, created_at = cur.fetchone()
+    
+    # Неудачные задачи возвращаются в очередь, пока не исчерпаны попытки; ошибки кадра — сразу failed
+    attempts = {job[0]: job[4] for job in jobs}
+    for job_id, error in errors.items():
+        final = job_id in permanent or attempts[job_id] >= settings['max_attempts']
+        cur.execute(
+            f"""
+            UPDATE {schema}.scan_jobs 
+            SET status = %s, error = %s, image = CASE WHEN %s THEN NULL ELSE image END, updated_at = NOW() 
+            WHERE id = %s
+            """,
+            ('failed' if final else 'pending', error, final, job_id)
+        )
+    conn.commit()
+    return {'claimed': len(jobs), 'done': len(ready), 'failed': len(errors)}
+
+def drain_scan_jobs(conn, cur, schema: str, settings: dict) -> dict:
+    """Обработка очереди пачками, пока есть задачи и не вышло SCAN_WORKER_MAX_SECONDS"""
+    started = time.monotonic()
+    totals = {'claimed': 0, 'done': 0, 'failed': 0}
+    while time.monotonic() - started < settings['max_seconds']:
+        summary = process_scan_jobs(conn, cur, schema, settings)
+        for key in totals:
+            totals[key] += summary[key]
+        if summary['claimed'] < settings['batch_size']:
+            break
+    return totals
+
+def run_task(event: dict, conn, cur) -> dict:
+    """POST ?task=worker|retention — задачи обслуживания для внешнего планировщика (cron, таймер облака):
+    worker — разбор очереди scan_jobs, retention — секции истории и чистка кэшей (раз в сутки).
+    Отдельных точек входа у функции нет, поэтому запуск идёт через handler с заголовком X-Maintenance-Token"""
+    token = runtime.setting('SCAN_MAINTENANCE_TOKEN')
+    if not token or not hmac.compare_digest(get_header(event, 'X-Maintenance-Token') or '', token):
+        return runtime.error(403, 'Нет доступа')
+    
+    task = event['queryStringParameters']['task']
+    schema = get_schema()
+    if task == 'worker':
+        with tracing.span('worker'):
+            summary = drain_scan_jobs(conn, cur, schema, get_worker_settings())
+    elif task == 'retention':
+        with tracing.span('retention'):
+            summary = run_retention(conn, schema, get_retention_settings(), get_image_store())
+    else:
+        return runtime.error(400, 'Неизвестная задача')
+    return runtime.json_response(200, summary)
+
+def publish_job_fields(schema: str, job_ids: list, fields: dict) -> None:
+    """Промежуточные title/category/confidence в задачи, пока описание ещё генерируется"""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            UPDATE {schema}.scan_jobs 
+            SET title = %s, category = %s, confidence = %s, updated_at = NOW() 
+            WHERE id = ANY(%s) AND status = 'processing'
+            """,
+            (fields.get('title'), fields.get('category'), fields.get('confidence'), job_ids)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def job_fields_publisher(schema: str, job_ids: list):
+    """Колбэк для recognize_image, публикующий промежуточные поля задач"""
+    def on_event(kind: str, value) -> None:
+        if kind == 'fields':
+            publish_job_fields(schema, job_ids, value)
+    return on_event
+
+def format_sse(events: list) -> str:
+    """Тело ответа text/event-stream"""
+    return ''.join(
+        f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        for kind, data in events
+    )
+
+def admit_scan(conn, cur, schema: str, user_id, cost: int, lane: str):
+    """Списание по token bucket; None, если допущено, иначе ответ 413 или 429.
+    Пакеты и очередь не вытесняют одиночные сканирования"""
+    limit = rate_limit.max_cost(lane)
+    if cost > limit:
+        return runtime.error(413, f'Не больше {int(limit)} изображений за запрос')
+    with tracing.span('admission'):
+        retry_after = rate_limit.admit(cur, schema, user_id, cost, lane)
+        # Строки вёдер не держим заблокированными на время распознавания
+        conn.commit()
+    if retry_after is None:
+        return None
+    return {
+        'statusCode': 429,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Retry-After': str(retry_after)},
+        'body': json.dumps({'error': 'Слишком много сканирований, повторите позже', 'retry_after': retry_after}),
+        'isBase64Encoded': False
+    }
+
+def get_scan_job(cur, schema: str, job_id, user_id):
+    """Строка задачи пользователя или None"""
+    cur.execute(
+        f"""
+        SELECT id, status, title, category, confidence, ai_response, error, scan_id, created_at, updated_at 
+        FROM {schema}.scan_jobs 
+        WHERE id = %s AND user_id = %s
+        """,
+        (job_id, user_id)
+    )
+    return cur.fetchone()
+
+router = runtime.Router('Content-Type, X-User-Id, Idempotency-Key')
+
+@router.route('POST')
+def scan_post(event: dict, conn, cur) -> dict:
+    """Распознавание кадра или пакета кадров"""
+    # Секция следующего месяца появляется, даже если retention не запускается
+    ensure_partitions_periodically(conn, cur, get_schema())
+    if (event.get('queryStringParameters') or {}).get('task'):
+        return run_task(event, conn, cur)
+    
+    raw_body = event.get('body') or '{}'
+    max_items, _ = get_batch_limits()
+    try:
+        # Ранний отказ до разбора JSON; пакет из max_items кадров ограничен тем же потолком
+        check_base64_size(raw_body, get_max_body_bytes())
+    except ImageTooLarge:
+        return runtime.error(413, 'Тело запроса слишком большое')
+    try:
+        with tracing.span('parse_body'):
+            # Бинарное тело (image/*, multipart) читается сразу в bytes, иначе JSON с base64
+            body = read_upload(event)
+            if body is None:
+                body = json.loads(raw_body)
+    except InvalidUpload as e:
+        return runtime.error(400, str(e))
+    user_id = body.get('user_id')
+    image_data = body.get('image')
+    images = body.get('images')
+    
+    if images is not None:
+        if not user_id or not isinstance(images, list) or not images:
+            return runtime.error(400, 'user_id и images обязательны')
+        if len(images) > max_items:
+            return runtime.error(413, f'Не больше {max_items} изображений за запрос')
+    elif not user_id or not image_data:
+        return runtime.error(400, 'user_id и image обязательны')
+    elif isinstance(image_data, str):
+        # Одиночный кадр — по лимиту одного изображения, а не пакета
+        try:
+            check_base64_size(image_data)
+        except ImageTooLarge as e:
+            return runtime.error(413, str(e))
+    
+    # Получаем настройки пользователя
+    schema = get_schema()
+    with tracing.span('user'):
+        user = user_cache.get_by_id(cur, schema, user_id)
+    
+    if not user:
+        return runtime.error(404, 'Пользователь не найден')
+    
+    ai_responses_enabled = user['ai_responses_enabled']
+    
+    if images is not None:
+        # Пакетное сканирование; списываются только кадры, прошедшие декодирование
+        decoded = decode_batch(images)
+        cost = sum(1 for image_bytes in decoded if isinstance(image_bytes, bytes))
+        if cost:
+            rejected = admit_scan(conn, cur, schema, user_id, cost, rate_limit.BATCH)
+            if rejected is not None:
+                return rejected
+        results = scan_batch(cur, schema, user_id, decoded, ai_responses_enabled)
+        with tracing.span('commit'):
             conn.commit()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'scan_id': scan_id,
-                    'title': analysis.get('title'),
-                    'category': analysis.get('category'),
-                    'confidence': analysis.get('confidence'),
-                    'description': analysis.get('description') if ai_responses_enabled else None,
-                    'created_at': created_at.isoformat()
-                }),
-                'isBase64Encoded': False
-            }
+        failed = sum(1 for item in results if 'error' in item)
+        return runtime.json_response(201 if failed == 0 else 207, {
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed
+        })
+    
+    try:
+        with tracing.span('decode'):
+            image_bytes = decode_image(image_data)
+    except ImageTooLarge as e:
+        return runtime.error(413, str(e))
+    except InvalidImage as e:
+        return runtime.error(400, str(e))
+    
+    if body.get('async'):
+        # Асинхронный режим: ставим задачу в очередь и сразу отвечаем
+        rejected = admit_scan(conn, cur, schema, user_id, 1, rate_limit.BATCH)
+        if rejected is not None:
+            return rejected
+        cur.execute(
+            f"""
+            INSERT INTO {schema}.scan_jobs (user_id, image, ai_responses_enabled) 
+            VALUES (%s, %s, %s) 
+            RETURNING id, created_at
+            """,
+            (
+                user_id,
+                image_data if isinstance(image_data, str) else base64.b64encode(image_bytes).decode(),
+                ai_responses_enabled
+            )
+        )
+        job_id, created_at = cur.fetchone()
+        conn.commit()
+        return runtime.json_response(202, {
+            'job_id': job_id,
+            'status': 'pending',
+            'created_at': created_at.isoformat()
+        })
+    
+    # Повторное сканирование того же кадра не идёт в OpenAI
+    cache = get_recognition_cache(cur, schema)
+    with tracing.span('phash'):
+        digest = image_digest(image_bytes)
+        cache_key = make_cache_key(digest, ai_responses_enabled)
+        image_phash = dhash(image_bytes)
+    
+    # Ретрай клиента с тем же кадром ждёт первый запрос и получает его scan_id
+    idempotency_key = get_idempotency_key(event)
+    with tracing.span('single_flight'):
+        # Уже сохранённый повтор отвечает без списания лимита
+        previous = find_previous(cur, schema, user_id, cache_key, idempotency_key)
+    if previous is None:
+        rejected = admit_scan(conn, cur, schema, user_id, 1, rate_limit.INTERACTIVE)
+        if rejected is not None:
+            return rejected
+        with tracing.span('single_flight'):
+            previous = claim_scan(cur, schema, user_id, cache_key, idempotency_key)
+        if previous is not None:
+            # Параллельный дубль успел сохранить результат, пока ждали блокировку
+            rate_limit.refund(cur, schema, user_id, 1, rate_limit.INTERACTIVE)
+    if previous is not None:
+        scan_id, created_at, analysis, image_urls = previous
+        cache_status = 'coalesced'
+    else:
+        with tracing.span('cache'):
+            analysis, cache_status = find_known_result(
+                cur, schema, cache, cache_key, user_id, image_phash, ai_responses_enabled
+            )
+        # Результат из кэша: кадр нормализуется на потоке загрузки; иначе загрузку запускает recognize_image
+        upload = submit_upload(digest, image_bytes) if analysis is not None else None
+    
+    image_stats = None
+    stream = bool(body.get('stream'))
+    events = []
+    if analysis is None:
+        # Анализ изображения через OpenAI Vision
+        try:
+            if stream:
+                analysis, image_stats, upload = recognize_image(
+                    image_bytes, ai_responses_enabled, lambda kind, value: events.append((kind, value)), digest=digest
+                )
+            else:
+                analysis, image_stats, upload = recognize_image(image_bytes, ai_responses_enabled, digest=digest)
+        except InvalidImage as e:
+            return runtime.error(400, str(e))
+        cache.set(cache_key, analysis)
+    
+    if previous is None:
+        # Загрузка шла параллельно с распознаванием; ждём её только перед вставкой
+        image_urls = upload_result(upload)
+        # Сохранение в историю
+        with tracing.span('insert'):
+            cur.execute(
+                f"""
+                INSERT INTO {schema}.scan_history 
+                (user_id, title, category, confidence, ai_response, phash, recognizer, recognition_ms, image_url, thumbnail_url, created_at) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) 
+                RETURNING id, created_at
+                """,
+                scan_history_values(user_id, analysis, image_phash, cache_status, image_stats, image_urls)
+            )
+            scan_id, created_at = cur.fetchone()
+            remember_scan(cur, schema, user_id, cache_key, idempotency_key, scan_id)
+    # Коммит отпускает блокировку, ожидающие дубли читают записанный результат
+    with tracing.span('commit'):
+        conn.commit()
+    
+    result = {
+        'scan_id': scan_id,
+        'title': analysis.get('title'),
+        'category': analysis.get('category'),
+        'confidence': analysis.get('confidence'),
+        'description': analysis.get('description') if ai_responses_enabled else None,
+        'created_at': created_at.isoformat(),
+        'cache': cache_status,
+        'image': image_stats,
+        'image_url': image_urls[0],
+        'thumbnail_url': image_urls[1]
+    }
+    
+    if stream:
+        # Поток событий: поля, куски описания, итог с scan_id после сохранения
+        if not events:
+            events.append(('fields', {key: analysis.get(key) for key in ('title', 'category', 'confidence')}))
+            if result['description']:
+                events.append(('description', result['description']))
+        events.append(('done', result))
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'text/event-stream; charset=utf-8',
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*',
+                'X-Cache': cache_status.upper()
+            },
+            'body': format_sse(events),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 201 if previous is None else 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'X-Cache': cache_status.upper()},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
+
+def history_item(row) -> dict:
+    """Строка истории в формате ответа"""
+    return {
+        'id': row[0],
+        'title': row[1],
+        'category': row[2],
+        'confidence': row[3],
+        'description': row[4],
+        'created_at': row[5].isoformat(),
+        'image_url': row[6],
+        'thumbnail_url': row[7]
+    }
+
+@router.route('GET')
+def scan_get(event: dict, conn, cur) -> dict:
+    """История сканирований, статус задачи или выгрузка"""
+    user_id = event.get('queryStringParameters', {}).get('user_id')
+    
+    if not user_id:
+        return runtime.error(400, 'user_id обязателен')
+    
+    schema = get_schema()
+    job_id = event.get('queryStringParameters', {}).get('job_id')
+    
+    if event.get('queryStringParameters', {}).get('export'):
+        # Выгрузка истории: CSV или NDJSON с фильтрами from, to и category
+        try:
+            options = parse_export_params(event['queryStringParameters'])
+        except InvalidExportRequest as e:
+            return runtime.error(400, str(e))
+        try:
+            with tracing.span('export'):
+                return export_response(
+                    conn, schema, user_id, options, get_header(event, 'Accept-Encoding'), get_image_store()
+                )
+        except ExportTooLarge as e:
+            return runtime.error(413, str(e))
+        finally:
+            conn.rollback()
+    
+    if job_id:
+        # Статус асинхронной задачи; wait — длинный опрос в секундах
+        try:
+            wait = float(event.get('queryStringParameters', {}).get('wait', 0))
+            job_id = int(job_id)
+        except ValueError:
+            return runtime.error(400, 'wait и job_id должны быть числами')
+        wait = min(max(wait, 0.0), float(runtime.setting('SCAN_JOB_MAX_WAIT', 25)))
+        deadline = time.monotonic() + wait
+        job = get_scan_job(cur, schema, job_id, user_id)
+        if job and job[1] in ('pending', 'processing'):
+            # Очередь разбирается и опросом: задача распознаётся в этом вызове, если её никто не держит
+            # (pending или processing с истёкшей блокировкой)
+            conn.rollback()
+            with tracing.span('job_process'):
+                process_scan_jobs(conn, cur, schema, get_worker_settings(), job_id)
+            job = get_scan_job(cur, schema, job_id, user_id)
+        while job and job[1] in ('pending', 'processing') and time.monotonic() < deadline:
+            conn.rollback()
+            time.sleep(0.5)
+            job = get_scan_job(cur, schema, job_id, user_id)
         
-        elif method == 'GET':
-            # Получение истории сканирований
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            limit = int(event.get('queryStringParameters', {}).get('limit', 20))
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            schema = get_schema()
+        if not job:
+            return runtime.error(404, 'Задача не найдена')
+        
+        return runtime.json_response(200, {
+            'job_id': job[0],
+            'status': job[1],
+            'title': job[2],
+            'category': job[3],
+            'confidence': job[4],
+            'description': job[5],
+            'error': job[6],
+            'scan_id': job[7],
+            'created_at': job[8].isoformat(),
+            'updated_at': job[9].isoformat()
+        })
+    
+    try:
+        limit = parse_limit(event.get('queryStringParameters', {}).get('limit'))
+        cursor = event.get('queryStringParameters', {}).get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, InvalidCursor) as e:
+        return runtime.error(400, str(e))
+    
+    if is_search(event['queryStringParameters']):
+        # Поиск по тексту, категории и уверенности; те же страницы и курсор, что у истории
+        try:
+            options = parse_search_params(event['queryStringParameters'])
+        except InvalidSearchRequest as e:
+            return runtime.error(400, str(e))
+        with tracing.span('search_query'):
+            rows = search_history(cur, schema, user_id, options, limit, after)
+        return runtime.json_response(200, {
+            'scans': [history_item(row) for row in rows[:limit]],
+            'next_cursor': encode_cursor(rows[limit - 1][5], rows[limit - 1][0]) if len(rows) > limit else None
+        })
+    
+    # Keyset-пагинация: страница читается по индексу (user_id, created_at DESC, id DESC)
+    with tracing.span('history_query'):
+        if after:
             cur.execute(
                 f"""
-                SELECT id, title, category, confidence, ai_response, created_at 
+                SELECT id, title, category, confidence, ai_response, created_at, image_url, thumbnail_url 
                 FROM {schema}.scan_history 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC 
+                WHERE user_id = %s AND (created_at, id) < (%s, %s) 
+                ORDER BY created_at DESC, id DESC 
                 LIMIT %s
                 """,
-                (user_id, limit)
+                (user_id, after[0], after[1], limit + 1)
             )
-            
-            scans = []
-            for row in cur.fetchall():
-                scans.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'category': row[2],
-                    'confidence': row[3],
-                    'description': row[4],
-                    'created_at': row[5].isoformat()
-                })
-            
-            # Статистика
+        else:
             cur.execute(
-                f"SELECT COUNT(*), AVG(confidence) FROM {schema}.scan_history WHERE user_id = %s",
-                (user_id,)
+                f"""
+                SELECT id, title, category, confidence, ai_response, created_at, image_url, thumbnail_url 
+                FROM {schema}.scan_history 
+                WHERE user_id = %s 
+                ORDER BY created_at DESC, id DESC 
+                LIMIT %s
+                """,
+                (user_id, limit + 1)
             )
-            stats = cur.fetchone()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'scans': scans,
-                    'total_scans': stats[0] or 0,
-                    'average_confidence': round(stats[1] or 0)
-                }),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
     
+        rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][5], rows[limit - 1][0]) if len(rows) > limit else None
+    
+    scans = [history_item(row) for row in rows[:limit]]
+    
+    # Статистика из агрегатов, которые ведёт триггер на scan_history
+    with tracing.span('stats_query'):
+        cur.execute(
+            f"SELECT total_scans, confidence_sum, confidence_count FROM {schema}.user_scan_stats WHERE user_id = %s",
+            (user_id,)
+        )
+        stats = cur.fetchone() or (0, 0, 0)
+        cur.execute(
+            f"SELECT category, scans FROM {schema}.user_category_stats WHERE user_id = %s ORDER BY scans DESC, category",
+            (user_id,)
+        )
+        categories = [{'category': row[0], 'count': row[1]} for row in cur.fetchall()]
+    
+    return runtime.json_response(200, {
+        'scans': scans,
+        'next_cursor': next_cursor,
+        'total_scans': stats[0],
+        'average_confidence': round(stats[1] / stats[2]) if stats[2] else 0,
+        'categories': categories
+    })
+
+@tracing.traced('scan')
+def handler(event: dict, context) -> dict:
+    """Обработчик сканирования объектов"""
+    route = router.get(event)
+    if route is None:
+        return router.reject(event)
+    
+    with tracing.span('db_checkout'):
+        conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        return route(event, conn, cur)
+    except http_client.UpstreamTimeout as e:
+        conn.rollback()
+        return runtime.error(504, str(e))
+    except ParseError as e:
+        conn.rollback()
+        return runtime.error(502, f'Не удалось разобрать ответ модели: {e}')
     except Exception as e:
         conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        return runtime.error(500, str(e))
     finally:
         cur.close()
-        conn.close()
\ No newline at end of file
+        release_db_connection(conn)
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+Непрозрачный курсор для keyset-пагинации по (created_at, id)
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+import runtime
+
+
+class InvalidCursor(Exception):
+    """Курсор повреждён или подделан"""
+
+
+def encode_cursor(created_at: datetime, scan_id: int) -> str:
+    """Курсор на последнюю строку страницы"""
+    raw = json.dumps([created_at.isoformat(), scan_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """(created_at, id) из курсора; InvalidCursor при ошибке"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, scan_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(scan_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor('Некорректный курсор') from e
+
+
+def parse_limit(value, default: int = 20) -> int:
+    """Размер страницы с жёстким ограничением SCAN_HISTORY_MAX_LIMIT"""
+    max_limit = int(runtime.setting('SCAN_HISTORY_MAX_LIMIT', 100))
+    if value is None:
+        return min(default, max_limit)
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit должен быть целым числом') from None
+    if limit < 1:
+        raise ValueError('limit должен быть положительным')
+    return min(limit, max_limit)
@@ -0,0 +1,178 @@
+"""
+Обслуживание помесячных секций scan_history: создание будущих секций и вывод старых из таблицы,
+заодно чистка устаревших записей recognition_cache и scan_requests.
+Старая секция выгружается в сжатый CSV в хранилище кадров и удаляется; без хранилища только отсоединяется.
+Агрегаты user_scan_stats при этом не меняются: статистика остаётся за всё время, а итоги секции
+до отсоединения пишутся в scan_history_retired_stats, чтобы rebuild_user_scan_stats() их учитывал.
+Будущие секции дополнительно проверяются из пути вставки (ensure_partitions_periodically),
+чтобы новый месяц не остался без секции, если задача обслуживания не запускается
+"""
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import date
+
+from recognition_cache import get_cache_ttl, prune_expired
+import runtime
+import single_flight
+import tracing
+
+PARTITION_RE = re.compile(r'^scan_history_y(\d{4})m(\d{2})$')
+
+_checked_at = None
+_check_lock = threading.Lock()
+
+
+def get_retention_settings() -> dict:
+    """SCAN_HISTORY_RETENTION_MONTHS — сколько прошлых месяцев держать в таблице, 0 — все"""
+    return {
+        'months_ahead': int(runtime.setting('SCAN_HISTORY_PARTITIONS_AHEAD', 3)),
+        'retention_months': int(runtime.setting('SCAN_HISTORY_RETENTION_MONTHS', 0)),
+        'archive_prefix': runtime.setting('SCAN_HISTORY_ARCHIVE_PREFIX', 'archive/scan_history')
+    }
+
+
+def ensure_partitions(cur, schema: str, months_ahead: int) -> int:
+    """Секции до текущего месяца плюс months_ahead; число созданных"""
+    cur.execute(f"SELECT {schema}.create_scan_history_partitions(CURRENT_DATE, %s)", (months_ahead,))
+    return cur.fetchone()[0]
+
+
+def ensure_partitions_periodically(conn, cur, schema: str) -> None:
+    """ensure_partitions при первом вызове в процессе и затем раз в SCAN_PARTITIONS_CHECK_INTERVAL секунд.
+    Если все секции есть, функция в базе только проверяет to_regclass и блокировок не берёт.
+    Ошибка не ломает запрос: вставка в существующую секцию пройдёт и так"""
+    global _checked_at
+    interval = float(runtime.setting('SCAN_PARTITIONS_CHECK_INTERVAL', 3600))
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < interval:
+        return
+    # Параллельный запрос не ждёт проверки, которую уже делает другой поток
+    if not _check_lock.acquire(blocking=False):
+        return
+    try:
+        _checked_at = now
+        with tracing.span('partitions_check'):
+            created = ensure_partitions(cur, schema, get_retention_settings()['months_ahead'])
+            conn.commit()
+        if created:
+            print(json.dumps({'scan_history_partitions_created': created}))
+    except Exception as e:
+        conn.rollback()
+        print(json.dumps({'scan_history_partitions_error': str(e)}, ensure_ascii=False))
+    finally:
+        _check_lock.release()
+
+
+def list_partitions(cur, schema: str) -> list:
+    """[(имя секции, первый день месяца, отсоединение не завершено)] по возрастанию месяца"""
+    cur.execute(
+        """
+        SELECT c.relname, i.inhdetachpending
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = %s AND p.relname = 'scan_history'
+        """,
+        (schema,)
+    )
+    partitions = []
+    for name, detach_pending in cur.fetchall():
+        match = PARTITION_RE.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1), detach_pending))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def retention_cutoff(today: date, retention_months: int) -> date:
+    """Первый день самого старого месяца, который остаётся в таблице"""
+    months = today.year * 12 + today.month - 1 - retention_months
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def archive_partition(cur, schema: str, name: str, store, prefix: str) -> str:
+    """Секция в gzip-CSV через COPY во временный файл на диске; URL архива"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f'{name}.csv.gz')
+        with gzip.open(path, 'wb') as f:
+            cur.copy_expert(f'COPY (SELECT * FROM {schema}.{name} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)', f)
+        key = f"{prefix.strip('/')}/{schema}/{name}.csv.gz"
+        store.put_file(key, path, 'application/gzip')
+    return store.url(key)
+
+
+def record_retired_stats(cur, schema: str, name: str) -> None:
+    """Итоги секции по пользователям и категориям; повтор после сбоя перезаписывает их"""
+    cur.execute(
+        f"""
+        INSERT INTO {schema}.scan_history_retired_stats 
+        (partition_name, user_id, category, scans, confidence_sum, confidence_count) 
+        SELECT %s, user_id, COALESCE(category, 'Другое'), COUNT(*), COALESCE(SUM(confidence), 0), COUNT(confidence) 
+        FROM {schema}.{name} 
+        GROUP BY user_id, COALESCE(category, 'Другое') 
+        ON CONFLICT (partition_name, user_id, category) DO UPDATE SET 
+            scans = EXCLUDED.scans, confidence_sum = EXCLUDED.confidence_sum, confidence_count = EXCLUDED.confidence_count
+        """,
+        (name,)
+    )
+
+
+def detach_partition(conn, cur, schema: str, name: str, detach_pending: bool) -> None:
+    """DETACH PARTITION CONCURRENTLY: вставки и чтения истории не ждут ACCESS EXCLUSIVE на scan_history.
+    Работает только вне транзакции; прерванное отсоединение (detach_pending) доводится FINALIZE"""
+    conn.autocommit = True
+    try:
+        cur.execute(
+            f"ALTER TABLE {schema}.scan_history DETACH PARTITION {schema}.{name} {'FINALIZE' if detach_pending else 'CONCURRENTLY'}"
+        )
+    finally:
+        conn.autocommit = False
+
+
+def run_retention(conn, schema: str, settings: dict, store) -> dict:
+    """Будущие секции, чистка кэша распознавания и ключей повторов, вывод секций старше срока хранения; каждая секция — своя транзакция"""
+    cur = conn.cursor()
+    summary = {'created': 0, 'archived': [], 'detached': [], 'recognition_cache_pruned': 0, 'scan_requests_pruned': 0}
+    try:
+        with tracing.span('partitions_create'):
+            summary['created'] = ensure_partitions(cur, schema, settings['months_ahead'])
+            conn.commit()
+
+        with tracing.span('recognition_cache_prune'):
+            summary['recognition_cache_pruned'] = prune_expired(conn, cur, schema, get_cache_ttl())
+
+        with tracing.span('scan_requests_prune'):
+            summary['scan_requests_pruned'] = single_flight.prune_expired(conn, cur, schema)
+
+        if settings['retention_months'] <= 0:
+            return summary
+
+        cutoff = retention_cutoff(date.today(), settings['retention_months'])
+        for name, month, detach_pending in list_partitions(cur, schema):
+            if month >= cutoff:
+                break
+            with tracing.span('partition_retire'):
+                # Выгрузка до отсоединения: при ошибке хранилища секция остаётся на месте
+                url = archive_partition(cur, schema, name, store, settings['archive_prefix']) if store is not None else None
+                record_retired_stats(cur, schema, name)
+                conn.commit()
+                detach_partition(conn, cur, schema, name, detach_pending)
+                if url:
+                    cur.execute(f'DROP TABLE {schema}.{name}')
+                    summary['archived'].append({'partition': name, 'url': url})
+                else:
+                    cur.execute(f"ALTER TABLE {schema}.{name} RENAME TO {name.replace('scan_history_', 'scan_history_archive_', 1)}")
+                    summary['detached'].append(name)
+                conn.commit()
+            print(json.dumps({'scan_history_retention': name, 'archived': bool(url)}))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return summary
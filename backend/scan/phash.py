@@ -0,0 +1,127 @@
+"""
+Перцептивный хэш кадра и поиск почти одинаковых сканирований
+"""
+import io
+from typing import Optional
+
+import runtime
+
+Image = runtime.lazy_import('PIL.Image')
+
+HASH_SIZE = 8
+_UINT64_MASK = (1 << 64) - 1
+
+
+def dhash(image_bytes: bytes) -> Optional[int]:
+    """Разностный хэш (dHash) на 64 бита, None если кадр не декодируется"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+            small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    except Exception:
+        return None
+
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """Расстояние Хэмминга между двумя хэшами"""
+    return bin(a ^ b).count('1')
+
+
+def to_db(value: int) -> int:
+    """Беззнаковый 64-битный хэш в знаковый BIGINT для Postgres"""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_db(value: int) -> int:
+    """Знаковый BIGINT из Postgres обратно в беззнаковый хэш"""
+    return value & _UINT64_MASK
+
+
+class BKTree:
+    """BK-дерево по метрике Хэмминга"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item) -> None:
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find_nearest(self, value: int, max_distance: int):
+        """Ближайший элемент в пределах max_distance: (расстояние, item) или None"""
+        if self.root is None:
+            return None
+        best = None
+        stack = [self.root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, item)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return best
+
+
+def get_max_distance() -> int:
+    """Порог расстояния Хэмминга, при котором кадры считаются одинаковыми"""
+    return int(runtime.setting('PHASH_MAX_DISTANCE', 10))
+
+
+def find_recent_duplicate(cur, schema: str, user_id, value: int, ai_responses_enabled: bool) -> Optional[dict]:
+    """Поиск недавнего сканирования пользователя с похожим кадром"""
+    max_distance = get_max_distance()
+    if max_distance < 0:
+        return None
+
+    cur.execute(
+        f"""
+        SELECT phash, title, category, confidence, ai_response
+        FROM {schema}.scan_history
+        WHERE user_id = %s AND phash IS NOT NULL
+          AND created_at > NOW() - make_interval(secs => %s)
+        ORDER BY created_at DESC
+        LIMIT %s
+        """,
+        (
+            user_id,
+            int(runtime.setting('PHASH_WINDOW_SECONDS', 3600)),
+            int(runtime.setting('PHASH_LOOKBACK', 50))
+        )
+    )
+
+    tree = BKTree()
+    for row in cur.fetchall():
+        # Без описания прошлый результат не подходит, если описание нужно сейчас
+        if ai_responses_enabled and not row[4]:
+            continue
+        tree.add(from_db(row[0]), row)
+
+    match = tree.find_nearest(value, max_distance)
+    if match is None:
+        return None
+
+    row = match[1]
+    analysis = {'title': row[1], 'category': row[2], 'confidence': row[3]}
+    if row[4]:
+        analysis['description'] = row[4]
+    return analysis
@@ -0,0 +1,166 @@
+"""
+Допуск к распознаванию по token bucket: ведро на пользователя и общее ведро функции.
+Пакетные и отложенные сканирования не забирают резерв общего ведра, оставленный одиночным
+"""
+import math
+import threading
+import time
+from typing import Optional
+
+import runtime
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+
+class Bucket:
+    """Запрос на списание: ключ, ёмкость, пополнение в секунду, стоимость и неприкосновенный остаток"""
+
+    def __init__(self, key: str, capacity: float, rate: float, cost: float, reserve: float = 0.0):
+        self.key = key
+        self.capacity = capacity
+        self.rate = rate
+        # Стоимость больше ёмкости за вычетом резерва не наберётся никогда: такие запросы отсекает max_cost
+        self.cost = cost
+        self.reserve = reserve
+
+    def retry_after(self, available: float) -> Optional[float]:
+        """None, если токенов хватает, иначе секунды до пополнения"""
+        missing = self.cost + self.reserve - available
+        if missing <= 0:
+            return None
+        return missing / self.rate if self.rate > 0 else 3600.0
+
+
+class MemoryBucketStore:
+    """Вёдра в памяти процесса: для локального запуска и одного экземпляра"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def admit(self, buckets: list) -> Optional[float]:
+        """Списание со всех вёдер или ни с одного; секунды до повтора при отказе"""
+        now = time.monotonic()
+        with self._lock:
+            available = {}
+            for bucket in buckets:
+                tokens, updated = self._buckets.get(bucket.key, (bucket.capacity, now))
+                available[bucket.key] = min(bucket.capacity, tokens + (now - updated) * bucket.rate)
+            waits = [bucket.retry_after(available[bucket.key]) for bucket in buckets]
+            denied = [wait for wait in waits if wait is not None]
+            for bucket in buckets:
+                tokens = available[bucket.key] - (0 if denied else bucket.cost)
+                self._buckets[bucket.key] = (tokens, now)
+            return max(denied) if denied else None
+
+    def refund(self, buckets: list) -> None:
+        """Возврат стоимости в вёдра, не больше ёмкости"""
+        now = time.monotonic()
+        with self._lock:
+            for bucket in buckets:
+                tokens, updated = self._buckets.get(bucket.key, (bucket.capacity, now))
+                tokens = min(bucket.capacity, tokens + (now - updated) * bucket.rate)
+                self._buckets[bucket.key] = (min(bucket.capacity, tokens + bucket.cost), now)
+
+
+class PostgresBucketStore:
+    """Вёдра в таблице rate_limit_buckets: лимиты общие для всех экземпляров функции.
+    Строки вёдер заблокированы до конца транзакции, её нужно сразу завершить"""
+
+    def __init__(self, cur, schema: str):
+        self.cur = cur
+        self.schema = schema
+
+    def admit(self, buckets: list) -> Optional[float]:
+        available = {}
+        for bucket in buckets:
+            # Пополнение по прошедшему времени с блокировкой строки ведра
+            self.cur.execute(
+                f"""
+                INSERT INTO {self.schema}.rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+                VALUES (%s, %s, clock_timestamp())
+                ON CONFLICT (bucket_key) DO UPDATE SET
+                    tokens = LEAST(EXCLUDED.tokens, b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at) * %s),
+                    updated_at = clock_timestamp()
+                RETURNING tokens
+                """,
+                (bucket.key, bucket.capacity, bucket.rate)
+            )
+            available[bucket.key] = self.cur.fetchone()[0]
+        denied = [wait for wait in (bucket.retry_after(available[bucket.key]) for bucket in buckets) if wait is not None]
+        if denied:
+            return max(denied)
+        for bucket in buckets:
+            self.cur.execute(
+                f"UPDATE {self.schema}.rate_limit_buckets SET tokens = tokens - %s WHERE bucket_key = %s",
+                (bucket.cost, bucket.key)
+            )
+        return None
+
+    def refund(self, buckets: list) -> None:
+        for bucket in buckets:
+            self.cur.execute(
+                f"UPDATE {self.schema}.rate_limit_buckets SET tokens = LEAST(%s, tokens + %s) WHERE bucket_key = %s",
+                (bucket.capacity, bucket.cost, bucket.key)
+            )
+
+
+_memory_store = MemoryBucketStore()
+
+
+def get_limits() -> dict:
+    """Ёмкость и пополнение в минуту для вёдер пользователя и функции, доля резерва для одиночных сканирований"""
+    return {
+        # Не меньше SCAN_BATCH_MAX_ITEMS по умолчанию: полный пакет проходит с полного ведра
+        'user_burst': float(runtime.setting('RATE_LIMIT_USER_BURST', 20)),
+        'user_per_minute': float(runtime.setting('RATE_LIMIT_USER_PER_MINUTE', 30)),
+        'global_burst': float(runtime.setting('RATE_LIMIT_GLOBAL_BURST', 200)),
+        'global_per_minute': float(runtime.setting('RATE_LIMIT_GLOBAL_PER_MINUTE', 600)),
+        'batch_reserve': float(runtime.setting('RATE_LIMIT_BATCH_RESERVE', 0.25))
+    }
+
+
+def get_backend() -> str:
+    """RATE_LIMIT_BACKEND: postgres (по умолчанию), memory или off"""
+    return runtime.setting('RATE_LIMIT_BACKEND', 'postgres')
+
+
+def get_reserve(limits: dict, lane: str) -> float:
+    return limits['global_burst'] * limits['batch_reserve'] if lane == BATCH else 0.0
+
+
+def scan_buckets(user_id, cost: int, lane: str) -> list:
+    limits = get_limits()
+    return [
+        Bucket(f'user:{user_id}', limits['user_burst'], limits['user_per_minute'] / 60, cost),
+        Bucket('global', limits['global_burst'], limits['global_per_minute'] / 60, cost, get_reserve(limits, lane))
+    ]
+
+
+def max_cost(lane: str = INTERACTIVE) -> float:
+    """Наибольшая стоимость одного запроса: больше ёмкости вёдер запрос не пройдёт никогда, и его нужно отклонить сразу"""
+    if get_backend() == 'off':
+        return math.inf
+    limits = get_limits()
+    return min(limits['user_burst'], limits['global_burst'] - get_reserve(limits, lane))
+
+
+def get_store(cur, schema: str):
+    return _memory_store if get_backend() == 'memory' else PostgresBucketStore(cur, schema)
+
+
+def admit(cur, schema: str, user_id, cost: int, lane: str = INTERACTIVE) -> Optional[int]:
+    """None, если сканирование допущено, иначе целое число секунд для Retry-After.
+    Стоимость списывается целиком; запрос дороже max_cost отклоняется до вызова"""
+    if get_backend() == 'off':
+        return None
+    retry_after = get_store(cur, schema).admit(scan_buckets(user_id, cost, lane))
+    return None if retry_after is None else max(1, math.ceil(retry_after))
+
+
+def refund(cur, schema: str, user_id, cost: int, lane: str = INTERACTIVE) -> None:
+    """Возврат списанного, если допущенный запрос так и не дошёл до распознавания (например, склеился с повтором)"""
+    if get_backend() == 'off':
+        return
+    get_store(cur, schema).refund(scan_buckets(user_id, cost, lane))
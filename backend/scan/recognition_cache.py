@@ -0,0 +1,153 @@
+"""
+Кэш результатов распознавания по содержимому изображения
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import runtime
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """SHA-256 исходных байтов кадра: основа ключа кэша и ключей хранилища"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def make_cache_key(digest: str, ai_responses_enabled: bool) -> str:
+    """Ключ кэша: image_digest кадра плюс флаг AI-ответов"""
+    return f"{digest}:{1 if ai_responses_enabled else 0}"
+
+
+class MemoryCacheBackend:
+    """LRU-кэш в памяти процесса с временем жизни записей"""
+
+    def __init__(self, max_size: int = 256, ttl: int = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class PostgresCacheBackend:
+    """Кэш в таблице recognition_cache, переживает холодный старт функции"""
+
+    def __init__(self, cur, schema: str, ttl: int = 3600):
+        self.cur = cur
+        self.schema = schema
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[dict]:
+        self.cur.execute(
+            f"""
+            SELECT result FROM {self.schema}.recognition_cache
+            WHERE cache_key = %s AND created_at > NOW() - make_interval(secs => %s)
+            """,
+            (key, self.ttl)
+        )
+        row = self.cur.fetchone()
+        if not row:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        self.cur.execute(
+            f"""
+            INSERT INTO {self.schema}.recognition_cache (cache_key, result, created_at)
+            VALUES (%s, %s, NOW())
+            ON CONFLICT (cache_key) DO UPDATE SET result = EXCLUDED.result, created_at = EXCLUDED.created_at
+            """,
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+
+class RecognitionCache:
+    """Цепочка бэкендов: сначала быстрые, попадание в медленном прогревает быстрые"""
+
+    def __init__(self, backends: list):
+        self.backends = backends
+
+    def get(self, key: str) -> Optional[dict]:
+        for index, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not None:
+                for faster in self.backends[:index]:
+                    faster.set(key, value)
+                return value
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        for backend in self.backends:
+            backend.set(key, value)
+
+
+def get_cache_ttl() -> int:
+    """Время жизни записи кэша в секундах"""
+    return int(runtime.setting('RECOGNITION_CACHE_TTL', 86400))
+
+
+def prune_expired(conn, cur, schema: str, ttl: int, batch_size: int = 5000) -> int:
+    """Удаление записей старше ttl порциями по индексу created_at, каждая порция — своя транзакция; число удалённых.
+    Фильтр TTL в get только скрывает такие строки, сами они без чистки копятся"""
+    deleted = 0
+    while True:
+        cur.execute(
+            f"""
+            DELETE FROM {schema}.recognition_cache
+            WHERE cache_key IN (
+                SELECT cache_key FROM {schema}.recognition_cache
+                WHERE created_at < NOW() - make_interval(secs => %s)
+                ORDER BY created_at
+                LIMIT %s
+            )
+            """,
+            (ttl, batch_size)
+        )
+        conn.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            return deleted
+
+
+# Живёт между тёплыми вызовами функции
+_memory_backend = MemoryCacheBackend(
+    max_size=int(runtime.setting('RECOGNITION_CACHE_SIZE', 256)),
+    ttl=get_cache_ttl()
+)
+
+
+def get_recognition_cache(cur, schema: str) -> RecognitionCache:
+    """Сборка кэша по настройке RECOGNITION_CACHE_BACKEND (memory, postgres или memory,postgres)"""
+    names = runtime.setting('RECOGNITION_CACHE_BACKEND', 'memory,postgres')
+    backends = []
+    for name in (n.strip() for n in names.split(',')):
+        if name == 'memory':
+            backends.append(_memory_backend)
+        elif name == 'postgres':
+            backends.append(PostgresCacheBackend(cur, schema, get_cache_ttl()))
+    return RecognitionCache(backends)
@@ -0,0 +1,161 @@
+"""
+Распознаватели кадра: локальная CPU-модель для основных категорий и OpenAI Vision,
+маршрутизация между ними по уверенности локальной модели.
+Локальной модели нужны numpy и onnxruntime; в requirements.txt их нет, чтобы не утяжелять
+каждую сборку: без них (или без LOCAL_MODEL_PATH) все кадры идут в Vision
+"""
+import abc
+import io
+import json
+import threading
+import time
+from typing import Optional
+
+import runtime
+import tracing
+
+Image = runtime.lazy_import('PIL.Image')
+
+CATEGORIES = ('Фрукты', 'Овощи', 'Животные', 'Электроника', 'Транспорт', 'Одежда', 'Мебель', 'Растения', 'Еда', 'Другое')
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class Recognizer(abc.ABC):
+    """Интерфейс распознавателя"""
+    name = 'base'
+
+    def available(self) -> bool:
+        return True
+
+    @abc.abstractmethod
+    def recognize(self, image_bytes: bytes, ai_responses_enabled: bool) -> dict:
+        """Результат в формате analyze_image: title, category, confidence (0-100), опционально description"""
+
+
+class RemoteRecognizer(Recognizer):
+    """OpenAI Vision через переданную функцию analyze(image_bytes, ai_responses_enabled)"""
+    name = 'openai'
+
+    def __init__(self, analyze):
+        self.analyze = analyze
+
+    def recognize(self, image_bytes: bytes, ai_responses_enabled: bool) -> dict:
+        return self.analyze(image_bytes, ai_responses_enabled)
+
+
+def parse_labels(value: Optional[str]) -> tuple:
+    """LOCAL_MODEL_LABELS: 'яблоко:Фрукты,кошка:Животные,...' в порядке выходов модели -> ((метка, категория), ...).
+    Метка без категории сама должна быть одной из CATEGORIES, иначе попадает в 'Другое'"""
+    if not value:
+        return tuple((category, category) for category in CATEGORIES)
+    labels = []
+    for item in value.split(','):
+        label, _, category = item.partition(':')
+        label, category = label.strip(), (category.strip() or label.strip())
+        labels.append((label, category if category in CATEGORIES else 'Другое'))
+    return tuple(labels)
+
+
+class OnnxCategoryRecognizer(Recognizer):
+    """Квантованная модель класса MobileNet в ONNX, выход — логиты по меткам (метка, категория);
+    метка становится названием объекта, категория — одной из CATEGORIES"""
+    name = 'local'
+
+    def __init__(self, model_path: Optional[str], labels: tuple = parse_labels(None), input_size: int = 224):
+        self.model_path = model_path
+        self.labels = labels
+        self.input_size = input_size
+        self._session = None
+        self._load_failed = False
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        """Ленивая загрузка onnxruntime и модели: холодный старт без модели не платит за импорт"""
+        if self._session is not None or self._load_failed:
+            return self._session
+        with self._lock:
+            if self._session is None and not self._load_failed:
+                try:
+                    import onnxruntime
+                    options = onnxruntime.SessionOptions()
+                    options.intra_op_num_threads = int(runtime.setting('LOCAL_MODEL_THREADS', 1))
+                    self._session = onnxruntime.InferenceSession(
+                        self.model_path, options, providers=['CPUExecutionProvider']
+                    )
+                except Exception as e:
+                    print(json.dumps({'local_model_unavailable': str(e)}, ensure_ascii=False))
+                    self._load_failed = True
+        return self._session
+
+    def available(self) -> bool:
+        return bool(self.model_path) and self._get_session() is not None
+
+    def _preprocess(self, image_bytes: bytes):
+        import numpy as np
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft('RGB', (self.input_size * 2, self.input_size * 2))
+            image = image.convert('RGB').resize((self.input_size, self.input_size), Image.BILINEAR)
+        pixels = np.asarray(image, dtype=np.float32) / 255.0
+        pixels = (pixels - np.array(IMAGENET_MEAN, dtype=np.float32)) / np.array(IMAGENET_STD, dtype=np.float32)
+        return pixels.transpose(2, 0, 1)[np.newaxis, ...]
+
+    def recognize(self, image_bytes: bytes, ai_responses_enabled: bool) -> dict:
+        import numpy as np
+        session = self._get_session()
+        inputs = {session.get_inputs()[0].name: self._preprocess(image_bytes)}
+        logits = session.run(None, inputs)[0][0].astype(np.float64)
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        best = int(probabilities.argmax())
+        label, category = self.labels[best]
+        return {
+            'title': label,
+            'category': category,
+            'confidence': int(round(float(probabilities[best]) * 100))
+        }
+
+
+_local_recognizer = None
+
+
+def get_local_recognizer() -> OnnxCategoryRecognizer:
+    """Локальный распознаватель процесса; модель загружается при первом использовании"""
+    global _local_recognizer
+    if _local_recognizer is None:
+        _local_recognizer = OnnxCategoryRecognizer(
+            runtime.setting('LOCAL_MODEL_PATH'),
+            labels=parse_labels(runtime.setting('LOCAL_MODEL_LABELS')),
+            input_size=int(runtime.setting('LOCAL_MODEL_INPUT_SIZE', 224))
+        )
+    return _local_recognizer
+
+
+def route_recognition(image_bytes: bytes, ai_responses_enabled: bool, local: Recognizer, remote: Recognizer) -> tuple:
+    """Сначала локальная модель; Vision — при нужном описании или уверенности ниже порога.
+    Возвращает (результат, {'route': ..., '<backend>_ms': ...})"""
+    threshold = float(runtime.setting('LOCAL_CONFIDENCE_THRESHOLD', 85))
+    routing = {}
+
+    if not ai_responses_enabled and local.available():
+        started = time.monotonic()
+        try:
+            with tracing.span(f'{local.name}_model'):
+                result = local.recognize(image_bytes, ai_responses_enabled)
+        except Exception as e:
+            print(json.dumps({'local_model_error': str(e)}, ensure_ascii=False))
+            result = None
+        routing[f'{local.name}_ms'] = round((time.monotonic() - started) * 1000, 2)
+        if result is not None:
+            routing['local_confidence'] = result['confidence']
+            if result['confidence'] >= threshold:
+                routing['route'] = local.name
+                return result, routing
+        routing['route'] = f'{local.name}_fallback_{remote.name}'
+    else:
+        routing['route'] = remote.name
+
+    started = time.monotonic()
+    result = remote.recognize(image_bytes, ai_responses_enabled)
+    routing[f'{remote.name}_ms'] = round((time.monotonic() - started) * 1000, 2)
+    return result, routing
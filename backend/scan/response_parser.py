@@ -0,0 +1,98 @@
+"""
+Разбор ответа модели: JSON-объект из текста с обёрткой или пояснениями, проверка схемы,
+одна дешёвая попытка починки и счётчики ошибок разбора
+"""
+import json
+import threading
+
+from recognizers import CATEGORIES
+
+_decoder = json.JSONDecoder()
+_CATEGORY_LOOKUP = {category.lower(): category for category in CATEGORIES}
+_metrics = {'parsed': 0, 'repaired': 0, 'failed': 0}
+_metrics_lock = threading.Lock()
+
+
+class ParseError(Exception):
+    """В ответе модели нет пригодного JSON-объекта"""
+
+
+def _count(name: str) -> None:
+    with _metrics_lock:
+        _metrics[name] += 1
+
+
+def get_metrics() -> dict:
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def extract_object(content: str) -> dict:
+    """Первый JSON-объект в тексте: в ```json```, в ``` или без обёртки, с текстом вокруг.
+    Один проход по кандидатам '{' без разрезания строки"""
+    position = content.find('{')
+    while position != -1:
+        try:
+            value, _ = _decoder.raw_decode(content, position)
+        except ValueError:
+            position = content.find('{', position + 1)
+            continue
+        if isinstance(value, dict):
+            return value
+        position = content.find('{', position + 1)
+    raise ParseError('В ответе модели нет JSON-объекта')
+
+
+def validate_analysis(data: dict) -> dict:
+    """Приведение к схеме: непустой title, category из списка, confidence в 0-100"""
+    title = data.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise ParseError('В ответе модели нет названия объекта')
+
+    category = data.get('category')
+    category = _CATEGORY_LOOKUP.get(category.strip().lower(), 'Другое') if isinstance(category, str) else 'Другое'
+
+    try:
+        confidence = int(round(float(data.get('confidence'))))
+    except (TypeError, ValueError):
+        confidence = 50
+    result = {'title': title.strip()[:255], 'category': category, 'confidence': max(0, min(100, confidence))}
+
+    description = data.get('description')
+    if isinstance(description, str) and description.strip():
+        result['description'] = description.strip()
+    return result
+
+
+def _parse(content: str) -> dict:
+    return validate_analysis(extract_object(content or ''))
+
+
+def _fail(error: ParseError, content: str) -> None:
+    _count('failed')
+    print(json.dumps({
+        'model_output_parse_error': str(error),
+        'content': (content or '')[:500],
+        'totals': get_metrics()
+    }, ensure_ascii=False))
+
+
+def parse_analysis(content: str, repair=None) -> dict:
+    """Результат распознавания из текста модели. repair(content) -> str вызывается один раз,
+    только если разобрать не удалось; ParseError, если не помогло и это"""
+    try:
+        result = _parse(content)
+    except ParseError as e:
+        if repair is None:
+            _fail(e, content)
+            raise
+        repaired = repair(content or '')
+        try:
+            result = _parse(repaired)
+        except ParseError as e:
+            _fail(e, repaired)
+            raise
+        _count('repaired')
+        return result
+    _count('parsed')
+    return result
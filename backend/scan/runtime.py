@@ -0,0 +1,99 @@
+"""
+Общая обвязка обработчиков: маршруты по HTTP-методу, заранее собранные заголовки ответов,
+настройки окружения, прочитанные один раз на процесс, и отложенный импорт тяжёлых модулей
+"""
+import importlib
+import json
+import os
+import time
+
+_LOADED = time.perf_counter()
+_cold = True
+_settings = {}
+
+# Общие словари заголовков не изменяются: tracing.traced копирует их перед добавлением своих
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к атрибуту"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> LazyModule:
+    """psycopg2, PIL, http.client и т.п. — только на путях, где они нужны"""
+    return LazyModule(name)
+
+
+def setting(name: str, default=None):
+    """Переменная окружения, прочитанная один раз на процесс"""
+    try:
+        return _settings[name]
+    except KeyError:
+        value = _settings[name] = os.environ.get(name, default)
+        return value
+
+
+def clear_settings() -> None:
+    """Сброс прочитанных настроек (после смены окружения в тестах и бенчмарках)"""
+    _settings.clear()
+
+
+def get_schema() -> str:
+    return setting('MAIN_DB_SCHEMA', 'public')
+
+
+def json_response(status: int, payload, headers: dict = JSON_HEADERS) -> dict:
+    return {'statusCode': status, 'headers': headers, 'body': json.dumps(payload), 'isBase64Encoded': False}
+
+
+def error(status: int, message: str, headers: dict = JSON_HEADERS) -> dict:
+    return json_response(status, {'error': message}, headers)
+
+
+def take_cold_start():
+    """Миллисекунды от загрузки модулей функции до первого вызова в процессе, затем None"""
+    global _cold
+    if not _cold:
+        return None
+    _cold = False
+    return round((time.perf_counter() - _LOADED) * 1000, 2)
+
+
+class Router:
+    """Таблица {метод: функция}; OPTIONS и неподдерживаемые методы отвечают готовыми ответами"""
+
+    def __init__(self, allow_headers: str = 'Content-Type, X-User-Id'):
+        self.routes = {}
+        self.preflight_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'OPTIONS',
+            'Access-Control-Allow-Headers': allow_headers
+        }
+
+    def route(self, method: str):
+        """Декоратор: @router.route('GET')"""
+        def register(fn):
+            self.routes[method] = fn
+            self.preflight_headers['Access-Control-Allow-Methods'] = ', '.join(list(self.routes) + ['OPTIONS'])
+            return fn
+        return register
+
+    def get(self, event: dict):
+        """Функция маршрута для метода запроса или None"""
+        return self.routes.get(event.get('httpMethod', 'GET'))
+
+    def reject(self, event: dict) -> dict:
+        """Ответ на запрос без маршрута: CORS preflight или 405"""
+        if event.get('httpMethod', 'GET') == 'OPTIONS':
+            return {'statusCode': 200, 'headers': self.preflight_headers, 'body': '', 'isBase64Encoded': False}
+        return error(405, 'Метод не поддерживается')
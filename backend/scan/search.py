@@ -0,0 +1,89 @@
+"""
+Поиск по истории сканирований: текст в title и ai_response (tsvector, конфигурация russian),
+категория и диапазон уверенности. Порядок и курсор — как у обычной истории, по (created_at, id)
+"""
+import re
+from typing import Optional
+
+SEARCH_PARAMS = ('q', 'category', 'min_confidence', 'max_confidence')
+MAX_QUERY_LENGTH = 200
+# Должно совпадать с выражением индекса idx_scan_history_search (V0012)
+SEARCH_DOCUMENT = "to_tsvector('russian', coalesce(title, '') || ' ' || coalesce(ai_response, ''))"
+_WORD = re.compile(r'\w+')
+
+
+class InvalidSearchRequest(Exception):
+    """Некорректный фильтр поиска"""
+
+
+def is_search(params: dict) -> bool:
+    """Запрос истории с хотя бы одним фильтром поиска"""
+    return any(params.get(name) for name in SEARCH_PARAMS)
+
+
+def _parse_confidence(value: Optional[str], name: str) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        confidence = int(value)
+    except ValueError as e:
+        raise InvalidSearchRequest(f'{name} должен быть целым числом') from e
+    if not 0 <= confidence <= 100:
+        raise InvalidSearchRequest(f'{name} должен быть от 0 до 100')
+    return confidence
+
+
+def to_tsquery_text(query: str) -> Optional[str]:
+    """Слова запроса как префиксы через И: 'ябл зел' -> 'ябл:* & зел:*'; без слов — None.
+    Из запроса берутся только буквы и цифры, поэтому синтаксис tsquery в него не попадает"""
+    words = _WORD.findall(query)
+    return ' & '.join(f'{word}:*' for word in words) if words else None
+
+
+def parse_search_params(params: dict) -> dict:
+    query = (params.get('q') or '').strip()
+    if len(query) > MAX_QUERY_LENGTH:
+        raise InvalidSearchRequest(f'Запрос длиннее {MAX_QUERY_LENGTH} символов')
+    min_confidence = _parse_confidence(params.get('min_confidence'), 'min_confidence')
+    max_confidence = _parse_confidence(params.get('max_confidence'), 'max_confidence')
+    if min_confidence is not None and max_confidence is not None and min_confidence > max_confidence:
+        raise InvalidSearchRequest('min_confidence больше max_confidence')
+    return {
+        'query': to_tsquery_text(query) if query else None,
+        'category': params.get('category') or None,
+        'min_confidence': min_confidence,
+        'max_confidence': max_confidence
+    }
+
+
+def search_history(cur, schema: str, user_id, options: dict, limit: int, after: Optional[tuple]) -> list:
+    """До limit + 1 строк (лишняя — признак следующей страницы) в порядке created_at DESC, id DESC"""
+    conditions = ['user_id = %s']
+    values = [user_id]
+    if options['query']:
+        conditions.append(f"{SEARCH_DOCUMENT} @@ to_tsquery('russian', %s)")
+        values.append(options['query'])
+    if options['category']:
+        conditions.append('category = %s')
+        values.append(options['category'])
+    if options['min_confidence'] is not None:
+        conditions.append('confidence >= %s')
+        values.append(options['min_confidence'])
+    if options['max_confidence'] is not None:
+        conditions.append('confidence <= %s')
+        values.append(options['max_confidence'])
+    if after:
+        conditions.append('(created_at, id) < (%s, %s)')
+        values.extend(after)
+
+    cur.execute(
+        f"""
+        SELECT id, title, category, confidence, ai_response, created_at, image_url, thumbnail_url
+        FROM {schema}.scan_history
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+        """,
+        values + [limit + 1]
+    )
+    return cur.fetchall()
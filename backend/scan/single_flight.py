@@ -0,0 +1,105 @@
+"""
+Склейка повторных запросов: одинаковый кадр пользователя распознаётся один раз,
+повтор с тем же Idempotency-Key возвращает исходный scan_id
+"""
+from typing import Optional
+
+import runtime
+
+DIGEST_PREFIX = 'image:'
+IDEMPOTENCY_PREFIX = 'key:'
+
+
+def get_idempotency_key(event: dict) -> Optional[str]:
+    """Заголовок Idempotency-Key (регистр имени не важен)"""
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'idempotency-key' and value:
+            return str(value).strip()[:200]
+    return None
+
+
+def get_windows() -> tuple:
+    """Сколько секунд повтор кадра без ключа и повтор с ключом получают прежний результат"""
+    return (
+        int(runtime.setting('SCAN_DEDUPE_WINDOW', 10)),
+        int(runtime.setting('SCAN_IDEMPOTENCY_TTL', 86400))
+    )
+
+
+def find_previous(cur, schema: str, user_id, cache_key: str, idempotency_key: Optional[str]):
+    """Уже сохранённое сканирование этого кадра или ключа без блокировки:
+    (scan_id, created_at, результат, (image_url, thumbnail_url)) или None"""
+    dedupe_window, idempotency_ttl = get_windows()
+    cur.execute(
+        f"""
+        SELECT h.id, h.created_at, h.title, h.category, h.confidence, h.ai_response, h.image_url, h.thumbnail_url 
+        FROM {schema}.scan_requests r 
+        JOIN {schema}.scan_history h ON h.id = r.scan_id 
+            -- Граница по created_at отсекает старые месячные секции истории
+            AND h.created_at > NOW() - make_interval(secs => %s) 
+        WHERE r.user_id = %s AND (
+            (r.request_key = %s AND r.created_at > NOW() - make_interval(secs => %s)) 
+            OR (r.request_key = %s AND r.created_at > NOW() - make_interval(secs => %s))
+        ) 
+        ORDER BY r.created_at DESC 
+        LIMIT 1
+        """,
+        (
+            # Запас на расхождение часов: created_at истории пишет приложение
+            max(dedupe_window, idempotency_ttl if idempotency_key else 0) + 3600,
+            user_id,
+            DIGEST_PREFIX + cache_key, dedupe_window,
+            IDEMPOTENCY_PREFIX + (idempotency_key or ''), idempotency_ttl if idempotency_key else 0
+        )
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], {'title': row[2], 'category': row[3], 'confidence': row[4], 'description': row[5]}, (row[6], row[7])
+
+
+def claim_scan(cur, schema: str, user_id, cache_key: str, idempotency_key: Optional[str]):
+    """Блокировка на (пользователь, кадр) до конца транзакции; параллельный дубль ждёт здесь.
+    Возвращает то же, что find_previous, уже под блокировкой"""
+    cur.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', (int(user_id), cache_key))
+    return find_previous(cur, schema, user_id, cache_key, idempotency_key)
+
+
+def remember_scan(cur, schema: str, user_id, cache_key: str, idempotency_key: Optional[str], scan_id: int) -> None:
+    """Запись ключей нового сканирования в той же транзакции, что и строка истории"""
+    keys = [DIGEST_PREFIX + cache_key]
+    if idempotency_key:
+        keys.append(IDEMPOTENCY_PREFIX + idempotency_key)
+    for key in keys:
+        cur.execute(
+            f"""
+            INSERT INTO {schema}.scan_requests (user_id, request_key, scan_id) 
+            VALUES (%s, %s, %s) 
+            ON CONFLICT (user_id, request_key) DO UPDATE SET scan_id = EXCLUDED.scan_id, created_at = CURRENT_TIMESTAMP
+            """,
+            (user_id, key, scan_id)
+        )
+
+
+def prune_expired(conn, cur, schema: str, batch_size: int = 5000) -> int:
+    """Удаление ключей старше самого длинного окна порциями по индексу created_at, каждая порция — своя транзакция;
+    число удалённых. claim_scan такие ключи уже не находит"""
+    window = max(get_windows())
+    deleted = 0
+    while True:
+        cur.execute(
+            f"""
+            DELETE FROM {schema}.scan_requests
+            WHERE (user_id, request_key) IN (
+                SELECT user_id, request_key FROM {schema}.scan_requests
+                WHERE created_at < NOW() - make_interval(secs => %s)
+                ORDER BY created_at
+                LIMIT %s
+            )
+            """,
+            (window, batch_size)
+        )
+        conn.commit()
+        deleted += cur.rowcount
+        if cur.rowcount < batch_size:
+            return deleted
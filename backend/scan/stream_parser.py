@@ -0,0 +1,83 @@
+"""
+Инкрементальный разбор JSON-ответа модели по мере поступления потока
+"""
+import json
+import re
+
+_STRING_FIELD = r'"{name}"\s*:\s*"((?:[^"\\]|\\.)*)"'
+_TITLE_RE = re.compile(_STRING_FIELD.format(name='title'))
+_CATEGORY_RE = re.compile(_STRING_FIELD.format(name='category'))
+_CONFIDENCE_RE = re.compile(r'"confidence"\s*:\s*(-?\d+(?:\.\d+)?)\s*[,}\s]')
+_DESCRIPTION_START_RE = re.compile(r'"description"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class StreamingFieldParser:
+    """Находит title/category/confidence как только они появились и отдаёт description по кускам"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.fields = {}
+        self.fields_emitted = False
+        self.description_pos = None
+        self.description_done = False
+
+    def feed(self, delta: str) -> list:
+        """Добавить кусок текста; возвращает события ('fields', dict) и ('description', str)"""
+        self.buffer += delta
+        events = []
+
+        for name, pattern in (('title', _TITLE_RE), ('category', _CATEGORY_RE)):
+            if name not in self.fields:
+                match = pattern.search(self.buffer)
+                if match:
+                    self.fields[name] = json.loads(f'"{match.group(1)}"')
+        if 'confidence' not in self.fields:
+            match = _CONFIDENCE_RE.search(self.buffer)
+            if match:
+                self.fields['confidence'] = json.loads(match.group(1))
+
+        if self.description_pos is None:
+            match = _DESCRIPTION_START_RE.search(self.buffer)
+            if match:
+                self.description_pos = match.end()
+
+        # Поля отдаём один раз: когда найдены все три или уже пошло описание
+        if not self.fields_emitted and (len(self.fields) == 3 or self.description_pos is not None):
+            self.fields_emitted = True
+            events.append(('fields', dict(self.fields)))
+
+        if self.description_pos is not None and not self.description_done:
+            text = self._read_description()
+            if text:
+                events.append(('description', text))
+        return events
+
+    def _read_description(self) -> str:
+        """Декодирует строку description до последнего целого символа в буфере"""
+        chunks = []
+        i = self.description_pos
+        buffer = self.buffer
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.description_done = True
+                i += 1
+                break
+            if char != '\\':
+                chunks.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break
+            escape = buffer[i + 1]
+            if escape == 'u':
+                if i + 6 > len(buffer):
+                    break
+                chunks.append(chr(int(buffer[i + 2:i + 6], 16)))
+                i += 6
+            else:
+                chunks.append(_ESCAPES.get(escape, escape))
+                i += 2
+        self.description_pos = i
+        return ''.join(chunks)
@@ -0,0 +1,99 @@
+"""
+Бинарная загрузка кадра: тело image/* или multipart/form-data, в том числе isBase64Encoded от шлюза.
+Байты изображения читаются сразу в bytes, без base64-строки внутри JSON
+"""
+import base64
+import binascii
+import re
+from typing import Optional
+
+_DISPOSITION_PARAM_RE = re.compile(r';\s*(name|filename)="([^"]*)"', re.IGNORECASE)
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_TRUE = ('1', 'true', 'yes')
+
+
+class InvalidUpload(Exception):
+    """Тело запроса не удалось разобрать"""
+
+
+def get_header(event: dict, name: str) -> Optional[str]:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def get_body_bytes(event: dict) -> bytes:
+    """Тело как bytes: шлюз присылает бинарные данные в base64 с isBase64Encoded"""
+    body = event.get('body') or b''
+    if isinstance(body, bytes):
+        return body
+    if event.get('isBase64Encoded'):
+        try:
+            return base64.b64decode(body, validate=True)
+        except (binascii.Error, ValueError) as e:
+            raise InvalidUpload('Некорректное тело запроса') from e
+    try:
+        return body.encode('latin-1')
+    except UnicodeEncodeError as e:
+        raise InvalidUpload('Бинарное тело должно приходить с isBase64Encoded') from e
+
+
+def parse_multipart(body: bytes, boundary: bytes) -> tuple:
+    """Поля формы и файлы [(имя поля, байты)] за один проход по разделителям"""
+    delimiter = b'--' + boundary
+    fields = {}
+    files = []
+    position = body.find(delimiter)
+    if position == -1:
+        raise InvalidUpload('В теле multipart нет разделителя')
+    while True:
+        position += len(delimiter)
+        if body[position:position + 2] == b'--':
+            return fields, files
+        headers_end = body.find(b'\r\n\r\n', position)
+        part_end = body.find(b'\r\n' + delimiter, headers_end + 4) if headers_end != -1 else -1
+        if part_end == -1:
+            raise InvalidUpload('Тело multipart оборвано')
+        headers = body[position:headers_end].decode('utf-8', 'replace')
+        params = {key.lower(): value for key, value in _DISPOSITION_PARAM_RE.findall(headers)}
+        content = body[headers_end + 4:part_end]
+        if 'filename' in params:
+            files.append((params.get('name', ''), content))
+        elif 'name' in params:
+            fields[params['name']] = content.decode('utf-8', 'replace')
+        position = part_end + 2
+
+
+def read_upload(event: dict) -> Optional[dict]:
+    """Параметры сканирования из бинарного тела или None для JSON и прочих типов тела.
+    user_id, stream и async берутся из полей формы, строки запроса или X-User-Id;
+    один файл даёт 'image', несколько — 'images' (пакет)"""
+    raw_content_type = get_header(event, 'Content-Type') or ''
+    content_type = raw_content_type.lower()
+    params = dict(event.get('queryStringParameters') or {})
+    batch = False
+    if content_type.startswith('multipart/form-data'):
+        match = _BOUNDARY_RE.search(raw_content_type)
+        if not match:
+            raise InvalidUpload('Не указан boundary для multipart/form-data')
+        fields, files = parse_multipart(get_body_bytes(event), match.group(1).encode('latin-1'))
+        params.update(fields)
+        images = [content for name, content in files if name in ('image', 'images', '')]
+        batch = len(images) > 1 or any(name == 'images' for name, _ in files)
+    elif content_type.startswith(('image/', 'application/octet-stream')):
+        images = [get_body_bytes(event)]
+    else:
+        return None
+
+    upload = {
+        'user_id': params.get('user_id') or get_header(event, 'X-User-Id'),
+        'stream': str(params.get('stream', '')).lower() in _TRUE,
+        'async': str(params.get('async', '')).lower() in _TRUE
+    }
+    if batch:
+        upload['images'] = images
+    else:
+        upload['image'] = images[0] if images else None
+    return upload
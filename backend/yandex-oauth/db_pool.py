@@ -0,0 +1,192 @@
+"""
+Пул соединений с базой данных, переживающий тёплые вызовы функции
+"""
+import json
+import os
+import threading
+import time
+
+import runtime
+
+psycopg2 = runtime.lazy_import('psycopg2')
+
+
+class PoolExhausted(Exception):
+    """Не удалось получить соединение за отведённое время"""
+
+
+class ConnectionPool:
+    """Пул с проверкой живости, ограничением возраста соединений и статистикой ожидания"""
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 5, max_age: float = 300.0,
+                 checkout_timeout: float = 5.0, health_check_interval: float = 30.0, stats_every: int = 0):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.stats_every = stats_every
+        self._idle = []
+        self._created_at = {}
+        self._checked_at = {}
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0, 'created': 0, 'recycled': 0, 'broken': 0, 'timeouts': 0,
+            'wait_total_ms': 0.0, 'wait_max_ms': 0.0
+        }
+
+    def _open(self):
+        conn = psycopg2.connect(self.dsn)
+        now = time.monotonic()
+        with self._cond:
+            self._created_at[id(conn)] = now
+            self._checked_at[id(conn)] = now
+            self._stats['created'] += 1
+        return conn
+
+    def _discard(self, conn) -> None:
+        self._created_at.pop(id(conn), None)
+        self._checked_at.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn) -> bool:
+        """Соединение открыто, не старше max_age и отвечает на SELECT 1; вызывается без блокировки пула"""
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - self._created_at.get(id(conn), 0) > self.max_age:
+            with self._cond:
+                self._stats['recycled'] += 1
+            return False
+        if now - self._checked_at.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+        except Exception:
+            with self._cond:
+                self._stats['broken'] += 1
+            return False
+        self._checked_at[id(conn)] = now
+        return True
+
+    def getconn(self):
+        """Выдача соединения; ждёт освобождения не дольше checkout_timeout"""
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        while True:
+            with self._cond:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolExhausted('Нет свободных соединений с базой данных')
+                    self._cond.wait(remaining)
+                # Место в пуле занято до проверки: соединение уже считается выданным
+                self._in_use += 1
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self._record_wait(started)
+                return conn
+            # Проверка живости вне блокировки: медленный SELECT 1 не задерживает другие выдачи и возвраты
+            if self._is_usable(conn):
+                with self._cond:
+                    self._record_wait(started)
+                return conn
+            self._discard(conn)
+            self._release_slot()
+
+    def _release_slot(self) -> None:
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        """Возврат соединения; незавершённая транзакция откатывается"""
+        if not broken and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    broken = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        with self._cond:
+            self._in_use -= 1
+            if broken or conn.closed or len(self._idle) >= self.max_size:
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def fill(self) -> None:
+        """Открытие соединений до min_size"""
+        with self._cond:
+            missing = self.min_size - len(self._idle) - self._in_use
+            for _ in range(max(missing, 0)):
+                self._idle.append(self._open())
+
+    def closeall(self) -> None:
+        with self._cond:
+            for conn in self._idle:
+                self._discard(conn)
+            self._idle.clear()
+
+    def _record_wait(self, started: float) -> None:
+        wait_ms = (time.monotonic() - started) * 1000
+        self._stats['checkouts'] += 1
+        self._stats['wait_total_ms'] += wait_ms
+        self._stats['wait_max_ms'] = max(self._stats['wait_max_ms'], wait_ms)
+        # Периодически пишем статистику в лог функции
+        if self.stats_every and self._stats['checkouts'] % self.stats_every == 0:
+            print(json.dumps({'db_pool': self._snapshot()}))
+
+    def _snapshot(self) -> dict:
+        result = dict(self._stats)
+        result['idle'] = len(self._idle)
+        result['in_use'] = self._in_use
+        checkouts = result['checkouts']
+        result['wait_avg_ms'] = round(result['wait_total_ms'] / checkouts, 3) if checkouts else 0.0
+        return result
+
+    def stats(self) -> dict:
+        """Статистика пула для подбора размеров"""
+        with self._cond:
+            return self._snapshot()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул процесса, создаётся при первом обращении"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ['DATABASE_URL'],
+                    min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+                    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 5)),
+                    max_age=float(os.environ.get('DB_POOL_MAX_AGE', 300)),
+                    checkout_timeout=float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 5)),
+                    health_check_interval=float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30)),
+                    stats_every=int(os.environ.get('DB_POOL_STATS_EVERY', 100))
+                )
+                _pool.fill()
+    return _pool
+
@@ -0,0 +1,345 @@
+"""
+Исходящий HTTP-клиент: пул keep-alive соединений между тёплыми вызовами,
+таймауты по хостам, повторы с джиттером на 429/5xx и метрики задержек
+"""
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from typing import Optional
+
+# Таймауты (подключение, чтение) в секундах
+DEFAULT_TIMEOUTS = (5.0, 30.0)
+HOST_TIMEOUTS = {
+    'api.openai.com': (5.0, 60.0),
+    'oauth.yandex.ru': (3.0, 10.0),
+    'login.yandex.ru': (3.0, 10.0),
+}
+MAX_IDLE_PER_HOST = 4
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 4.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+READ_CHUNK = 64 * 1024
+
+_pool = {}
+_pool_lock = threading.Lock()
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class HttpClientError(Exception):
+    """Ошибка исходящего запроса"""
+
+
+class UpstreamTimeout(HttpClientError):
+    """Внешний сервис не ответил за отведённое время"""
+
+
+class HttpError(HttpClientError):
+    """Внешний сервис вернул статус не из диапазона 2xx"""
+
+    def __init__(self, status: int, body: bytes, url: str):
+        super().__init__(f'HTTP {status} от {url}')
+        self.status = status
+        self.body = body
+        self.url = url
+
+
+class Response:
+    """Полностью прочитанный ответ"""
+
+    def __init__(self, status: int, headers: dict, body: bytes, latency_ms: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.latency_ms = latency_ms
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+
+def set_host_timeouts(host: str, connect_timeout: float, read_timeout: float) -> None:
+    """Переопределение таймаутов для хоста"""
+    HOST_TIMEOUTS[host] = (connect_timeout, read_timeout)
+
+
+def _acquire(scheme: str, host: str, port: int, connect_timeout: float):
+    """Соединение из пула или новое; второй элемент — признак повторного использования"""
+    key = (scheme, host, port)
+    with _pool_lock:
+        idle = _pool.get(key)
+        if idle:
+            return idle.pop(), True
+    if scheme == 'https':
+        conn = http.client.HTTPSConnection(host, port, timeout=connect_timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=connect_timeout)
+    return conn, False
+
+
+def _release(scheme: str, host: str, port: int, conn) -> None:
+    key = (scheme, host, port)
+    with _pool_lock:
+        idle = _pool.setdefault(key, [])
+        if len(idle) < MAX_IDLE_PER_HOST:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def close_all() -> None:
+    """Закрытие всех соединений пула"""
+    with _pool_lock:
+        connections = [conn for idle in _pool.values() for conn in idle]
+        _pool.clear()
+    for conn in connections:
+        conn.close()
+
+
+def _record(host: str, latency_ms: float, status: Optional[int], retries: int, failed: bool) -> None:
+    with _metrics_lock:
+        stats = _metrics.setdefault(host, {
+            'calls': 0, 'errors': 0, 'retries': 0,
+            'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0, 'last_status': None
+        })
+        stats['calls'] += 1
+        stats['retries'] += retries
+        stats['total_ms'] += latency_ms
+        stats['max_ms'] = max(stats['max_ms'], latency_ms)
+        stats['last_ms'] = latency_ms
+        stats['last_status'] = status
+        if failed:
+            stats['errors'] += 1
+
+
+def get_metrics() -> dict:
+    """Снимок метрик по хостам со средней задержкой"""
+    with _metrics_lock:
+        snapshot = {}
+        for host, stats in _metrics.items():
+            item = dict(stats)
+            item['avg_ms'] = round(stats['total_ms'] / stats['calls'], 2) if stats['calls'] else 0.0
+            snapshot[host] = item
+        return snapshot
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def _backoff(attempt: int, retry_after: Optional[str]) -> float:
+    """Пауза перед повтором: Retry-After или экспонента с полным джиттером"""
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def _within(timeouts: tuple, deadline: Optional[float]) -> tuple:
+    """Таймауты попытки, урезанные до остатка общего срока; socket.timeout, если срок уже вышел"""
+    if deadline is None:
+        return timeouts
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout('Общий срок запроса истёк')
+    return min(timeouts[0], remaining), min(timeouts[1], remaining)
+
+
+def _can_wait(pause: float, deadline: Optional[float]) -> bool:
+    """Повтор после паузы ещё успевает до общего срока"""
+    return deadline is None or time.monotonic() + pause < deadline
+
+
+def _open(scheme, host, port, method, path, body, headers, timeouts):
+    """Отправка запроса и чтение заголовков ответа; на оборванном keep-alive соединении повторяем сразу на новом.
+    Возвращает (соединение, ответ, сокет): при will_close соединение отдаёт сокет ответу и обнуляет conn.sock"""
+    connect_timeout, read_timeout = timeouts
+    for _ in range(2):
+        conn, reused = _acquire(scheme, host, port, connect_timeout)
+        try:
+            if conn.sock is None:
+                conn.connect()
+            sock = conn.sock
+            sock.settimeout(read_timeout)
+            conn.request(method, path, body=body, headers=headers)
+            return conn, conn.getresponse(), sock
+        except socket.timeout:
+            conn.close()
+            raise
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError, http.client.CannotSendRequest):
+            conn.close()
+            if reused:
+                continue
+            raise
+        except Exception:
+            conn.close()
+            raise
+    raise HttpClientError(f'Соединение с {host} разорвано')
+
+
+def _finish(scheme, host, port, conn, response) -> None:
+    """Соединение после полностью прочитанного ответа возвращается в пул"""
+    if response.will_close:
+        conn.close()
+    else:
+        _release(scheme, host, port, conn)
+
+
+def _read_within(response, sock, deadline: float) -> bytes:
+    """Тело ответа порциями: таймаут сокета ограничивает одно чтение, а общий срок проверяется между чтениями,
+    поэтому медленная отдача по байту не растягивает запрос сверх deadline"""
+    chunks = []
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Общий срок запроса истёк')
+        sock.settimeout(remaining)
+        chunk = response.read1(READ_CHUNK)
+        if not chunk:
+            # read1 не закрывает ответ по Content-Length: read() на пустом остатке помечает его прочитанным
+            chunks.append(response.read())
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def _send_once(scheme, host, port, method, path, body, headers, timeouts, deadline=None):
+    conn, response, sock = _open(scheme, host, port, method, path, body, headers, _within(timeouts, deadline))
+    try:
+        data = response.read() if deadline is None else _read_within(response, sock, deadline)
+    except Exception:
+        conn.close()
+        raise
+    _finish(scheme, host, port, conn, response)
+    return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+
+
+def _split(url: str) -> tuple:
+    parsed = urllib.parse.urlsplit(url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    path = parsed.path or '/'
+    if parsed.query:
+        path = f'{path}?{parsed.query}'
+    return parsed.scheme, parsed.hostname, port, path
+
+
+def request(method: str, url: str, body: Optional[bytes] = None, headers: Optional[dict] = None,
+            retries: int = DEFAULT_RETRIES, timeouts: Optional[tuple] = None, deadline: Optional[float] = None) -> Response:
+    """HTTP-запрос через пул соединений; HttpError на не-2xx, UpstreamTimeout на таймаут.
+    deadline — общий срок по time.monotonic() на все попытки, паузы и чтение тела"""
+    scheme, host, port, path = _split(url)
+    timeouts = timeouts or HOST_TIMEOUTS.get(host, DEFAULT_TIMEOUTS)
+
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            status, response_headers, data = _send_once(
+                scheme, host, port, method, path, body, headers or {}, timeouts, deadline
+            )
+        except socket.timeout as e:
+            _record(host, (time.monotonic() - started) * 1000, None, attempt, True)
+            raise UpstreamTimeout(f'Таймаут запроса к {host}') from e
+        except OSError as e:
+            # Ошибки подключения повторяем, если есть попытки и время
+            pause = _backoff(attempt, None)
+            if attempt < retries and _can_wait(pause, deadline):
+                time.sleep(pause)
+                attempt += 1
+                continue
+            _record(host, (time.monotonic() - started) * 1000, None, attempt, True)
+            raise HttpClientError(f'Ошибка подключения к {host}: {e}') from e
+
+        if status in RETRY_STATUSES and attempt < retries:
+            pause = _backoff(attempt, response_headers.get('retry-after'))
+            if _can_wait(pause, deadline):
+                time.sleep(pause)
+                attempt += 1
+                continue
+
+        latency_ms = (time.monotonic() - started) * 1000
+        failed = not 200 <= status < 300
+        _record(host, latency_ms, status, attempt, failed)
+        if failed:
+            raise HttpError(status, data, url)
+        return Response(status, response_headers, data, latency_ms)
+
+
+def stream_lines(method: str, url: str, body: Optional[bytes] = None, headers: Optional[dict] = None,
+                 retries: int = DEFAULT_RETRIES, timeouts: Optional[tuple] = None):
+    """Построчное чтение ответа (например, server-sent events) без буферизации всего тела.
+    Повторы возможны только до получения первой строки."""
+    scheme, host, port, path = _split(url)
+    timeouts = timeouts or HOST_TIMEOUTS.get(host, DEFAULT_TIMEOUTS)
+
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            conn, response, _ = _open(scheme, host, port, method, path, body, headers or {}, timeouts)
+        except socket.timeout as e:
+            _record(host, (time.monotonic() - started) * 1000, None, attempt, True)
+            raise UpstreamTimeout(f'Таймаут запроса к {host}') from e
+        except OSError as e:
+            if attempt < retries:
+                time.sleep(_backoff(attempt, None))
+                attempt += 1
+                continue
+            _record(host, (time.monotonic() - started) * 1000, None, attempt, True)
+            raise HttpClientError(f'Ошибка подключения к {host}: {e}') from e
+
+        if 200 <= response.status < 300:
+            break
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        _finish(scheme, host, port, conn, response)
+        if response.status in RETRY_STATUSES and attempt < retries:
+            time.sleep(_backoff(attempt, response.getheader('retry-after')))
+            attempt += 1
+            continue
+        _record(host, (time.monotonic() - started) * 1000, response.status, attempt, True)
+        raise HttpError(response.status, data, url)
+
+    try:
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            yield line
+    except socket.timeout as e:
+        conn.close()
+        _record(host, (time.monotonic() - started) * 1000, response.status, attempt, True)
+        raise UpstreamTimeout(f'Таймаут чтения ответа от {host}') from e
+    except BaseException:
+        # В том числе досрочное закрытие генератора: соединение в неизвестном состоянии
+        conn.close()
+        raise
+    _finish(scheme, host, port, conn, response)
+    _record(host, (time.monotonic() - started) * 1000, response.status, attempt, False)
+
+
+def post_json(url: str, payload: dict, headers: Optional[dict] = None, **kwargs) -> Response:
+    """POST с JSON-телом"""
+    all_headers = {'Content-Type': 'application/json'}
+    all_headers.update(headers or {})
+    return request('POST', url, body=json.dumps(payload).encode(), headers=all_headers, **kwargs)
+
+
+def post_form(url: str, fields: dict, headers: Optional[dict] = None, **kwargs) -> Response:
+    """POST с телом application/x-www-form-urlencoded"""
+    all_headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    all_headers.update(headers or {})
+    return request('POST', url, body=urllib.parse.urlencode(fields).encode(), headers=all_headers, **kwargs)
+
+
+def get(url: str, headers: Optional[dict] = None, **kwargs) -> Response:
+    return request('GET', url, headers=headers, **kwargs)
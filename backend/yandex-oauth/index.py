@@ -2,223 +2,248 @@
 OAuth авторизация через Яндекс ID
 """
 import json
-import os
-import psycopg2
-import urllib.request
-import urllib.parse
+import threading
+import time
 from datetime import datetime
+from db_pool import get_pool
+from user_cache import user_cache
+import runtime
+import tracing
+
+# Нужны только для обмена кода: выдача ссылки авторизации их не загружает
+http_client = runtime.lazy_import('http_client')
+executors = runtime.lazy_import('concurrent.futures')
+
+# Живут между тёплыми вызовами функции
+_executor = None
+_executor_lock = threading.Lock()
+_userinfo = {}
+_userinfo_lock = threading.Lock()
+USERINFO_CACHE_MAX_SIZE = 1000
 
 def get_db_connection():
-    """Подключение к базе данных"""
-    dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+    """Соединение из пула процесса"""
+    return get_pool().getconn()
+
+def release_db_connection(conn):
+    """Возврат соединения в пул, незавершённая транзакция откатывается"""
+    get_pool().putconn(conn)
 
 def get_schema():
     """Получение имени схемы"""
-    return os.environ.get('MAIN_DB_SCHEMA', 'public')
+    return runtime.get_schema()
 
-def handler(event: dict, context) -> dict:
-    """Обработчик OAuth авторизации через Яндекс"""
-    method = event.get('httpMethod', 'GET')
+router = runtime.Router()
+
+@router.route('GET')
+def auth_url(event: dict) -> dict:
+    """Генерация URL для авторизации"""
+    client_id = runtime.setting('YANDEX_CLIENT_ID')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    if not client_id:
+        return runtime.error(500, 'Яндекс OAuth не настроен')
     
+    # Callback URL будет настроен в Яндекс.OAuth
+    return runtime.json_response(200, {'auth_url': f'https://oauth.yandex.ru/authorize?response_type=code&client_id={client_id}'})
+
+def prefetch(user_id):
+    """Соединение из пула и, для привязки, запись пользователя — пока идут запросы к Яндексу"""
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
-        if method == 'POST':
-            # Обмен кода на токен и получение данных пользователя
-            body = json.loads(event.get('body', '{}'))
-            code = body.get('code')
-            user_id = body.get('user_id')  # ID пользователя для привязки
-            
-            if not code:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Код авторизации обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            client_id = os.environ.get('YANDEX_CLIENT_ID')
-            client_secret = os.environ.get('YANDEX_CLIENT_SECRET')
-            
-            if not client_id or not client_secret:
-                return {
-                    'statusCode': 500,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Яндекс OAuth не настроен'}),
-                    'isBase64Encoded': False
-                }
-            
-            # Обмен кода на токен
-            token_data = urllib.parse.urlencode({
-                'grant_type': 'authorization_code',
-                'code': code,
-                'client_id': client_id,
-                'client_secret': client_secret
-            }).encode()
-            
-            token_req = urllib.request.Request(
-                'https://oauth.yandex.ru/token',
-                data=token_data,
-                headers={'Content-Type': 'application/x-www-form-urlencoded'}
-            )
-            
-            with urllib.request.urlopen(token_req) as response:
-                token_response = json.loads(response.read().decode())
-            
-            access_token = token_response.get('access_token')
-            
-            if not access_token:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Не удалось получить токен'}),
-                    'isBase64Encoded': False
-                }
-            
-            # Получение данных пользователя
-            user_req = urllib.request.Request(
-                'https://login.yandex.ru/info?format=json',
-                headers={'Authorization': f'OAuth {access_token}'}
-            )
-            
-            with urllib.request.urlopen(user_req) as response:
-                yandex_user = json.loads(response.read().decode())
-            
-            yandex_id = yandex_user.get('id')
-            yandex_email = yandex_user.get('default_email')
-            first_name = yandex_user.get('first_name', '')
-            last_name = yandex_user.get('last_name', '')
-            
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
+        user = None
+        if user_id:
+            user = user_cache.get_by_id(cur, get_schema(), user_id)
+            # Не держим транзакцию открытой, пока ждём Яндекс
+            conn.rollback()
+    except Exception:
+        cur.close()
+        release_db_connection(conn)
+        raise
+    return conn, cur, user
+
+def submit_prefetch(user_id):
+    """Фоновая подготовка базы; потоков не больше, чем соединений в пуле"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = executors.ThreadPoolExecutor(max_workers=int(runtime.setting('DB_POOL_MAX_SIZE', 5)))
+    return _executor.submit(tracing.bind(prefetch), user_id)
+
+def discard_prefetch(future) -> None:
+    """Возврат заранее взятого соединения, когда запрос завершился без базы"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    conn, cur, _ = future.result()
+    cur.close()
+    release_db_connection(conn)
+
+def upstream_timeouts() -> tuple:
+    """(подключение, чтение) одной попытки; общий бюджет обмена кода ограничивает их через deadline"""
+    return float(runtime.setting('YANDEX_CONNECT_TIMEOUT', 2)), float(runtime.setting('YANDEX_EXCHANGE_TIMEOUT', 8))
+
+def get_userinfo(access_token: str, deadline: float) -> dict:
+    """Данные пользователя Яндекса; Яндекс выдаёт приложению тот же токен повторно, поэтому ответ кэшируется по токену.
+    GET идемпотентен: один повтор, если он укладывается в deadline"""
+    now = time.monotonic()
+    with _userinfo_lock:
+        cached = _userinfo.get(access_token)
+    if cached and cached[0] > now:
+        return cached[1]
+    
+    login_base = runtime.setting('YANDEX_LOGIN_URL', 'https://login.yandex.ru')
+    with tracing.span('yandex_userinfo'):
+        yandex_user = http_client.get(
+            f'{login_base}/info?format=json',
+            headers={'Authorization': f'OAuth {access_token}'},
+            retries=1, timeouts=upstream_timeouts(), deadline=deadline
+        ).json()
+    
+    with _userinfo_lock:
+        if len(_userinfo) >= USERINFO_CACHE_MAX_SIZE:
+            _userinfo.clear()
+        _userinfo[access_token] = (now + float(runtime.setting('YANDEX_USERINFO_TTL', 60)), yandex_user)
+    return yandex_user
+
+@router.route('POST')
+def exchange_code(event: dict) -> dict:
+    """Обмен кода на токен и получение данных пользователя"""
+    body = json.loads(event.get('body', '{}'))
+    code = body.get('code')
+    user_id = body.get('user_id')  # ID пользователя для привязки
+    
+    if not code:
+        return runtime.error(400, 'Код авторизации обязателен')
+    
+    client_id = runtime.setting('YANDEX_CLIENT_ID')
+    client_secret = runtime.setting('YANDEX_CLIENT_SECRET')
+    
+    if not client_id or not client_secret:
+        return runtime.error(500, 'Яндекс OAuth не настроен')
+    
+    # Соединение с базой берётся параллельно с запросами к Яндексу, а не после них
+    future = submit_prefetch(user_id)
+    deadline = time.monotonic() + float(runtime.setting('YANDEX_EXCHANGE_TIMEOUT', 8))
+    
+    try:
+        # Обмен кода на токен; без повторов — код одноразовый
+        oauth_base = runtime.setting('YANDEX_OAUTH_URL', 'https://oauth.yandex.ru')
+        with tracing.span('yandex_token'):
             try:
-                schema = get_schema()
-                if user_id:
-                    # Привязка Яндекс к существующему аккаунту
-                    cur.execute(
-                        f"UPDATE {schema}.users SET yandex_id = %s, yandex_email = %s, updated_at = %s WHERE id = %s RETURNING id, phone, first_name, last_name",
-                        (yandex_id, yandex_email, datetime.now(), user_id)
-                    )
-                    user = cur.fetchone()
-                    conn.commit()
-                    
-                    if not user:
-                        return {
-                            'statusCode': 404,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'error': 'Пользователь не найден'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'user_id': user[0],
-                            'phone': user[1],
-                            'first_name': user[2],
-                            'last_name': user[3],
-                            'yandex_email': yandex_email,
-                            'message': 'Яндекс ID успешно привязан'
-                        }),
-                        'isBase64Encoded': False
-                    }
-                else:
-                    # Проверяем есть ли уже пользователь с таким Яндекс ID
-                    cur.execute(
-                        f"SELECT id, phone, first_name, last_name, ai_responses_enabled FROM {schema}.users WHERE yandex_id = %s",
-                        (yandex_id,)
-                    )
-                    user = cur.fetchone()
-                    
-                    if user:
-                        # Вход через Яндекс
-                        return {
-                            'statusCode': 200,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({
-                                'user_id': user[0],
-                                'phone': user[1],
-                                'first_name': user[2],
-                                'last_name': user[3],
-                                'yandex_email': yandex_email,
-                                'ai_responses_enabled': user[4],
-                                'message': 'Вход через Яндекс выполнен'
-                            }),
-                            'isBase64Encoded': False
-                        }
-                    else:
-                        # Регистрация через Яндекс (без телефона)
-                        cur.execute(
-                            f"INSERT INTO {schema}.users (phone, first_name, last_name, yandex_id, yandex_email) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                            (f'yandex_{yandex_id}', first_name, last_name, yandex_id, yandex_email)
-                        )
-                        new_user_id = cur.fetchone()[0]
-                        conn.commit()
-                        
-                        return {
-                            'statusCode': 201,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({
-                                'user_id': new_user_id,
-                                'first_name': first_name,
-                                'last_name': last_name,
-                                'yandex_email': yandex_email,
-                                'yandex_connected': True,
-                                'ai_responses_enabled': False,
-                                'message': 'Регистрация через Яндекс успешна'
-                            }),
-                            'isBase64Encoded': False
-                        }
-            finally:
-                cur.close()
-                conn.close()
+                token_response = http_client.post_form(f'{oauth_base}/token', {
+                    'grant_type': 'authorization_code',
+                    'code': code,
+                    'client_id': client_id,
+                    'client_secret': client_secret
+                }, retries=0, timeouts=upstream_timeouts(), deadline=deadline).json()
+            except http_client.HttpError as e:
+                # 4xx — неверный или уже использованный код
+                if e.status >= 500:
+                    raise
+                token_response = {}
         
-        elif method == 'GET':
-            # Генерация URL для авторизации
-            client_id = os.environ.get('YANDEX_CLIENT_ID')
-            
-            if not client_id:
-                return {
-                    'statusCode': 500,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Яндекс OAuth не настроен'}),
-                    'isBase64Encoded': False
-                }
-            
-            # Callback URL будет настроен в Яндекс.OAuth
-            auth_url = f'https://oauth.yandex.ru/authorize?response_type=code&client_id={client_id}'
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'auth_url': auth_url}),
-                'isBase64Encoded': False
-            }
+        access_token = token_response.get('access_token')
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        if not access_token:
+            future.add_done_callback(discard_prefetch)
+            return runtime.error(400, 'Не удалось получить токен')
+        
+        # Получение данных пользователя
+        yandex_user = get_userinfo(access_token, deadline)
+    except BaseException:
+        future.add_done_callback(discard_prefetch)
+        raise
+    
+    yandex_id = yandex_user.get('id')
+    yandex_email = yandex_user.get('default_email')
+    first_name = yandex_user.get('first_name', '')
+    last_name = yandex_user.get('last_name', '')
+    
+    with tracing.span('db_checkout'):
+        conn, cur, linked_user = future.result()
+    
+    try:
+        schema = get_schema()
+        if user_id:
+            # Привязка Яндекс к существующему аккаунту; наличие пользователя проверено заранее
+            if not linked_user:
+                return runtime.error(404, 'Пользователь не найден')
+            
+            with tracing.span('update'):
+                cur.execute(
+                    f"UPDATE {schema}.users SET yandex_id = %s, yandex_email = %s, updated_at = %s WHERE id = %s RETURNING id, phone, first_name, last_name",
+                    (yandex_id, yandex_email, datetime.now(), user_id)
+                )
+                user = cur.fetchone()
+                if user:
+                    user_cache.invalidate(cur, user[0])
+                conn.commit()
+            
+            if not user:
+                return runtime.error(404, 'Пользователь не найден')
+            
+            return runtime.json_response(200, {
+                'user_id': user[0],
+                'phone': user[1],
+                'first_name': user[2],
+                'last_name': user[3],
+                'yandex_email': yandex_email,
+                'message': 'Яндекс ID успешно привязан'
+            })
+        
+        # Повторный вход из кэша — без обращения к базе
+        user = user_cache.cached_by_yandex_id(yandex_id)
+        
+        if user is None:
+            # Вход или регистрация через Яндекс (без телефона) одним INSERT ... ON CONFLICT
+            with tracing.span('upsert'):
+                user, created = user_cache.upsert(cur, schema, 'yandex_id', {
+                    'phone': f'yandex_{yandex_id}',
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'yandex_id': yandex_id,
+                    'yandex_email': yandex_email
+                })
+                conn.commit()
+            user_cache.put(user)
+            
+            if created:
+                return runtime.json_response(201, {
+                    'user_id': user['id'],
+                    'first_name': user['first_name'],
+                    'last_name': user['last_name'],
+                    'yandex_email': yandex_email,
+                    'yandex_connected': True,
+                    'ai_responses_enabled': user['ai_responses_enabled'],
+                    'message': 'Регистрация через Яндекс успешна'
+                })
+        
+        # Вход через Яндекс
+        return runtime.json_response(200, {
+            'user_id': user['id'],
+            'phone': user['phone'],
+            'first_name': user['first_name'],
+            'last_name': user['last_name'],
+            'yandex_email': yandex_email,
+            'ai_responses_enabled': user['ai_responses_enabled'],
+            'message': 'Вход через Яндекс выполнен'
+        })
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+@tracing.traced('yandex-oauth')
+def handler(event: dict, context) -> dict:
+    """Обработчик OAuth авторизации через Яндекс"""
+    route = router.get(event)
+    if route is None:
+        return router.reject(event)
     
+    try:
+        return route(event)
+    except http_client.UpstreamTimeout as e:
+        return runtime.error(504, str(e))
+    except http_client.HttpClientError as e:
+        return runtime.error(502, str(e))
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        return runtime.error(500, str(e))
@@ -0,0 +1,119 @@
+"""
+Холодный старт и накладные расходы обработчиков без базы и внешних сервисов.
+
+Каждый замер — новый интерпретатор: время импорта index, первый вызов handler и среднее
+время тёплого вызова на пути без базы (OPTIONS, ссылка авторизации Яндекса).
+--source указывает на другую копию репозитория, например git worktree старой ревизии:
+
+    python bench/coldstart.py --output cold-new.json
+    git worktree add /tmp/base HEAD~1 && python bench/coldstart.py --source /tmp/base --output cold-old.json
+    python bench/coldstart.py --compare cold-old.json cold-new.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'auth': {'options': {'httpMethod': 'OPTIONS'}},
+    'scan': {'options': {'httpMethod': 'OPTIONS'}},
+    'yandex-oauth': {'options': {'httpMethod': 'OPTIONS'}, 'auth_url': {'httpMethod': 'GET', 'queryStringParameters': {}}},
+}
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+event = json.loads(sys.argv[1])
+index.handler(dict(event), None)
+first = time.perf_counter()
+warm = int(sys.argv[2])
+for _ in range(warm):
+    index.handler(dict(event), None)
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_call_ms': (first - imported) * 1000,
+    'warm_us': (done - first) / warm * 1e6,
+    'modules': len(sys.modules)
+}))
+"""
+
+
+def probe(source: str, backend: str, event: dict, warm: int) -> dict:
+    env = dict(
+        os.environ,
+        DATABASE_URL=os.environ.get('DATABASE_URL', 'postgresql://localhost/bench'),
+        YANDEX_CLIENT_ID='bench', USER_CACHE_LISTEN='0', TRACE_SAMPLE_RATE='0'
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE, json.dumps(event), str(warm)],
+        cwd=os.path.join(source, 'backend', backend), env=env, check=True, capture_output=True, text=True
+    ).stdout
+    # Последняя строка — замер, выше могут быть логи функции
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(source: str, runs: int, warm: int) -> list:
+    # Байт-код заранее: в замер попадает загрузка модулей, а не компиляция исходников
+    subprocess.run([sys.executable, '-m', 'compileall', '-q', os.path.join(source, 'backend')], check=True)
+    results = []
+    for backend, scenarios in SCENARIOS.items():
+        for endpoint, event in scenarios.items():
+            samples = [probe(source, backend, event, warm) for _ in range(runs)]
+            result = {'backend': backend, 'endpoint': endpoint}
+            for metric in ('import_ms', 'first_call_ms', 'warm_us'):
+                result[metric] = round(statistics.median(sample[metric] for sample in samples), 2)
+            result['modules'] = samples[-1]['modules']
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    def index(path):
+        with open(path, encoding='utf-8') as f:
+            return {(r['backend'], r['endpoint']): r for r in json.load(f)['results']}
+
+    old, new = index(old_path), index(new_path)
+    for key in sorted(old.keys() & new.keys()):
+        deltas = []
+        for metric in ('import_ms', 'first_call_ms', 'warm_us', 'modules'):
+            before, after = old[key][metric], new[key][metric]
+            change = f' ({(after - before) / before * 100:+.1f}%)' if before else ''
+            deltas.append(f'{metric}={after}{change}')
+        print(f"{'/'.join(key)}: {' '.join(deltas)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=ROOT, help='Корень репозитория с каталогом backend')
+    parser.add_argument('--runs', default=15, type=int, help='Новых процессов на сценарий, в отчёте медиана')
+    parser.add_argument('--warm', default=2000, type=int, help='Тёплых вызовов на процесс')
+    parser.add_argument('--output', help='Файл для JSON с результатами')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {
+        'meta': {'source': os.path.abspath(args.source), 'python': sys.version.split()[0], 'runs': args.runs, 'warm': args.warm},
+        'results': measure(args.source, args.runs, args.warm)
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Подсчёт SQL-запросов по потокам: курсор psycopg2 с учётом execute/executemany
+"""
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+_local = threading.local()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        _local.count = getattr(_local, 'count', 0) + 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        _local.count = getattr(_local, 'count', 0) + 1
+        return super().executemany(query, vars_list)
+
+
+def install() -> None:
+    """Все соединения, открытые после вызова, создают считающие курсоры"""
+    original = psycopg2.connect
+    if getattr(original, 'counting', False):
+        return
+
+    def connect(*args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return original(*args, **kwargs)
+
+    connect.counting = True
+    psycopg2.connect = connect
+
+
+def reset() -> None:
+    _local.count = 0
+
+
+def count() -> int:
+    return getattr(_local, 'count', 0)
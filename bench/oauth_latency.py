@@ -0,0 +1,151 @@
+"""
+Задержка входа через Яндекс от начала до конца: handler backend/yandex-oauth вызывается
+последовательно против заглушки Яндекса с задержкой и локального Postgres (схема из
+bench/run.py --setup). --connect-latency добавляет задержку к открытию соединения с базой,
+как у удалённой управляемой базы; --fresh-connections открывает соединение на каждый вход,
+как на холодном экземпляре. --source — другая копия репозитория, например старая ревизия:
+
+    DATABASE_URL=postgresql://localhost/bench python bench/run.py --setup
+    git worktree add /tmp/base HEAD~1
+    DATABASE_URL=... python bench/oauth_latency.py --source /tmp/base --fresh-connections --output oauth-old.json
+    DATABASE_URL=... python bench/oauth_latency.py --fresh-connections --output oauth-new.json
+    python bench/oauth_latency.py --compare oauth-old.json oauth-new.json
+
+login — коды сидированных пользователей по кругу (Яндекс повторно выдаёт приложению тот же
+токен), register — каждый раз новый код и новый пользователь
+"""
+import argparse
+import importlib
+import json
+import os
+import statistics
+import sys
+import time
+
+import stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_USERS = 50
+
+
+def slow_connect(latency_ms: float) -> None:
+    """Задержка перед каждым psycopg2.connect"""
+    import psycopg2
+    original = psycopg2.connect
+
+    def connect(*args, **kwargs):
+        time.sleep(latency_ms / 1000)
+        return original(*args, **kwargs)
+    psycopg2.connect = connect
+
+
+def scenarios(run_id: str) -> dict:
+    return {
+        'login': lambda n: {'code': f'seed{n % SEED_USERS + 1}'},
+        'register': lambda n: {'code': f'{run_id}{n:04d}'},
+    }
+
+
+def measure(handler, make_body, requests: int, warmup: int) -> dict:
+    latencies = []
+    statuses = {}
+    for n in range(-warmup, requests):
+        event = {'httpMethod': 'POST', 'headers': {}, 'queryStringParameters': {}, 'body': json.dumps(make_body(n + warmup))}
+        started = time.perf_counter()
+        response = handler(event, None)
+        elapsed = (time.perf_counter() - started) * 1000
+        if n < 0:
+            continue
+        latencies.append(elapsed)
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+    latencies.sort()
+    return {
+        'requests': requests,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'p50_ms': round(latencies[len(latencies) // 2], 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        'max_ms': round(latencies[-1], 2),
+    }
+
+
+def run(args) -> list:
+    yandex_stub = stubs.start_yandex_stub(args.yandex_latency)
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+    os.environ['YANDEX_CLIENT_ID'] = 'bench'
+    os.environ['YANDEX_CLIENT_SECRET'] = 'bench'
+    os.environ['YANDEX_OAUTH_URL'] = yandex_stub.url
+    os.environ['YANDEX_LOGIN_URL'] = yandex_stub.url
+    os.environ.setdefault('DB_POOL_STATS_EVERY', '0')
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    if args.fresh_connections:
+        # Соединение старше max_age не выдаётся повторно: каждый вход открывает новое
+        os.environ['DB_POOL_MIN_SIZE'] = '0'
+        os.environ['DB_POOL_MAX_AGE'] = '0'
+    if args.connect_latency:
+        slow_connect(args.connect_latency)
+
+    sys.path.insert(0, os.path.join(args.source, 'backend', 'yandex-oauth'))
+    handler = importlib.import_module('index').handler
+
+    run_id = f'{int(time.time()) % 1000:03d}'
+    results = []
+    for endpoint, make_body in scenarios(run_id).items():
+        result = {'endpoint': endpoint}
+        result.update(measure(handler, make_body, args.requests, args.warmup))
+        results.append(result)
+        print(json.dumps(result), file=sys.stderr)
+    yandex_stub.stop()
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    def index(path):
+        with open(path, encoding='utf-8') as f:
+            return {r['endpoint']: r for r in json.load(f)['results']}
+
+    old, new = index(old_path), index(new_path)
+    for endpoint in sorted(old.keys() & new.keys()):
+        deltas = []
+        for metric in ('mean_ms', 'p50_ms', 'p95_ms'):
+            before, after = old[endpoint][metric], new[endpoint][metric]
+            change = f' ({(after - before) / before * 100:+.1f}%)' if before else ''
+            deltas.append(f'{metric}={after}{change}')
+        print(f"{endpoint}: {' '.join(deltas)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=ROOT, help='Корень репозитория с каталогом backend')
+    parser.add_argument('--requests', default=100, type=int, help='Входов на сценарий')
+    parser.add_argument('--warmup', default=5, type=int)
+    parser.add_argument('--yandex-latency', default=80.0, type=float, help='Задержка заглушки Яндекса на запрос, мс')
+    parser.add_argument('--connect-latency', default=0.0, type=float, help='Задержка открытия соединения с базой, мс')
+    parser.add_argument('--fresh-connections', action='store_true', help='Новое соединение с базой на каждый вход')
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--output', help='Файл для JSON с результатами')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = {
+        'meta': {
+            'source': os.path.abspath(args.source), 'python': sys.version.split()[0], 'requests': args.requests,
+            'yandex_latency_ms': args.yandex_latency, 'connect_latency_ms': args.connect_latency,
+            'fresh_connections': args.fresh_connections
+        },
+        'results': run(args)
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+"""
+Нагрузочный прогон функций backend/auth, backend/scan и backend/yandex-oauth.
+
+Каждая функция вызывается в отдельном процессе (у функций одинаковые имена модулей):
+напрямую через handler(event, context) и через локальную HTTP-обёртку, на нескольких
+уровнях параллельности. Внешние OpenAI и Яндекс заменены заглушками с задержкой,
+база — локальный Postgres (схема MAIN_DB_SCHEMA пересоздаётся из db_migrations).
+
+    DATABASE_URL=postgresql://localhost/bench python bench/run.py --setup
+    DATABASE_URL=... python bench/run.py --backend all --concurrency 1,8,32 --output bench-1.json
+    python bench/run.py --compare bench-0.json bench-1.json
+"""
+import argparse
+import base64
+import http.client
+import importlib
+import io
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import dbstats
+import stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ('auth', 'scan', 'yandex-oauth')
+SEED_PREFIX = '+7900'
+SEED_USERS = 50
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5 - 1e-9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def make_image(seed: int, size: int = 320) -> str:
+    """Уникальный JPEG в base64: шум не даёт кэшу и pHash склеить кадры"""
+    from PIL import Image
+    rng = random.Random(seed)
+    image = Image.frombytes('RGB', (size, size), rng.randbytes(size * size * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=80)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def seeded_user_id(n: int) -> int:
+    return n % SEED_USERS + 1
+
+
+def build_scenarios(backend: str, run_id: str) -> dict:
+    """Сценарии функции: имя -> фабрика event по номеру запроса"""
+    counter = itertools.count()
+    if backend == 'auth':
+        return {
+            'login': lambda n: {'httpMethod': 'POST', 'body': json.dumps({'phone': f'{SEED_PREFIX}{seeded_user_id(n):07d}'})},
+            'register': lambda n: {'httpMethod': 'POST', 'body': json.dumps({
+                'phone': f'+7{run_id}{next(counter):05d}', 'first_name': 'Bench', 'last_name': 'User'
+            })},
+            'get_user': lambda n: {'httpMethod': 'GET', 'queryStringParameters': {'user_id': str(seeded_user_id(n))}},
+            'update_settings': lambda n: {'httpMethod': 'PUT', 'body': json.dumps({
+                'user_id': seeded_user_id(n), 'ai_responses_enabled': n % 2 == 0
+            })},
+        }
+    if backend == 'scan':
+        cached_image = make_image(0)
+        return {
+            'history': lambda n: {'httpMethod': 'GET', 'queryStringParameters': {'user_id': str(seeded_user_id(n)), 'limit': '20'}},
+            'export': lambda n: {
+                'httpMethod': 'GET',
+                'headers': {'Accept-Encoding': 'gzip'},
+                'queryStringParameters': {'user_id': str(seeded_user_id(n)), 'export': 'csv' if n % 2 else 'ndjson'}
+            },
+            'recognize': lambda n: {'httpMethod': 'POST', 'body': json.dumps({
+                'user_id': seeded_user_id(n), 'image': make_image(hash((run_id, next(counter))))
+            })},
+            'recognize_binary': lambda n: {
+                'httpMethod': 'POST',
+                'headers': {'Content-Type': 'image/jpeg'},
+                'queryStringParameters': {'user_id': str(seeded_user_id(n))},
+                'body': make_image(hash((run_id, next(counter)))),
+                'isBase64Encoded': True
+            },
+            'recognize_cached': lambda n: {'httpMethod': 'POST', 'body': json.dumps({
+                'user_id': seeded_user_id(n), 'image': cached_image
+            })},
+            'batch': lambda n: {'httpMethod': 'POST', 'body': json.dumps({
+                'user_id': seeded_user_id(n),
+                'images': [make_image(hash((run_id, next(counter)))) for _ in range(4)]
+            })},
+        }
+    if backend == 'yandex-oauth':
+        return {
+            'auth_url': lambda n: {'httpMethod': 'GET', 'queryStringParameters': {}},
+            'login': lambda n: {'httpMethod': 'POST', 'body': json.dumps({'code': f'seed{seeded_user_id(n)}'})},
+            'register': lambda n: {'httpMethod': 'POST', 'body': json.dumps({'code': f'{run_id}-{next(counter)}'})},
+        }
+    raise ValueError(f'Неизвестная функция: {backend}')
+
+
+class InProcessClient:
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __call__(self, event: dict) -> tuple:
+        event.setdefault('headers', {})
+        event.setdefault('queryStringParameters', {})
+        event.setdefault('body', '{}')
+        event.setdefault('isBase64Encoded', False)
+        dbstats.reset()
+        response = self.handler(event, None)
+        return response['statusCode'], dbstats.count()
+
+
+class HttpClient:
+    """Keep-alive соединение к HTTP-обёртке на поток"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.local = threading.local()
+
+    def __call__(self, event: dict) -> tuple:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        query = '&'.join(f'{k}={v}' for k, v in (event.get('queryStringParameters') or {}).items())
+        body = event.get('body') if event['httpMethod'] != 'GET' else None
+        headers = {'Content-Type': 'application/json'}
+        headers.update(event.get('headers') or {})
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        conn.request(event['httpMethod'], f'/?{query}', body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status, int(response.getheader('X-Bench-Db-Queries', 0))
+
+
+def run_scenario(client, make_event, requests: int, concurrency: int, warmup: int) -> dict:
+    """requests вызовов на concurrency потоках; задержки по каждому вызову"""
+    for n in range(warmup):
+        client(make_event(n))
+
+    numbers = iter(range(warmup, warmup + requests))
+    numbers_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with numbers_lock:
+                n = next(numbers, None)
+            if n is None:
+                return
+            event = make_event(n)
+            started = time.perf_counter()
+            try:
+                status, queries = client(event)
+            except Exception as e:
+                status, queries = f'error:{type(e).__name__}', 0
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with samples_lock:
+                samples.append((elapsed_ms, status, queries))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies = sorted(sample[0] for sample in samples)
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(count for status, count in statuses.items() if not status.startswith(('2', '3', '4')))
+    total_queries = sum(sample[2] for sample in samples)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'status_codes': statuses,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+        'throughput_rps': round(len(samples) / wall, 2) if wall else 0.0,
+        'db_queries_per_request': round(total_queries / len(samples), 2) if samples else 0.0,
+    }
+
+
+def configure_env(args, openai_url: str, yandex_url: str) -> None:
+    """Окружение функций до их импорта"""
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+    os.environ['OPENAI_API_KEY'] = 'bench'
+    os.environ['OPENAI_API_BASE'] = f'{openai_url}/v1'
+    os.environ['YANDEX_CLIENT_ID'] = 'bench'
+    os.environ['YANDEX_CLIENT_SECRET'] = 'bench'
+    os.environ['YANDEX_OAUTH_URL'] = yandex_url
+    os.environ['YANDEX_LOGIN_URL'] = yandex_url
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(max(args.concurrency) + 2))
+    os.environ.setdefault('DB_POOL_STATS_EVERY', '0')
+    # Ограничитель частоты работает, но не отказывает: меряем его стоимость, а не лимиты
+    os.environ.setdefault('RATE_LIMIT_USER_BURST', '1000000')
+    os.environ.setdefault('RATE_LIMIT_GLOBAL_BURST', '1000000')
+
+
+def run_backend(args) -> list:
+    """Все сценарии одной функции в текущем процессе"""
+    openai_stub = stubs.start_openai_stub(args.openai_latency)
+    yandex_stub = stubs.start_yandex_stub(args.yandex_latency)
+    configure_env(args, openai_stub.url, yandex_stub.url)
+    dbstats.install()
+
+    sys.path.insert(0, os.path.join(ROOT, 'backend', args.backend))
+    handler = importlib.import_module('index').handler
+
+    run_id = f'{int(time.time()) % 100000:05d}'
+    scenarios = build_scenarios(args.backend, run_id)
+    selected = args.endpoints.split(',') if args.endpoints else list(scenarios)
+
+    results = []
+    for mode in args.modes.split(','):
+        server = None
+        if mode == 'http':
+            from shim import HandlerServer
+            server = HandlerServer(handler)
+            client = HttpClient(server.port)
+        else:
+            client = InProcessClient(handler)
+        for endpoint in selected:
+            for concurrency in args.concurrency:
+                stats = run_scenario(client, scenarios[endpoint], args.requests, concurrency, args.warmup)
+                result = {'backend': args.backend, 'endpoint': endpoint, 'mode': mode, 'concurrency': concurrency}
+                result.update(stats)
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+        if server:
+            server.stop()
+
+    openai_stub.stop()
+    yandex_stub.stop()
+    return results
+
+
+def setup_database(args) -> None:
+    """Схема с нуля по db_migrations и тестовые пользователи с историей сканирований"""
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS {args.schema} CASCADE')
+    cur.execute(f'CREATE SCHEMA {args.schema}')
+    cur.execute(f'SET search_path TO {args.schema}')
+    migrations = os.path.join(ROOT, 'db_migrations')
+    for name in sorted(os.listdir(migrations)):
+        with open(os.path.join(migrations, name), encoding='utf-8') as f:
+            cur.execute(f.read())
+
+    for i in range(1, SEED_USERS + 1):
+        cur.execute(
+            'INSERT INTO users (phone, first_name, last_name, yandex_id, yandex_email) VALUES (%s, %s, %s, %s, %s)',
+            (f'{SEED_PREFIX}{i:07d}', 'Bench', str(i), f'bench-seed{i}', f'seed{i}@bench.local')
+        )
+    cur.execute("""
+        INSERT INTO scan_history (user_id, title, category, confidence, ai_response, created_at)
+        SELECT u.id, 'Яблоко', (ARRAY['Фрукты', 'Овощи', 'Еда', 'Другое'])[1 + g % 4], 50 + g % 50, NULL,
+               NOW() - g * INTERVAL '1 minute'
+        FROM users u, generate_series(1, %s) g
+    """, (args.seed_scans,))
+    conn.commit()
+    conn.close()
+    print(f'Схема {args.schema}: {SEED_USERS} пользователей по {args.seed_scans} сканирований', file=sys.stderr)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run_all(args) -> list:
+    """Каждая функция в своём процессе, результаты сливаются"""
+    results = []
+    for backend in BACKENDS:
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+            output = f.name
+        command = [
+            sys.executable, os.path.abspath(__file__), '--backend', backend, '--output', output,
+            '--schema', args.schema, '--modes', args.modes,
+            '--concurrency', ','.join(map(str, args.concurrency)),
+            '--requests', str(args.requests), '--warmup', str(args.warmup),
+            '--openai-latency', str(args.openai_latency), '--yandex-latency', str(args.yandex_latency)
+        ]
+        subprocess.run(command, check=True)
+        with open(output, encoding='utf-8') as f:
+            results.extend(json.load(f)['results'])
+        os.unlink(output)
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Изменение p50/p95/p99 и пропускной способности между двумя прогонами"""
+    def index(path):
+        with open(path, encoding='utf-8') as f:
+            return {(r['backend'], r['endpoint'], r['mode'], r['concurrency']): r for r in json.load(f)['results']}
+
+    old, new = index(old_path), index(new_path)
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        deltas = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'db_queries_per_request'):
+            if before[metric]:
+                change = (after[metric] - before[metric]) / before[metric] * 100
+                deltas.append(f'{metric}={after[metric]} ({change:+.1f}%)')
+            else:
+                deltas.append(f'{metric}={after[metric]}')
+        print(f"{'/'.join(map(str, key))}: {' '.join(deltas)}")
+    for key in sorted(old.keys() ^ new.keys()):
+        print(f"{'/'.join(map(str, key))}: только в {'старом' if key in old else 'новом'} прогоне")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон функций')
+    parser.add_argument('--backend', default='all', choices=('all',) + BACKENDS)
+    parser.add_argument('--endpoints', help='Сценарии через запятую, по умолчанию все')
+    parser.add_argument('--modes', default='inprocess,http')
+    parser.add_argument('--concurrency', default='1,8,32', type=lambda v: [int(x) for x in v.split(',')])
+    parser.add_argument('--requests', default=200, type=int, help='Запросов на сценарий и уровень параллельности')
+    parser.add_argument('--warmup', default=5, type=int)
+    parser.add_argument('--openai-latency', default=300.0, type=float, help='Задержка заглушки OpenAI, мс')
+    parser.add_argument('--yandex-latency', default=80.0, type=float, help='Задержка заглушки Яндекса, мс')
+    parser.add_argument('--schema', default='bench')
+    parser.add_argument('--seed-scans', default=200, type=int)
+    parser.add_argument('--setup', action='store_true', help='Пересоздать схему и тестовые данные')
+    parser.add_argument('--output', help='Файл для JSON с результатами')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.setup:
+        setup_database(args)
+        return
+
+    results = run_all(args) if args.backend == 'all' else run_backend(args)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'requests': args.requests,
+            'openai_latency_ms': args.openai_latency,
+            'yandex_latency_ms': args.yandex_latency,
+        },
+        'results': results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Локальная HTTP-обёртка над handler(event, context) в формате событий облачной функции
+"""
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import dbstats
+
+
+class HandlerServer:
+    """Принимает HTTP-запросы, собирает event, вызывает handler и отдаёт его ответ.
+    Число SQL-запросов за вызов передаётся клиенту заголовком X-Bench-Db-Queries"""
+
+    def __init__(self, handler):
+        target = handler
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                # Как шлюз: бинарные тела приходят в base64
+                binary = not (self.headers.get('Content-Type') or 'application/json').startswith(('application/json', 'text/'))
+                event = {
+                    'httpMethod': self.command,
+                    'path': url.path,
+                    'headers': dict(self.headers.items()),
+                    'queryStringParameters': dict(parse_qsl(url.query)),
+                    'body': base64.b64encode(body).decode() if binary else body.decode(),
+                    'isBase64Encoded': binary
+                }
+                dbstats.reset()
+                try:
+                    response = target(event, None)
+                except Exception as e:
+                    response = {'statusCode': 502, 'headers': {}, 'body': json.dumps({'error': str(e)})}
+                payload = response.get('body') or ''
+                if response.get('isBase64Encoded'):
+                    payload = base64.b64decode(payload)
+                payload = payload.encode() if isinstance(payload, str) else payload
+
+                self.send_response(response.get('statusCode', 200))
+                for name, value in (response.get('headers') or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('X-Bench-Db-Queries', str(dbstats.count()))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_OPTIONS = _dispatch
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self) -> int:
+        return self.server.server_port
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,121 @@
+"""
+Гонка первых входов: много потоков одновременно входят с одним телефоном (backend/auth)
+или одним кодом Яндекса (backend/yandex-oauth). В каждом раунде ожидается ровно один
+ответ 201, остальные 200 с тем же user_id и ни одного 500. Схема — из bench/run.py --setup:
+
+    DATABASE_URL=postgresql://localhost/bench python bench/run.py --setup
+    DATABASE_URL=... python bench/signin_race.py --threads 32 --rounds 20
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ('auth', 'yandex-oauth')
+
+
+def make_event(backend: str, key: str) -> dict:
+    if backend == 'auth':
+        body = {'phone': f'+7901{key}', 'first_name': 'Race', 'last_name': key}
+    else:
+        # Заглушка выдаёт yandex_id bench-<code>; телефон yandex_<id> укладывается в VARCHAR(20)
+        body = {'code': key}
+    return {'httpMethod': 'POST', 'headers': {}, 'queryStringParameters': {}, 'body': json.dumps(body)}
+
+
+def race(handler, event: dict, threads: int) -> list:
+    """Все потоки стартуют с барьера и вызывают handler с одним и тем же событием"""
+    barrier = threading.Barrier(threads)
+    results = [None] * threads
+
+    def worker(i):
+        barrier.wait()
+        response = handler(dict(event), None)
+        results[i] = (response['statusCode'], json.loads(response['body']))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return results
+
+
+def check(results: list) -> list:
+    """Нарушения ожиданий раунда"""
+    problems = []
+    statuses = Counter(status for status, _ in results)
+    if statuses.get(201, 0) != 1:
+        problems.append(f'ответов 201: {statuses.get(201, 0)}')
+    unexpected = {status: n for status, n in statuses.items() if status not in (200, 201)}
+    if unexpected:
+        errors = {body.get('error') for status, body in results if status not in (200, 201)}
+        problems.append(f'неожиданные статусы {unexpected}: {sorted(map(str, errors))}')
+    user_ids = {body.get('user_id') for status, body in results if status in (200, 201)}
+    if len(user_ids) > 1:
+        problems.append(f'разные user_id: {sorted(user_ids)}')
+    return problems
+
+
+def run_backend(args) -> int:
+    yandex_stub = stubs.start_yandex_stub(args.yandex_latency)
+    os.environ['MAIN_DB_SCHEMA'] = args.schema
+    os.environ['YANDEX_CLIENT_ID'] = 'bench'
+    os.environ['YANDEX_CLIENT_SECRET'] = 'bench'
+    os.environ['YANDEX_OAUTH_URL'] = yandex_stub.url
+    os.environ['YANDEX_LOGIN_URL'] = yandex_stub.url
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.threads))
+    os.environ.setdefault('DB_POOL_STATS_EVERY', '0')
+
+    sys.path.insert(0, os.path.join(ROOT, 'backend', args.backend))
+    handler = importlib.import_module('index').handler
+
+    run_id = f'{int(time.time()) % 100000:05d}'
+    failed = 0
+    for n in range(args.rounds):
+        results = race(handler, make_event(args.backend, f'{run_id}{n:02d}'), args.threads)
+        problems = check(results)
+        failed += bool(problems)
+        print(json.dumps({
+            'backend': args.backend, 'round': n, 'statuses': dict(Counter(status for status, _ in results)),
+            'problems': problems
+        }, ensure_ascii=False), file=sys.stderr)
+
+    yandex_stub.stop()
+    print(f'{args.backend}: раундов с ошибками {failed} из {args.rounds}', file=sys.stderr)
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='all', choices=('all',) + BACKENDS)
+    parser.add_argument('--threads', default=32, type=int, help='Одновременных входов в раунде')
+    parser.add_argument('--rounds', default=20, type=int, help='Раундов, у каждого свой новый телефон или код')
+    parser.add_argument('--yandex-latency', default=0.0, type=float, help='Задержка заглушки Яндекса, мс')
+    parser.add_argument('--schema', default='bench')
+    args = parser.parse_args()
+
+    if args.backend != 'all':
+        sys.exit(run_backend(args))
+
+    # У функций одинаковые имена модулей: каждая в своём процессе
+    code = 0
+    for backend in BACKENDS:
+        command = [
+            sys.executable, os.path.abspath(__file__), '--backend', backend, '--threads', str(args.threads),
+            '--rounds', str(args.rounds), '--yandex-latency', str(args.yandex_latency), '--schema', args.schema
+        ]
+        code |= subprocess.run(command).returncode
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Заглушки OpenAI и Яндекс OAuth для нагрузочных прогонов: настраиваемая задержка, keep-alive
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULT_ANALYSIS = {
+    'title': 'Яблоко',
+    'category': 'Фрукты',
+    'confidence': 93,
+    'description': 'Красное спелое яблоко на столе. Выглядит свежим и сочным.'
+}
+
+
+class StubServer:
+    """HTTP-сервер в фоновом потоке"""
+
+    def __init__(self, handler_class):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+
+def start_openai_stub(latency_ms: float = 0, analysis: dict = None) -> StubServer:
+    """/v1/chat/completions: обычный ответ или поток SSE, если stream=true"""
+    content = '```json\n' + json.dumps(analysis or DEFAULT_ANALYSIS, ensure_ascii=False) + '\n```'
+
+    class Handler(_JsonHandler):
+        def do_POST(self):
+            request = json.loads(self.read_body() or b'{}')
+            time.sleep(latency_ms / 1000)
+            if not request.get('stream'):
+                self.send_json(200, {'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(content), 8):
+                event = {'choices': [{'delta': {'content': content[i:i + 8]}}]}
+                self.send_chunk(b'data: ' + json.dumps(event, ensure_ascii=False).encode() + b'\n\n')
+            self.send_chunk(b'data: [DONE]\n\n')
+            self.send_chunk(b'')
+
+    return StubServer(Handler)
+
+
+def start_yandex_stub(latency_ms: float = 0) -> StubServer:
+    """/token меняет code на токен (code invalid* — ошибка 400), /info отдаёт пользователя, стабильного для кода"""
+
+    class Handler(_JsonHandler):
+        def do_POST(self):
+            fields = parse_qs(self.read_body().decode())
+            time.sleep(latency_ms / 1000)
+            code = fields.get('code', [''])[0]
+            if code.startswith('invalid'):
+                self.send_json(400, {'error': 'invalid_grant', 'error_description': 'Code has expired'})
+                return
+            self.send_json(200, {'access_token': f'token-{code}', 'token_type': 'bearer'})
+
+        def do_GET(self):
+            time.sleep(latency_ms / 1000)
+            if urlsplit(self.path).path != '/info':
+                self.send_json(404, {'error': 'not found'})
+                return
+            token = self.headers.get('Authorization', '').replace('OAuth ', '')
+            suffix = token.replace('token-', '')
+            self.send_json(200, {
+                'id': f'bench-{suffix}',
+                'default_email': f'{suffix}@bench.local',
+                'first_name': 'Bench',
+                'last_name': suffix
+            })
+
+    return StubServer(Handler)
@@ -0,0 +1,177 @@
+"""
+Проверка http_client против локальной заглушки: keep-alive, повторы на 5xx и Retry-After,
+ошибки 4xx без повторов, таймаут чтения, общий срок запроса и построчное чтение потока.
+
+    python -m unittest bench/test_http_client.py
+"""
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'scan'))
+
+import http_client  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Ответ выбирается по пути; каждое новое соединение и каждый запрос учитываются"""
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    connections = set()
+    failures = {}
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status: int, payload, headers: dict = None) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        StubHandler.requests.append((self.command, self.path, body))
+        StubHandler.connections.add(self.client_address)
+        if self.path.startswith('/flaky'):
+            # Первые N ответов — 503, затем 200
+            left = StubHandler.failures.get(self.path, 0)
+            if left:
+                StubHandler.failures[self.path] = left - 1
+                self.send_json(503, {'error': 'busy'}, {'Retry-After': '1' if self.path == '/flaky-wait' else '0'})
+                return
+            self.send_json(200, {'ok': True})
+        elif self.path == '/bad':
+            self.send_json(400, {'error': 'bad request'})
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            self.send_json(200, {'ok': True})
+        elif self.path.startswith('/drip'):
+            # Тело по байту: каждое чтение укладывается в таймаут, весь ответ — нет
+            body = b'x' * 10
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            if self.path == '/drip-close':
+                self.send_header('Connection', 'close')
+            self.end_headers()
+            for byte in body:
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+                time.sleep(0.05)
+        elif self.path == '/stream':
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for line in (b'data: 1\n', b'data: 2\n', b'data: [DONE]\n'):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_json(200, {'method': self.command, 'body': body.decode()})
+
+    do_GET = do_POST = handle_request
+
+
+class HttpClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        http_client.close_all()
+
+    def setUp(self):
+        http_client.close_all()
+        http_client.reset_metrics()
+        StubHandler.requests = []
+        StubHandler.connections = set()
+        StubHandler.failures = {}
+
+    def test_keep_alive_reuses_connection(self):
+        for _ in range(5):
+            self.assertEqual(http_client.get(f'{self.base}/ok').json()['method'], 'GET')
+        self.assertEqual(len(StubHandler.requests), 5)
+        self.assertEqual(len(StubHandler.connections), 1)
+
+    def test_post_json_and_form(self):
+        self.assertEqual(json.loads(http_client.post_json(f'{self.base}/echo', {'a': 1}).json()['body']), {'a': 1})
+        self.assertEqual(http_client.post_form(f'{self.base}/echo', {'code': 'x y'}).json()['body'], 'code=x+y')
+
+    def test_retries_on_503_then_succeeds(self):
+        StubHandler.failures['/flaky'] = 2
+        response = http_client.get(f'{self.base}/flaky', retries=2)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(StubHandler.requests), 3)
+        self.assertEqual(http_client.get_metrics()['127.0.0.1']['retries'], 2)
+
+    def test_gives_up_after_retries(self):
+        StubHandler.failures['/flaky'] = 5
+        with self.assertRaises(http_client.HttpError) as ctx:
+            http_client.get(f'{self.base}/flaky', retries=1)
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(len(StubHandler.requests), 2)
+
+    def test_client_error_is_not_retried(self):
+        with self.assertRaises(http_client.HttpError) as ctx:
+            http_client.get(f'{self.base}/bad', retries=2)
+        self.assertEqual(ctx.exception.status, 400)
+        self.assertEqual(len(StubHandler.requests), 1)
+
+    def test_read_timeout(self):
+        started = time.monotonic()
+        with self.assertRaises(http_client.UpstreamTimeout):
+            http_client.get(f'{self.base}/slow', retries=0, timeouts=(1.0, 0.1))
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_deadline_bounds_slow_body(self):
+        for path in ('/drip', '/drip-close'):
+            started = time.monotonic()
+            with self.assertRaises(http_client.UpstreamTimeout):
+                http_client.get(f'{self.base}{path}', retries=0, timeouts=(1.0, 1.0), deadline=time.monotonic() + 0.2)
+            self.assertLess(time.monotonic() - started, 0.35)
+        # Без deadline тот же ответ дочитывается: таймаут ограничивает только одно чтение
+        self.assertEqual(http_client.get(f'{self.base}/drip', retries=0, timeouts=(1.0, 1.0)).body, b'x' * 10)
+        self.assertEqual(
+            http_client.get(f'{self.base}/drip-close', retries=0, deadline=time.monotonic() + 5).body, b'x' * 10
+        )
+
+    def test_deadline_read_keeps_connection(self):
+        for _ in range(3):
+            self.assertEqual(http_client.get(f'{self.base}/ok', deadline=time.monotonic() + 5).json()['method'], 'GET')
+        self.assertEqual(len(StubHandler.connections), 1)
+
+    def test_deadline_stops_retries(self):
+        # Пауза Retry-After: 1 не укладывается в срок: ответ 503 отдаётся сразу, без сна
+        StubHandler.failures['/flaky-wait'] = 5
+        started = time.monotonic()
+        with self.assertRaises(http_client.HttpError) as ctx:
+            http_client.get(f'{self.base}/flaky-wait', retries=5, deadline=time.monotonic() + 0.5)
+        self.assertEqual(ctx.exception.status, 503)
+        self.assertEqual(len(StubHandler.requests), 1)
+        self.assertLess(time.monotonic() - started, 0.3)
+
+    def test_stream_lines(self):
+        lines = [line.strip() for line in http_client.stream_lines('GET', f'{self.base}/stream')]
+        self.assertEqual(lines, [b'data: 1', b'data: 2', b'data: [DONE]'])
+        # Дочитанный поток возвращает соединение в пул
+        http_client.get(f'{self.base}/ok')
+        self.assertEqual(len(StubHandler.connections), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
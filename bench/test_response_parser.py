@@ -0,0 +1,78 @@
+"""
+Проверка разбора ответа модели: обёртка ```json```, текст вокруг JSON, регистр категории,
+приведение уверенности к 0-100 и одна попытка починки.
+
+    python -m unittest bench/test_response_parser.py
+"""
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'scan'))
+
+from response_parser import ParseError, parse_analysis  # noqa: E402
+
+
+def parse_quietly(content: str, repair=None) -> dict:
+    """parse_analysis без строки лога об ошибке в выводе тестов"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return parse_analysis(content, repair)
+
+
+class ParseAnalysisTest(unittest.TestCase):
+    def test_plain_object(self):
+        result = parse_analysis('{"title": "Яблоко", "category": "Фрукты", "confidence": 90, "description": "Красное"}')
+        self.assertEqual(result, {'title': 'Яблоко', 'category': 'Фрукты', 'confidence': 90, 'description': 'Красное'})
+
+    def test_code_fences(self):
+        for content in (
+            '```json\n{"title": "Яблоко", "category": "Фрукты", "confidence": 90}\n```',
+            '```\n{"title": "Яблоко", "category": "Фрукты", "confidence": 90}\n```'
+        ):
+            self.assertEqual(parse_analysis(content)['title'], 'Яблоко')
+
+    def test_prose_around_json(self):
+        content = 'Вот результат: {"title": "Кошка", "category": "Животные", "confidence": 80} Надеюсь, помог {а это не JSON}'
+        self.assertEqual(parse_analysis(content)['category'], 'Животные')
+
+    def test_skips_braces_before_object(self):
+        content = 'Формат {title} ниже: {"title": "Стул", "category": "Мебель", "confidence": 70}'
+        self.assertEqual(parse_analysis(content)['title'], 'Стул')
+
+    def test_category_case_and_unknown(self):
+        self.assertEqual(parse_analysis('{"title": "Кот", "category": "  животные ", "confidence": 80}')['category'], 'Животные')
+        self.assertEqual(parse_analysis('{"title": "Кот", "category": "Коты", "confidence": 80}')['category'], 'Другое')
+        self.assertEqual(parse_analysis('{"title": "Кот", "category": 5, "confidence": 80}')['category'], 'Другое')
+
+    def test_confidence_clamped_and_defaulted(self):
+        def confidence(value: str) -> int:
+            return parse_analysis('{"title": "Кот", "category": "Животные", "confidence": %s}' % value)['confidence']
+        self.assertEqual(confidence('150'), 100)
+        self.assertEqual(confidence('-5'), 0)
+        self.assertEqual(confidence('87.6'), 88)
+        self.assertEqual(confidence('"95"'), 95)
+        self.assertEqual(confidence('"высокая"'), 50)
+        self.assertEqual(confidence('null'), 50)
+
+    def test_missing_title_fails(self):
+        with self.assertRaises(ParseError):
+            parse_quietly('{"title": "  ", "category": "Животные", "confidence": 80}')
+        with self.assertRaises(ParseError):
+            parse_quietly('Не удалось распознать объект')
+
+    def test_repair_called_once_on_failure(self):
+        calls = []
+
+        def repair(content: str) -> str:
+            calls.append(content)
+            return '{"title": "Кот", "category": "Животные", "confidence": 80}'
+        self.assertEqual(parse_quietly('{"title": "Кот", "category": ', repair)['title'], 'Кот')
+        self.assertEqual(len(calls), 1)
+        parse_quietly('{"title": "Кот", "category": "Животные", "confidence": 80}', repair)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
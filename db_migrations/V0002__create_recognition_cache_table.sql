@@ -0,0 +1,8 @@
+-- Кэш результатов распознавания по хэшу изображения
+CREATE TABLE IF NOT EXISTS recognition_cache (
+    cache_key VARCHAR(80) PRIMARY KEY,
+    result TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_recognition_cache_created_at ON recognition_cache(created_at);
@@ -0,0 +1,2 @@
+-- Перцептивный хэш кадра для поиска почти одинаковых сканирований
+ALTER TABLE scan_history ADD COLUMN IF NOT EXISTS phash BIGINT;
@@ -0,0 +1,21 @@
+-- Очередь асинхронных сканирований
+CREATE TABLE IF NOT EXISTS scan_jobs (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    image TEXT,
+    ai_responses_enabled BOOLEAN DEFAULT false,
+    title VARCHAR(255),
+    category VARCHAR(100),
+    confidence INTEGER,
+    ai_response TEXT,
+    error TEXT,
+    scan_id INTEGER REFERENCES scan_history(id),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_scan_jobs_pending ON scan_jobs(id) WHERE status IN ('pending', 'processing');
+CREATE INDEX IF NOT EXISTS idx_scan_jobs_user_id ON scan_jobs(user_id);
@@ -0,0 +1,5 @@
+-- Составной индекс для keyset-пагинации истории пользователя
+CREATE INDEX IF NOT EXISTS idx_scan_history_user_created_id ON scan_history(user_id, created_at DESC, id DESC);
+
+-- Покрывается префиксом составного индекса
+DROP INDEX IF EXISTS idx_scan_history_user_id;
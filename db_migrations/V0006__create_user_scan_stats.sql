@@ -0,0 +1,100 @@
+-- Инкрементальная статистика сканирований пользователя
+CREATE TABLE IF NOT EXISTS user_scan_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    total_scans BIGINT NOT NULL DEFAULT 0,
+    confidence_sum BIGINT NOT NULL DEFAULT 0,
+    confidence_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_category_stats (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    category VARCHAR(100) NOT NULL,
+    scans BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, category)
+);
+
+-- Обновление статистики в той же транзакции, что и вставка в историю
+CREATE OR REPLACE FUNCTION scan_history_stats_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO user_scan_stats AS s (user_id, total_scans, confidence_sum, confidence_count, updated_at)
+    SELECT user_id, COUNT(*), COALESCE(SUM(confidence), 0), COUNT(confidence), NOW()
+    FROM new_rows
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        total_scans = s.total_scans + EXCLUDED.total_scans,
+        confidence_sum = s.confidence_sum + EXCLUDED.confidence_sum,
+        confidence_count = s.confidence_count + EXCLUDED.confidence_count,
+        updated_at = NOW();
+
+    INSERT INTO user_category_stats AS c (user_id, category, scans)
+    SELECT user_id, COALESCE(category, 'Другое'), COUNT(*)
+    FROM new_rows
+    GROUP BY user_id, COALESCE(category, 'Другое')
+    ON CONFLICT (user_id, category) DO UPDATE SET scans = c.scans + EXCLUDED.scans;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+CREATE OR REPLACE FUNCTION scan_history_stats_delete() RETURNS trigger AS $$
+BEGIN
+    UPDATE user_scan_stats s SET
+        total_scans = s.total_scans - d.total_scans,
+        confidence_sum = s.confidence_sum - d.confidence_sum,
+        confidence_count = s.confidence_count - d.confidence_count,
+        updated_at = NOW()
+    FROM (
+        SELECT user_id, COUNT(*) AS total_scans, COALESCE(SUM(confidence), 0) AS confidence_sum, COUNT(confidence) AS confidence_count
+        FROM old_rows
+        GROUP BY user_id
+    ) d
+    WHERE s.user_id = d.user_id;
+
+    UPDATE user_category_stats c SET scans = c.scans - d.scans
+    FROM (
+        SELECT user_id, COALESCE(category, 'Другое') AS category, COUNT(*) AS scans
+        FROM old_rows
+        GROUP BY user_id, COALESCE(category, 'Другое')
+    ) d
+    WHERE c.user_id = d.user_id AND c.category = d.category;
+
+    DELETE FROM user_category_stats WHERE scans <= 0;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+DROP TRIGGER IF EXISTS trg_scan_history_stats_insert ON scan_history;
+CREATE TRIGGER trg_scan_history_stats_insert
+    AFTER INSERT ON scan_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION scan_history_stats_insert();
+
+DROP TRIGGER IF EXISTS trg_scan_history_stats_delete ON scan_history;
+CREATE TRIGGER trg_scan_history_stats_delete
+    AFTER DELETE ON scan_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION scan_history_stats_delete();
+
+-- Пересчёт статистики с нуля (бэкфилл и починка): SELECT rebuild_user_scan_stats(); или для одного пользователя
+CREATE OR REPLACE FUNCTION rebuild_user_scan_stats(p_user_id INTEGER DEFAULT NULL) RETURNS void AS $$
+BEGIN
+    DELETE FROM user_scan_stats WHERE p_user_id IS NULL OR user_id = p_user_id;
+    DELETE FROM user_category_stats WHERE p_user_id IS NULL OR user_id = p_user_id;
+
+    INSERT INTO user_scan_stats (user_id, total_scans, confidence_sum, confidence_count, updated_at)
+    SELECT user_id, COUNT(*), COALESCE(SUM(confidence), 0), COUNT(confidence), NOW()
+    FROM scan_history
+    WHERE p_user_id IS NULL OR user_id = p_user_id
+    GROUP BY user_id;
+
+    INSERT INTO user_category_stats (user_id, category, scans)
+    SELECT user_id, COALESCE(category, 'Другое'), COUNT(*)
+    FROM scan_history
+    WHERE p_user_id IS NULL OR user_id = p_user_id
+    GROUP BY user_id, COALESCE(category, 'Другое');
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+SELECT rebuild_user_scan_stats();
@@ -0,0 +1,3 @@
+-- Какой распознаватель дал результат и задержки по бэкендам
+ALTER TABLE scan_history ADD COLUMN IF NOT EXISTS recognizer VARCHAR(40);
+ALTER TABLE scan_history ADD COLUMN IF NOT EXISTS recognition_ms JSONB;
@@ -0,0 +1,10 @@
+-- Ключи повторных запросов сканирования: хэш кадра и Idempotency-Key клиента
+CREATE TABLE IF NOT EXISTS scan_requests (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    request_key VARCHAR(255) NOT NULL,
+    scan_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, request_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_scan_requests_created_at ON scan_requests(created_at);
@@ -0,0 +1,6 @@
+-- Token bucket для ограничения частоты сканирований: ведро на пользователя и общее
+CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+    bucket_key VARCHAR(100) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL
+);
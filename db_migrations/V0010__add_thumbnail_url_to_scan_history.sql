@@ -0,0 +1,2 @@
+-- Превью кадра для списка истории (image_url — нормализованный кадр)
+ALTER TABLE scan_history ADD COLUMN IF NOT EXISTS thumbnail_url TEXT;
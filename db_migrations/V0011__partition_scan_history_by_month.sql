@@ -0,0 +1,72 @@
+-- Помесячные секции истории сканирований по created_at.
+-- Старая таблица переименовывается, данные копируются в секционированную с тем же именем и id
+
+-- Ссылка на историю из очереди задач: внешний ключ на секционированную таблицу требует created_at в ключе,
+-- как и у scan_requests, связь держит приложение
+ALTER TABLE scan_jobs DROP CONSTRAINT IF EXISTS scan_jobs_scan_id_fkey;
+
+DROP TRIGGER IF EXISTS trg_scan_history_stats_insert ON scan_history;
+DROP TRIGGER IF EXISTS trg_scan_history_stats_delete ON scan_history;
+DROP INDEX IF EXISTS idx_scan_history_user_created_id;
+DROP INDEX IF EXISTS idx_scan_history_created_at;
+ALTER TABLE scan_history RENAME CONSTRAINT scan_history_pkey TO scan_history_legacy_pkey;
+ALTER TABLE scan_history RENAME TO scan_history_legacy;
+
+-- Ключ секционирования обязателен и входит в первичный ключ
+UPDATE scan_history_legacy SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+
+CREATE TABLE scan_history (
+    LIKE scan_history_legacy INCLUDING DEFAULTS,
+    PRIMARY KEY (id, created_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+) PARTITION BY RANGE (created_at);
+
+ALTER TABLE scan_history ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_scan_history_user_created_id ON scan_history(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_scan_history_created_at ON scan_history(created_at DESC);
+
+-- Секции помесячно от p_from до текущего месяца плюс p_months_ahead вперёд; число созданных.
+-- Секции по умолчанию нет: иначе планировщик не может читать секции по порядку created_at
+-- и останавливаться на свежих при LIMIT. Будущие секции создаёт задача обслуживания
+CREATE OR REPLACE FUNCTION create_scan_history_partitions(p_from DATE DEFAULT CURRENT_DATE, p_months_ahead INTEGER DEFAULT 3) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', LEAST(p_from, CURRENT_DATE))::DATE;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := 'scan_history_' || to_char(month_start, '"y"YYYY"m"MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF scan_history FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::DATE
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::DATE;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+-- Запас на год вперёд на случай, если задача обслуживания ещё не настроена
+SELECT create_scan_history_partitions(COALESCE((SELECT MIN(created_at)::DATE FROM scan_history_legacy), CURRENT_DATE), 12);
+
+-- Копирование до создания триггеров: агрегаты user_scan_stats уже учитывают эти строки
+INSERT INTO scan_history SELECT * FROM scan_history_legacy;
+
+ALTER SEQUENCE scan_history_id_seq OWNED BY scan_history.id;
+DROP TABLE scan_history_legacy;
+
+-- Триггеры статистики из V0006 на секционированной таблице: срабатывают на уровне оператора для всех секций
+CREATE TRIGGER trg_scan_history_stats_insert
+    AFTER INSERT ON scan_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION scan_history_stats_insert();
+
+CREATE TRIGGER trg_scan_history_stats_delete
+    AFTER DELETE ON scan_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION scan_history_stats_delete();
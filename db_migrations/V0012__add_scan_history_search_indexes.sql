@@ -0,0 +1,7 @@
+-- Полнотекстовый поиск по названию и ответу ИИ с русской морфологией.
+-- Выражение должно совпадать с search.SEARCH_DOCUMENT в backend/scan, иначе индекс не используется
+CREATE INDEX IF NOT EXISTS idx_scan_history_search ON scan_history
+    USING GIN (to_tsvector('russian', coalesce(title, '') || ' ' || coalesce(ai_response, '')));
+
+-- Фильтр по категории: страница читается по индексу в порядке keyset-пагинации
+CREATE INDEX IF NOT EXISTS idx_scan_history_user_category ON scan_history(user_id, category, created_at DESC, id DESC);
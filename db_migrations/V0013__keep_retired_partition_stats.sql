@@ -0,0 +1,82 @@
+-- Статистика секций истории, выведенных задачей retention.
+-- user_scan_stats остаётся за всё время, а строк старых месяцев в scan_history уже нет:
+-- без этих итогов rebuild_user_scan_stats() урезал бы статистику до хранимого окна
+CREATE TABLE IF NOT EXISTS scan_history_retired_stats (
+    partition_name VARCHAR(63) NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    category VARCHAR(100) NOT NULL,
+    scans BIGINT NOT NULL DEFAULT 0,
+    confidence_sum BIGINT NOT NULL DEFAULT 0,
+    confidence_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (partition_name, user_id, category)
+);
+
+-- Итоги секции пишутся до отсоединения; пока секция ещё присоединена (отсоединение не удалось
+-- или не завершено), её строки считаются по scan_history, а не отсюда
+CREATE OR REPLACE FUNCTION scan_history_partition_attached(p_name TEXT) RETURNS BOOLEAN AS $$
+    SELECT EXISTS (
+        SELECT 1
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'scan_history'::regclass AND c.relname = p_name AND NOT i.inhdetachpending
+    );
+$$ LANGUAGE sql STABLE SET search_path FROM CURRENT;
+
+-- Пересчёт статистики с нуля (бэкфилл и починка): строки scan_history плюс итоги выведенных секций
+CREATE OR REPLACE FUNCTION rebuild_user_scan_stats(p_user_id INTEGER DEFAULT NULL) RETURNS void AS $$
+BEGIN
+    DELETE FROM user_scan_stats WHERE p_user_id IS NULL OR user_id = p_user_id;
+    DELETE FROM user_category_stats WHERE p_user_id IS NULL OR user_id = p_user_id;
+
+    INSERT INTO user_scan_stats (user_id, total_scans, confidence_sum, confidence_count, updated_at)
+    SELECT user_id, SUM(scans), SUM(confidence_sum), SUM(confidence_count), NOW()
+    FROM (
+        SELECT user_id, COUNT(*) AS scans, COALESCE(SUM(confidence), 0) AS confidence_sum, COUNT(confidence) AS confidence_count
+        FROM scan_history
+        WHERE p_user_id IS NULL OR user_id = p_user_id
+        GROUP BY user_id
+        UNION ALL
+        SELECT user_id, scans, confidence_sum, confidence_count
+        FROM scan_history_retired_stats
+        WHERE (p_user_id IS NULL OR user_id = p_user_id) AND NOT scan_history_partition_attached(partition_name)
+    ) t
+    GROUP BY user_id;
+
+    INSERT INTO user_category_stats (user_id, category, scans)
+    SELECT user_id, category, SUM(scans)
+    FROM (
+        SELECT user_id, COALESCE(category, 'Другое') AS category, COUNT(*) AS scans
+        FROM scan_history
+        WHERE p_user_id IS NULL OR user_id = p_user_id
+        GROUP BY user_id, COALESCE(category, 'Другое')
+        UNION ALL
+        SELECT user_id, category, scans
+        FROM scan_history_retired_stats
+        WHERE (p_user_id IS NULL OR user_id = p_user_id) AND NOT scan_history_partition_attached(partition_name)
+    ) t
+    GROUP BY user_id, category;
+END;
+$$ LANGUAGE plpgsql SET search_path FROM CURRENT;
+
+-- Секции, уже отсоединённые без хранилища, лежат рядом как scan_history_archive_yYYYYmMM: их итоги берутся оттуда.
+-- Строк секций, выгруженных в архив и удалённых до этой миграции, в базе нет — rebuild их не вернёт
+DO $$
+DECLARE
+    archive_name TEXT;
+BEGIN
+    FOR archive_name IN
+        SELECT c.relname
+        FROM pg_class c
+        WHERE c.relnamespace = current_schema()::regnamespace AND c.relkind = 'r'
+          AND c.relname ~ '^scan_history_archive_y[0-9]{4}m[0-9]{2}$'
+    LOOP
+        EXECUTE format(
+            'INSERT INTO scan_history_retired_stats (partition_name, user_id, category, scans, confidence_sum, confidence_count) '
+            'SELECT %L, user_id, COALESCE(category, ''Другое''), COUNT(*), COALESCE(SUM(confidence), 0), COUNT(confidence) '
+            'FROM %I GROUP BY user_id, COALESCE(category, ''Другое'') '
+            'ON CONFLICT (partition_name, user_id, category) DO NOTHING',
+            replace(archive_name, 'scan_history_archive_', 'scan_history_'), archive_name
+        );
+    END LOOP;
+END;
+$$;
@@ -20,11 +20,24 @@ interface HomeProps {
 const API_SCAN = 'https://functions.poehali.dev/9cef3444-65a0-416d-8301-2e9dffbc4367';
 const API_YANDEX = 'https://functions.poehali.dev/067eda8a-b33a-43d3-8354-a1ddf3bf5466';
 
+type CaptureQuality = 'fast' | 'standard' | 'max';
+
+const CAPTURE_PRESETS: Record<CaptureQuality, { label: string; maxSide: number; jpegQuality: number }> = {
+  fast: { label: 'Быстро', maxSide: 640, jpegQuality: 0.7 },
+  standard: { label: 'Стандарт', maxSide: 1024, jpegQuality: 0.8 },
+  max: { label: 'Максимум', maxSide: 2048, jpegQuality: 0.9 }
+};
+
 const Home = ({ onNavigate, user }: HomeProps) => {
   const [history, setHistory] = useState<any[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [stats, setStats] = useState({ total_scans: 0, average_confidence: 0 });
   const [showCamera, setShowCamera] = useState(false);
   const [scanning, setScanning] = useState(false);
+  const [captureQuality, setCaptureQuality] = useState<CaptureQuality>(
+    (localStorage.getItem('captureQuality') as CaptureQuality) || 'standard'
+  );
   const videoRef = useRef<HTMLVideoElement>(null);
   const canvasRef = useRef<HTMLCanvasElement>(null);
   const { toast } = useToast();
@@ -40,6 +53,7 @@ const Home = ({ onNavigate, user }: HomeProps) => {
       
       if (response.ok) {
         setHistory(data.scans || []);
+        setNextCursor(data.next_cursor || null);
         setStats({
           total_scans: data.total_scans || 0,
           average_confidence: data.average_confidence || 0
@@ -50,11 +64,32 @@ const Home = ({ onNavigate, user }: HomeProps) => {
     }
   };
 
+  const loadMoreHistory = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await fetch(`${API_SCAN}?user_id=${user.user_id}&cursor=${encodeURIComponent(nextCursor)}`);
+      const data = await response.json();
+
+      if (response.ok) {
+        setHistory(prev => [...prev, ...(data.scans || [])]);
+        setNextCursor(data.next_cursor || null);
+      }
+    } catch (error) {
+      console.error('Error loading history:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const openCamera = async () => {
     setShowCamera(true);
     try {
       const stream = await navigator.mediaDevices.getUserMedia({ 
-        video: { facingMode: 'environment' } 
+        video: {
+          facingMode: 'environment',
+          width: { ideal: CAPTURE_PRESETS[captureQuality].maxSide }
+        }
       });
       if (videoRef.current) {
         videoRef.current.srcObject = stream;
@@ -84,23 +119,32 @@ const Home = ({ onNavigate, user }: HomeProps) => {
     const canvas = canvasRef.current;
     const video = videoRef.current;
     
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
+    // Уменьшаем кадр до выбранного размера ещё на телефоне
+    const preset = CAPTURE_PRESETS[captureQuality];
+    const scale = Math.min(1, preset.maxSide / Math.max(video.videoWidth, video.videoHeight));
+    canvas.width = Math.round(video.videoWidth * scale);
+    canvas.height = Math.round(video.videoHeight * scale);
     const ctx = canvas.getContext('2d');
     if (!ctx) return;
 
-    ctx.drawImage(video, 0, 0);
-    const imageBase64 = canvas.toDataURL('image/jpeg').split(',')[1];
+    ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+    // Кадр уходит бинарным телом image/jpeg: без base64 он на треть меньше
+    const image = await new Promise<Blob | null>((resolve) => canvas.toBlob(resolve, 'image/jpeg', preset.jpegQuality));
+    if (!image) {
+      setScanning(false);
+      return;
+    }
+
+    // Один ключ на кадр: повтор после обрыва сети вернёт тот же scan_id
+    const idempotencyKey = crypto.randomUUID();
+    const sendScan = () => fetch(`${API_SCAN}?user_id=${user.user_id}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'image/jpeg', 'Idempotency-Key': idempotencyKey },
+      body: image
+    });
 
     try {
-      const response = await fetch(API_SCAN, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          user_id: user.user_id,
-          image: imageBase64
-        })
-      });
+      const response = await sendScan().catch(() => sendScan());
 
       const data = await response.json();
 
@@ -129,6 +173,11 @@ const Home = ({ onNavigate, user }: HomeProps) => {
     }
   };
 
+  const changeCaptureQuality = (quality: CaptureQuality) => {
+    setCaptureQuality(quality);
+    localStorage.setItem('captureQuality', quality);
+  };
+
   const connectYandex = async () => {
     try {
       const response = await fetch(API_YANDEX);
@@ -237,12 +286,21 @@ const Home = ({ onNavigate, user }: HomeProps) => {
               <Card 
                 key={item.id}
                 className="bg-slate-900/60 border-slate-700/50 backdrop-blur-lg p-4 hover-scale cursor-pointer animate-fade-in"
-                style={{ animationDelay: `${index * 100}ms` }}
+                style={{ animationDelay: `${Math.min(index, 9) * 100}ms` }}
               >
                 <div className="flex items-center gap-4">
-                  <div className="bg-gradient-to-br from-purple-500 to-pink-500 p-3 rounded-2xl">
-                    <Icon name="Camera" className="text-white" size={24} />
-                  </div>
+                  {item.thumbnail_url ? (
+                    <img
+                      src={item.thumbnail_url}
+                      alt={item.title}
+                      loading="lazy"
+                      className="w-12 h-12 rounded-2xl object-cover"
+                    />
+                  ) : (
+                    <div className="bg-gradient-to-br from-purple-500 to-pink-500 p-3 rounded-2xl">
+                      <Icon name="Camera" className="text-white" size={24} />
+                    </div>
+                  )}
                   <div className="flex-1">
                     <h3 className="text-white font-semibold mb-1">{item.title}</h3>
                     <div className="flex items-center gap-2 text-xs">
@@ -262,6 +320,20 @@ const Home = ({ onNavigate, user }: HomeProps) => {
                 </div>
               </Card>
             ))}
+            {nextCursor && (
+              <Button
+                variant="ghost"
+                onClick={loadMoreHistory}
+                disabled={loadingMore}
+                className="w-full text-purple-300 hover:text-purple-200"
+              >
+                {loadingMore ? (
+                  <Icon name="Loader2" className="animate-spin" size={20} />
+                ) : (
+                  'Показать ещё'
+                )}
+              </Button>
+            )}
           </div>
         )}
       </div>
@@ -279,6 +351,19 @@ const Home = ({ onNavigate, user }: HomeProps) => {
               className="w-full rounded-lg bg-black"
             />
             <canvas ref={canvasRef} className="hidden" />
+            <div className="flex gap-2">
+              {(Object.keys(CAPTURE_PRESETS) as CaptureQuality[]).map((quality) => (
+                <Button
+                  key={quality}
+                  variant="ghost"
+                  size="sm"
+                  onClick={() => changeCaptureQuality(quality)}
+                  className={`flex-1 ${captureQuality === quality ? 'bg-purple-500/30 text-white' : 'text-slate-400'}`}
+                >
+                  {CAPTURE_PRESETS[quality].label}
+                </Button>
+              ))}
+            </div>
             <Button
               onClick={captureAndScan}
               disabled={scanning}
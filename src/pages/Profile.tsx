@@ -33,6 +33,8 @@ const Profile = ({ onNavigate, user, onLogout }: ProfileProps) => {
   const { toast } = useToast();
   const [aiResponsesEnabled, setAiResponsesEnabled] = useState(user.ai_responses_enabled || false);
   const [stats, setStats] = useState({ total_scans: 0, average_confidence: 0 });
+  const [categories, setCategories] = useState<{ category: string; count: number }[]>([]);
+  const [recentScans, setRecentScans] = useState<any[]>([]);
 
   useEffect(() => {
     loadStats();
@@ -40,7 +42,7 @@ const Profile = ({ onNavigate, user, onLogout }: ProfileProps) => {
 
   const loadStats = async () => {
     try {
-      const response = await fetch(`${API_SCAN}?user_id=${user.user_id}`);
+      const response = await fetch(`${API_SCAN}?user_id=${user.user_id}&limit=6`);
       const data = await response.json();
       
       if (response.ok) {
@@ -48,6 +50,8 @@ const Profile = ({ onNavigate, user, onLogout }: ProfileProps) => {
           total_scans: data.total_scans || 0,
           average_confidence: data.average_confidence || 0
         });
+        setCategories(data.categories || []);
+        setRecentScans(data.scans || []);
       }
     } catch (error) {
       console.error('Error loading stats:', error);
@@ -180,6 +184,58 @@ const Profile = ({ onNavigate, user, onLogout }: ProfileProps) => {
           </Card>
         </div>
 
+        {categories.length > 0 && (
+          <Card className="bg-slate-900/60 border-slate-700/50 backdrop-blur-lg p-4 mb-6 animate-fade-in" style={{ animationDelay: '200ms' }}>
+            <p className="text-white font-semibold mb-3">По категориям</p>
+            <div className="space-y-3">
+              {categories.map((item) => (
+                <div key={item.category}>
+                  <div className="flex items-center justify-between text-sm mb-1">
+                    <span className="text-slate-300">{item.category}</span>
+                    <span className="text-slate-400">{item.count}</span>
+                  </div>
+                  <div className="h-2 rounded-full bg-slate-800">
+                    <div
+                      className="h-2 rounded-full bg-gradient-to-r from-purple-500 to-pink-500"
+                      style={{ width: `${stats.total_scans ? Math.round((item.count / stats.total_scans) * 100) : 0}%` }}
+                    />
+                  </div>
+                </div>
+              ))}
+            </div>
+          </Card>
+        )}
+
+        {recentScans.length > 0 && (
+          <Card className="bg-slate-900/60 border-slate-700/50 backdrop-blur-lg p-4 mb-6 animate-fade-in" style={{ animationDelay: '300ms' }}>
+            <div className="flex items-center justify-between mb-3">
+              <p className="text-white font-semibold">Последние сканирования</p>
+              <a
+                href={`${API_SCAN}?user_id=${user.user_id}&export=csv`}
+                download
+                className="flex items-center gap-1 text-purple-300 text-sm"
+              >
+                <Icon name="Download" size={16} />
+                CSV
+              </a>
+            </div>
+            <div className="grid grid-cols-3 gap-2">
+              {recentScans.map((item) => (
+                <div key={item.id} className="relative aspect-square rounded-xl overflow-hidden bg-slate-800">
+                  {item.thumbnail_url ? (
+                    <img src={item.thumbnail_url} alt={item.title} loading="lazy" className="w-full h-full object-cover" />
+                  ) : (
+                    <div className="w-full h-full flex items-center justify-center bg-gradient-to-br from-purple-500/40 to-pink-500/40">
+                      <Icon name="Camera" className="text-white/70" size={24} />
+                    </div>
+                  )}
+                  <span className="absolute bottom-0 inset-x-0 bg-black/60 text-white text-xs px-2 py-1 truncate">{item.title}</span>
+                </div>
+              ))}
+            </div>
+          </Card>
+        )}
+
         <h3 className="text-white font-bold mb-3">Настройки</h3>
         
         <Card className="bg-slate-900/60 border-slate-700/50 backdrop-blur-lg p-4 mb-3 animate-fade-in">